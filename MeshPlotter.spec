@@ -1,4 +1,11 @@
 # -*- mode: python ; coding: utf-8 -*-
+import sys
+
+sys.path.insert(0, SPECPATH)
+import webassets  # noqa: E402
+
+# asset hashati e precompressi in static/dist, inclusi nel bundle con static/
+webassets.build('static')
 
 
 a = Analysis(
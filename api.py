@@ -1,12 +1,22 @@
-import json
+import asyncio
+import contextvars
+import functools
+import inspect
+import itertools
 import os
 import sqlite3
+import struct
+import sys
 import time
+import zlib
+from array import array
 from contextlib import asynccontextmanager
-from typing import Any, Dict, List, Optional, Tuple
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 from fastapi import Body, FastAPI, Query, Request
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from fastapi.responses import JSONResponse as _StdJSONResponse
 from fastapi.staticfiles import StaticFiles
 try:
     from fastapi.middleware.cors import CORSMiddleware
@@ -14,22 +24,115 @@ try:
 except Exception:  # pragma: no cover - middleware non disponibile
     HAVE_CORS = False
 
-from config import ALLOW_CORS, UNITS, POWER_V_KEYS, POWER_I_KEYS, TRACEROUTE_TTL
-from database import DB, DB_LOCK
+import backup
+import coldstore
+import compress
+import config
+import dbexec
+import downsample as _downsample
+import estimator
+import events
+import export
+import fastjson
+import instrument
+import maintenance
+import mapcluster
+import respcache
+import sqlconsole
+import topology
+import tsblock
+import webassets
+from database import ROLLUP_BUCKET_S, Storage, get_storage, set_storage
 from mqtt_client import start_mqtt
+from processing import metric_family
 
 from paho.mqtt.client import Client as MQTTClient
 
 mqtt_client_ref: Optional[MQTTClient] = None
+# creati alla prima richiesta (vedi _executor e _cache): ``import api`` non legge config.yml
+_db: Optional[dbexec.DBExecutor] = None
+_response_cache: Optional[respcache.ResponseCache] = None
+_response_cache_ready = False
+
+
+def _executor() -> dbexec.DBExecutor:
+    """Executor DB con i limiti di ``web.db_executor``."""
+    global _db
+    if _db is None:
+        _db = dbexec.DBExecutor(dbexec.parse_limits(config.DB_EXECUTOR))
+    return _db
+
+
+def _cache() -> Optional[respcache.ResponseCache]:
+    """Cache delle risposte, ``None`` se ``web.response_cache_mb`` è 0."""
+    global _response_cache, _response_cache_ready
+    if not _response_cache_ready:
+        mb = config.RESPONSE_CACHE_MB
+        _response_cache = respcache.ResponseCache(int(mb * 1024 * 1024)) if mb > 0 else None
+        _response_cache_ready = True
+    return _response_cache
+
+
+# ``(tables, key, headers)`` calcolati da ``_db_route`` per la richiesta in corso
+_Validated = Tuple[Tuple[str, ...], Tuple[Any, ...], Dict[str, str]]
+_VALIDATED: "contextvars.ContextVar[Optional[_Validated]]" = contextvars.ContextVar("_VALIDATED", default=None)
+
+
+def _db_route(kind: str, etag: Optional[Callable[..., Any]] = None):
+    """Rende async un handler sincrono eseguendolo nell'executor DB (classe ``kind``).
+
+    La firma resta quella originale, così FastAPI ne ricava i parametri.
+    ``etag`` riceve gli argomenti dell'handler e restituisce ``(tables, key,
+    window)`` per :func:`_validators`, o ``None`` se i parametri non sono
+    validi: una richiesta condizionale ancora valida riceve 304 qui, senza
+    attendere in coda né ricevere 503 dall'executor. Altrimenti l'handler
+    ritrova gli stessi validatori con :func:`_validated`.
+    """
+
+    def decorate(fn):
+        sig = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def handler(*args, **kwargs):
+            validated = None
+            if etag is not None:
+                bound = sig.bind(*args, **kwargs)
+                bound.apply_defaults()
+                spec = etag(**bound.arguments)
+                if spec is not None:
+                    key, headers = _validators(*spec)
+                    cached = _not_modified(kwargs.get("request"), headers)
+                    if cached is not None:
+                        return cached
+                    validated = (spec[0], key, headers)
+            _VALIDATED.set(validated)
+            try:
+                # il contesto copiato porta ``_VALIDATED`` nel thread dell'executor
+                return await _executor().run(kind, contextvars.copy_context().run, fn, *args, **kwargs)
+            except dbexec.Overloaded as e:
+                return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "1"})
+
+        return handler
+
+    return decorate
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global mqtt_client_ref
-    mqtt_client_ref = start_mqtt()
+    storage = get_storage()
+    app.state.storage = storage
+    storage.start_backfills()
+    coldstore.start_archiver(storage, config.COLD_AFTER_DAYS)
+    if config.COMPRESSION == "gorilla":
+        tsblock.start_compactor(storage)
+    app.state.maintenance = maintenance.start_maintenance(storage, config.MAINTENANCE)
+    mqtt_client_ref = start_mqtt(storage)
     try:
         yield
     finally:
+        if app.state.maintenance:
+            app.state.maintenance.stop()
         try:
             if mqtt_client_ref:
                 mqtt_client_ref.loop_stop()
@@ -41,156 +144,261 @@ async def lifespan(app: FastAPI):
         except Exception:
             pass
         try:
-            DB.close()
+            storage.close()
         except Exception:
             pass
+        app.state.storage = None
+        set_storage(None)
+        if _db is not None:
+            _db.shutdown()
+
+
+class JSONResponse(_StdJSONResponse):
+    """``JSONResponse`` serializzata con ``fastjson`` (orjson se disponibile)."""
+
+    def render(self, content: Any) -> bytes:
+        return fastjson.dumps_bytes(content)
+
+
+def _cors(app):
+    if config.ALLOW_CORS and HAVE_CORS:
+        return CORSMiddleware(app, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+    return app
 
 
-app = FastAPI(title="Meshtastic Telemetry (embedded UI)", lifespan=lifespan)
-if ALLOW_CORS and HAVE_CORS:
-    app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+def _compression(app):
+    return compress.CompressionMiddleware(app, **compress.parse_options(config.HTTP_COMPRESSION))
+
+
+app = FastAPI(title="Meshtastic Telemetry (embedded UI)", lifespan=lifespan, default_response_class=JSONResponse)
+# fabbriche chiamate da Starlette alla costruzione dello stack, cioè al primo
+# evento ASGI: le opzioni si leggono da config solo allora
+app.add_middleware(_cors)
+app.add_middleware(_compression)
+# più esterno: la durata comprende anche la compressione
+app.add_middleware(instrument.HTTPMetricsMiddleware)
+
+
+def _storage() -> Storage:
+    """Storage dell'app: quello creato nel ``lifespan`` o, in sua assenza, il predefinito."""
+    return getattr(app.state, "storage", None) or get_storage()
+
+
+def __getattr__(name: str) -> Any:
+    # compatibilità: ``api.DB`` / ``api.DB_LOCK`` puntano allo storage in uso
+    if name == "DB":
+        return _storage().conn
+    if name == "DB_LOCK":
+        return _storage().lock
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
+_assets = webassets.AssetStore("static")
+
+
+def _page(request: Optional[Request], name: str) -> Response:
+    """Pagina HTML con i riferimenti agli asset hashati e una breve durata in cache."""
+    body, etag = _assets.page(name)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={config.HTML_MAX_AGE}"}
+    if request is not None:
+        tags = {t.strip() for t in request.headers.get("if-none-match", "").split(",")}
+        if etag in tags or f"W/{etag}" in tags:
+            return Response(status_code=304, headers=headers)
+    return Response(body, media_type="text/html; charset=utf-8", headers=headers)
+
+
+@app.get("/assets/{filename}", include_in_schema=False)
+async def asset(filename: str, request: Request = None):
+    """Asset con nome hashato: immutabile, precompresso se il client lo accetta."""
+    accept = request.headers.get("accept-encoding", "") if request is not None else ""
+    found = _assets.lookup(filename, accept)
+    if found is None:
+        return JSONResponse({"error": "not found"}, status_code=404)
+    path, media_type, encoding = found
+    headers = {"Cache-Control": webassets.IMMUTABLE, "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return FileResponse(path, media_type=media_type, headers=headers)
 
 
 @app.get("/favicon.ico", include_in_schema=False)
-def favicon():
+async def favicon():
     """Serve the browser favicon."""
-    return FileResponse(os.path.join("static", "favicon.svg"), media_type="image/svg+xml")
+    return FileResponse(
+        os.path.join("static", "favicon.svg"),
+        media_type="image/svg+xml",
+        headers={"Cache-Control": "public, max-age=86400"},
+    )
 
 
 @app.get("/")
-def ui():
-    return FileResponse(os.path.join("static", "index.html"))
+async def ui(request: Request = None):
+    return _page(request, "index.html")
 
 
 @app.get("/map")
-def map_ui():
-    return FileResponse(os.path.join("static", "map.html"))
+async def map_ui(request: Request = None):
+    return _page(request, "map.html")
 
 
 @app.get("/traceroutes")
-def traceroutes_ui():
-    return FileResponse(os.path.join("static", "traceroutes.html"))
+async def traceroutes_ui(request: Request = None):
+    return _page(request, "traceroutes.html")
 
 
 @app.get("/admin")
-def admin_ui():
-    return FileResponse(os.path.join("static", "admin.html"))
+async def admin_ui(request: Request = None):
+    return _page(request, "admin.html")
 
 
 @app.get("/setup")
-def setup_ui():
-    return FileResponse(os.path.join("static", "setup.html"))
+async def setup_ui(request: Request = None):
+    return _page(request, "setup.html")
 
 
-def _estimate_missing_positions(nodes: List[Dict[str, Any]]) -> None:
-    """Assign estimated coordinates to nodes lacking a position.
+def _parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    """``"min_lon,min_lat,max_lon,max_lat"`` (come ``toBBoxString()`` di Leaflet)."""
+    parts = [float(p) for p in bbox.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+    min_lon, min_lat, max_lon, max_lat = parts
+    if min_lat > max_lat:
+        raise ValueError("bbox min_lat > max_lat")
+    return min_lon, min_lat, max_lon, max_lat
 
-    Nodes that have no ``lat``/``lon`` values but appear in traceroute paths
-    alongside nodes with known coordinates will be placed near or between those
-    neighbours:
 
-    * if only a single neighbour has a known position, the node is placed just
-      offset from that neighbour's location;
-    * if two or more neighbours have known positions, the node is centred
-      amongst them (average latitude/longitude).
+def _validators(
+    tables: Tuple[str, ...], key: Tuple[Any, ...], window: int = 0
+) -> Tuple[Tuple[Any, ...], Dict[str, str]]:
+    """Chiave normalizzata e header ``ETag``/``Last-Modified`` di una risposta.
 
-    The function mutates the ``nodes`` list in place.
+    L'ETag combina l'istanza dello storage, la somma delle versioni delle
+    tabelle ``tables`` (vedi :meth:`Storage.touch`) e i parametri ``key``; non
+    serve interrogare SQLite. Con ``window`` (secondi) entra nella chiave anche
+    l'intervallo di tempo corrente, per le risposte relative a "adesso".
     """
-
-    known_pos = {
-        n["node_id"]: (n["lat"], n["lon"], n.get("alt"))
-        for n in nodes
-        if n.get("lat") is not None and n.get("lon") is not None
+    storage = _storage()
+    version, modified = storage.data_version(tables)
+    if window:
+        bucket = int(time.time()) // window
+        key = (*key, bucket)
+        modified = max(modified, bucket * window)
+    tag = zlib.crc32(repr(key).encode("utf-8"))
+    return key, {
+        "ETag": f'W/"{storage.epoch}-{version}-{tag:08x}"',
+        "Last-Modified": formatdate(modified, usegmt=True),
+        # il browser tiene la copia ma la rivalida a ogni uso
+        "Cache-Control": "no-cache",
     }
-    unknown = [n for n in nodes if n.get("lat") is None or n.get("lon") is None]
-    if not unknown:
-        return
-
-    with DB_LOCK:
-        cur = DB.execute("SELECT src_id, dest_id, route FROM traceroutes")
-        raw_routes = cur.fetchall()
-
-    routes: List[List[str]] = []
-    for src, dest, rjson in raw_routes:
-        path: List[str] = []
-        if src:
-            path.append(src)
-        if rjson:
-            try:
-                path.extend(json.loads(rjson))
-            except Exception:
-                pass
-        if dest and dest not in path:
-            path.append(dest)
-        if len(path) >= 2:
-            routes.append(path)
-
-    updates: List[Tuple[float, float, Optional[float], str]] = []
-    for node in unknown:
-        nid = node["node_id"]
-        neighbours: set[str] = set()
-        for route in routes:
-            if nid in route:
-                for other in route:
-                    if other != nid and other in known_pos:
-                        neighbours.add(other)
-
-        if not neighbours:
-            continue
 
-        if len(neighbours) == 1:
-            lat, lon, alt = known_pos[next(iter(neighbours))]
-            offset = 0.001
-            node["lat"] = lat + offset
-            node["lon"] = lon + offset
-            if node.get("alt") is None and alt is not None:
-                node["alt"] = alt
-        else:
-            lats = [known_pos[n][0] for n in neighbours]
-            lons = [known_pos[n][1] for n in neighbours]
-            alts = [known_pos[n][2] for n in neighbours if known_pos[n][2] is not None]
-            node["lat"] = sum(lats) / len(lats)
-            node["lon"] = sum(lons) / len(lons)
-            if alts and node.get("alt") is None:
-                node["alt"] = sum(alts) / len(alts)
-
-
-        updates.append((node["lat"], node["lon"], node.get("alt"), nid))
-
-    if updates:
-        with DB_LOCK:
-            DB.executemany(
-                "UPDATE nodes SET lat=?, lon=?, alt=?, pos_ts=COALESCE(pos_ts,0) WHERE node_id=?",
-                updates,
-            )
-            DB.commit()
 
+def _validated() -> _Validated:
+    """``(tables, key, headers)`` calcolati da :func:`_db_route` per la richiesta in corso."""
+    validated = _VALIDATED.get()
+    if validated is None:
+        raise RuntimeError("validatori assenti: handler senza etag o parametri non validi")
+    return validated
 
 
-@app.get("/api/nodes")
-def api_nodes(include_inactive: bool = Query(default=True)):
+def _not_modified(request: Optional[Request], headers: Dict[str, str]) -> Optional[Response]:
+    """Risposta 304 se il client ha già la versione descritta da ``headers``."""
+    if request is None:
+        return None
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        tags = {t.strip() for t in inm.split(",")}
+        # confronto debole: ``W/"x"`` e ``"x"`` indicano la stessa versione
+        weak = headers["ETag"][2:]
+        if "*" in tags or headers["ETag"] in tags or weak in tags:
+            return Response(status_code=304, headers=headers)
+        return None
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            since = parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return None
+        if int(parsedate_to_datetime(headers["Last-Modified"]).timestamp()) <= since:
+            return Response(status_code=304, headers=headers)
+    return None
+
+
+def _computed(res: Response, node_ids: Optional[List[str]] = None) -> respcache.Computed:
+    return respcache.Computed(res.body, res.media_type, res.status_code, node_ids)
+
+
+def _respond(
+    key: Tuple[Any, ...],
+    tables: Tuple[str, ...],
+    compute: Callable[[], respcache.Computed],
+    headers: Dict[str, str],
+) -> Response:
+    """Esegue ``compute`` passando dalla cache delle risposte, se attiva."""
+    cache = _cache()
+    if cache is not None:
+        storage = _storage()
+        res = cache.get_or_compute(storage, (storage.epoch, *key), tables, compute)
+    else:
+        res = compute()
+    if res.status_code != 200:
+        return Response(res.body, status_code=res.status_code, media_type=res.media_type)
+    return Response(res.body, media_type=res.media_type, headers=headers)
+
+
+_RTREE_JOIN = " JOIN node_rtree_ids g ON g.node_id = nodes.node_id JOIN node_rtree r ON r.id = g.id"
+
+
+def _rtree_where(box: Tuple[float, float, float, float], params: List[Any]) -> List[str]:
+    """Condizioni sull'R*Tree ``r`` per i nodi nel riquadro (vedi ``_RTREE_JOIN``)."""
+    min_lon, min_lat, max_lon, max_lat = box
+    where = ["r.min_lat >= ? AND r.max_lat <= ?"]
+    params += [min_lat, max_lat]
+    if min_lon <= max_lon:
+        where.append("r.min_lon >= ? AND r.max_lon <= ?")
+    else:
+        # riquadro a cavallo dell'antimeridiano
+        where.append("(r.min_lon >= ? OR r.max_lon <= ?)")
+    params += [min_lon, max_lon]
+    return where
+
+
+def _query_nodes(include_inactive: bool, bbox: Optional[str]) -> respcache.Computed:
+    params: List[Any] = []
+    where: List[str] = []
     query = (
         """
-        SELECT node_id, short_name, long_name, nickname, last_seen, info_packets, lat, lon, alt
+        SELECT nodes.node_id, short_name, long_name, nickname, last_seen, info_packets,
+               lat, lon, alt, est_lat, est_lon, est_alt
         FROM nodes
         """
     )
+    if bbox:
+        try:
+            box = _parse_bbox(bbox)
+        except ValueError as e:
+            return _computed(JSONResponse({"error": str(e)}, status_code=400))
+        query += _RTREE_JOIN
+        where += _rtree_where(box, params)
     if not include_inactive:
-        query += " WHERE last_seen > 0 OR info_packets > 0"
-    query += " ORDER BY COALESCE(nickname, long_name, short_name, node_id)"
-    with DB_LOCK:
-        old_factory = DB.row_factory
-        DB.row_factory = sqlite3.Row
+        where.append("(last_seen > 0 OR info_packets > 0)")
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY COALESCE(nickname, long_name, short_name, nodes.node_id)"
+    storage = _storage()
+    db = storage.conn
+    with storage.lock:
+        old_factory = db.row_factory
+        db.row_factory = sqlite3.Row
         try:
-            cur = DB.execute(query)
+            cur = db.execute(query, params)
             rows = cur.fetchall()
         finally:
-            DB.row_factory = old_factory
+            db.row_factory = old_factory
     out = []
     for r in rows:
         disp = r["nickname"] or r["long_name"] or r["short_name"] or r["node_id"]
+        estimated = (r["lat"] is None or r["lon"] is None) and r["est_lat"] is not None
         out.append(
             {
                 "node_id": r["node_id"],
@@ -200,20 +408,52 @@ def api_nodes(include_inactive: bool = Query(default=True)):
                 "display_name": disp,
                 "last_seen": r["last_seen"],
                 "info_packets": r["info_packets"],
-                "lat": r["lat"],
-                "lon": r["lon"],
-                "alt": r["alt"],
+                "lat": r["est_lat"] if estimated else r["lat"],
+                "lon": r["est_lon"] if estimated else r["lon"],
+                "alt": r["alt"] if r["alt"] is not None or not estimated else r["est_alt"],
+                "estimated": estimated,
             }
         )
-    _estimate_missing_positions(out)
-    return JSONResponse(out)
+    return _computed(JSONResponse(out))
 
 
-@app.get("/api/traceroutes")
-def api_traceroutes(
-    limit: int = Query(default=100, ge=1, le=1000),
-    max_age: int = Query(default=TRACEROUTE_TTL, ge=0),
-):
+def _nodes_etag(include_inactive, bbox, **_):
+    return ("nodes", "estimates"), ("nodes", bool(include_inactive), bbox or None), 0
+
+
+@app.get("/api/nodes")
+@_db_route("light", etag=_nodes_etag)
+def api_nodes(include_inactive: bool = Query(default=True), bbox: Optional[str] = None, request: Request = None):
+    """Nodi noti; con ``bbox`` solo quelli con posizione nel riquadro (via R*Tree).
+
+    I nodi senza posizione reale riportano quella stimata dai traceroute
+    (vedi ``estimator``) con ``estimated: true``. Solo lettura.
+    """
+    tables, key, headers = _validated()
+    return _respond(key, tables, lambda: _query_nodes(include_inactive, bbox), headers)
+
+
+@app.get("/api/nodes/{node_id}/track")
+@_db_route("light")
+def api_node_track(node_id: str, since: int = 0, until: Optional[int] = None, limit: int = 5000):
+    """Storico delle posizioni di un nodo, in ordine cronologico."""
+    if limit < 1 or limit > 50000:
+        return JSONResponse({"error": "limit must be between 1 and 50000"}, status_code=400)
+    params: List[Any] = [node_id, since]
+    query = "SELECT ts, lat, lon, alt FROM positions WHERE node_id = ? AND ts >= ?"
+    if until is not None:
+        query += " AND ts < ?"
+        params.append(until)
+    query += " ORDER BY ts LIMIT ?"
+    params.append(limit)
+    storage = _storage()
+    with storage.lock:
+        rows = storage.conn.execute(query, params).fetchall()
+    points = [{"ts": ts, "lat": lat, "lon": lon, "alt": alt} for ts, lat, lon, alt in rows]
+    return JSONResponse({"node_id": node_id, "points": points})
+
+
+def _query_traceroutes(limit: int, max_age: int) -> respcache.Computed:
     params: List[Any] = []
     sub_where = ""
     if max_age:
@@ -221,8 +461,10 @@ def api_traceroutes(
         sub_where = "WHERE ts >= ?"
         params.append(cutoff)
     params.append(limit)
-    with DB_LOCK:
-        cur = DB.execute(
+    storage = _storage()
+    db = storage.conn
+    with storage.lock:
+        cur = db.execute(
             f"""
             SELECT t.ts, t.src_id, t.dest_id, t.route, t.hop_count, t.radio
             FROM (
@@ -244,11 +486,11 @@ def api_traceroutes(
     out = []
     for ts, src, dest, route_json, hop, radio_json in rows:
         try:
-            route = json.loads(route_json) if route_json else []
+            route = fastjson.loads(route_json) if route_json else []
         except Exception:
             route = []
         try:
-            radio = json.loads(radio_json) if radio_json else None
+            radio = fastjson.loads(radio_json) if radio_json else None
         except Exception:
             radio = None
         via = "radio" if radio else "mqtt"
@@ -263,17 +505,537 @@ def api_traceroutes(
                 "via": via,
             }
         )
-    return JSONResponse(out)
+    return _computed(JSONResponse(out))
+
+
+def _traceroutes_etag(limit, max_age, **_):
+    if max_age is None:
+        max_age = config.TRACEROUTE_TTL
+    return ("traceroutes",), ("traceroutes", limit, max_age), 60 if max_age else 0
+
+
+@app.get("/api/traceroutes")
+@_db_route("light", etag=_traceroutes_etag)
+def api_traceroutes(
+    limit: int = Query(default=100, ge=1, le=1000),
+    max_age: Optional[int] = Query(default=None, ge=0),
+    request: Request = None,
+):
+    if max_age is None:
+        max_age = config.TRACEROUTE_TTL
+    tables, key, headers = _validated()
+    return _respond(key, tables, lambda: _query_traceroutes(limit, max_age), headers)
 
 
 @app.delete("/api/traceroutes")
+@_db_route("light")
 def api_delete_traceroutes():
-    with DB_LOCK:
-        DB.execute("DELETE FROM traceroutes")
-        DB.commit()
+    storage = _storage()
+    db = storage.conn
+    with storage.lock:
+        db.execute("DELETE FROM traceroutes")
+        db.execute("DELETE FROM node_links")
+        db.execute("UPDATE nodes SET est_lat = NULL, est_lon = NULL, est_alt = NULL WHERE est_lat IS NOT NULL")
+        storage.topology.clear(db)
+        db.commit()
+        storage.touch("traceroutes", "estimates", "topology")
     return JSONResponse({"status": "ok"})
 
 
+TOPOLOGY_EDGE_FIELDS = ("source", "target", "count", "last_seen", "hop", "snr", "rssi")
+
+
+def _topology_nodes(storage: Storage, ids: List[str]) -> List[Dict[str, Any]]:
+    """``{id, name, lat, lon, estimated}`` per ``ids``, nello stesso ordine; lock già acquisito."""
+    rows: List[Tuple] = []
+    for i in range(0, len(ids), 500):
+        chunk = ids[i : i + 500]
+        rows += storage.conn.execute(
+            f"""
+            SELECT node_id, nickname, long_name, short_name, lat, lon, est_lat, est_lon
+            FROM nodes WHERE node_id IN ({','.join('?' for _ in chunk)})
+            """,
+            chunk,
+        ).fetchall()
+    known = {r[0]: r for r in rows}
+    out = []
+    for node_id in ids:
+        _, nick, long_name, short_name, lat, lon, est_lat, est_lon = known.get(node_id, (node_id,) + (None,) * 7)
+        estimated = (lat is None or lon is None) and est_lat is not None
+        out.append(
+            {
+                "id": node_id,
+                "name": nick or long_name or short_name or node_id,
+                "lat": est_lat if estimated else lat,
+                "lon": est_lon if estimated else lon,
+                "estimated": estimated,
+            }
+        )
+    return out
+
+
+def _query_topology(max_age: int) -> respcache.Computed:
+    storage = _storage()
+    since = int(time.time()) - max_age if max_age else None
+    with storage.lock:
+        edges = storage.topology.snapshot(since)
+        ids = sorted({n for a, b, _ in edges for n in (a, b)})
+        nodes = _topology_nodes(storage, ids)
+    index = {node_id: i for i, node_id in enumerate(ids)}
+    # archi come righe compatte, con i nodi indicati per posizione in ``nodes``
+    out_edges = [
+        [index[a], index[b], count, last_seen, hop, snr, rssi]
+        for a, b, (_first, last_seen, count, hop, snr, rssi) in edges
+    ]
+    return _computed(JSONResponse({"nodes": nodes, "edge_fields": TOPOLOGY_EDGE_FIELDS, "edges": out_edges}))
+
+
+def _topology_etag(max_age, **_):
+    return ("topology", "nodes", "estimates"), ("topology", max_age), 60 if max_age else 0
+
+
+@app.get("/api/topology")
+@_db_route("light", etag=_topology_etag)
+def api_topology(max_age: int = Query(default=0, ge=0), request: Request = None):
+    """Grafo dei collegamenti radio osservati nei traceroute (vedi :mod:`topology`).
+
+    ``edges`` sono righe con i campi di ``edge_fields``; ``source`` e
+    ``target`` sono indici in ``nodes``. Gli archi sono orientati nel verso del
+    pacchetto; con ``max_age`` restano solo quelli visti negli ultimi secondi.
+    """
+    tables, key, headers = _validated()
+    return _respond(key, tables, lambda: _query_topology(max_age), headers)
+
+
+def _topology_node(storage: Storage, name: str) -> Optional[str]:
+    """``node_id`` presente nel grafo per un id o un nome visualizzato; lock già acquisito."""
+    graph = storage.topology
+    if name in graph.out or name in graph.into:
+        return name
+    cur = storage.conn.execute(
+        "SELECT node_id FROM nodes WHERE COALESCE(nickname, long_name, short_name, node_id) = ?", (name,)
+    )
+    return next((r[0] for r in cur if r[0] in graph.out or r[0] in graph.into), None)
+
+
+def _query_topology_path(src: str, dst: str, metric: str, directed: bool, max_age: int) -> respcache.Computed:
+    storage = _storage()
+    since = int(time.time()) - max_age if max_age else None
+    with storage.lock:
+        src_id, dst_id = _topology_node(storage, src), _topology_node(storage, dst)
+        missing = [n for n, i in ((src, src_id), (dst, dst_id)) if i is None]
+        if missing:
+            return _computed(JSONResponse({"error": f"not in topology: {', '.join(missing)}"}, status_code=404))
+        path = storage.topology.path(src_id, dst_id, metric, since, directed)
+        if path is None:
+            return _computed(JSONResponse({"error": "no path", "from": src_id, "to": dst_id}, status_code=404))
+        ids = [src_id] + [b for _a, b, _e in path]
+        nodes = _topology_nodes(storage, ids)
+        edges = [
+            {
+                "source": a,
+                "target": b,
+                "count": e.count,
+                "last_seen": e.last_seen,
+                "snr": e.snr,
+                "rssi": e.rssi,
+            }
+            for a, b, e in path
+        ]
+    snrs = [e["snr"] for e in edges]
+    return _computed(
+        JSONResponse(
+            {
+                "from": src_id,
+                "to": dst_id,
+                "metric": metric,
+                "hops": len(edges),
+                # ``None`` se manca l'SNR di almeno un collegamento
+                "min_snr": min(snrs) if snrs and None not in snrs else None,
+                "nodes": nodes,
+                "edges": edges,
+            }
+        )
+    )
+
+
+def _topology_path_etag(src, dst, metric, directed, max_age, **_):
+    if metric not in topology.PATH_METRICS:
+        return None
+    key = ("topology_path", src, dst, metric, directed, max_age)
+    return ("topology", "nodes", "estimates"), key, 60 if max_age else 0
+
+
+@app.get("/api/topology/path")
+@_db_route("light", etag=_topology_path_etag)
+def api_topology_path(
+    src: str = Query(..., alias="from"),
+    dst: str = Query(..., alias="to"),
+    metric: str = Query(default="hops"),
+    directed: int = Query(default=0, ge=0, le=1),
+    max_age: int = Query(default=0, ge=0),
+    request: Request = None,
+):
+    """Percorso tra due nodi nel grafo di :mod:`topology`.
+
+    ``metric=hops`` cerca il percorso più corto, ``metric=snr`` quello con
+    l'SNR peggiore più alto. Con ``directed=1`` i collegamenti valgono solo
+    nel verso osservato nei traceroute. 404 se un nodo non compare nel
+    grafo o se non c'è percorso.
+    """
+    if metric not in topology.PATH_METRICS:
+        return JSONResponse({"error": f"metric must be one of {', '.join(topology.PATH_METRICS)}"}, status_code=400)
+    tables, key, headers = _validated()
+    return _respond(key, tables, lambda: _query_topology_path(src, dst, metric, bool(directed), max_age), headers)
+
+
+def _query_topology_critical(max_age: int) -> respcache.Computed:
+    storage = _storage()
+    since = int(time.time()) - max_age if max_age else None
+    with storage.lock:
+        found = storage.topology.critical(since)
+        points = _topology_nodes(storage, found["articulation_points"])
+    return _computed(
+        JSONResponse(
+            {
+                "nodes": found["nodes"],
+                "articulation_points": points,
+                "bridges": [list(b) for b in found["bridges"]],
+            }
+        )
+    )
+
+
+def _topology_critical_etag(max_age, **_):
+    return ("topology", "nodes", "estimates"), ("topology_critical", max_age), 60 if max_age else 0
+
+
+@app.get("/api/topology/critical")
+@_db_route("light", etag=_topology_critical_etag)
+def api_topology_critical(max_age: int = Query(default=0, ge=0), request: Request = None):
+    """Nodi (punti di articolazione) e collegamenti (ponti) la cui perdita divide la rete.
+
+    Il grafo è considerato non orientato; ``bridges`` sono coppie di id.
+    """
+    tables, key, headers = _validated()
+    return _respond(key, tables, lambda: _query_topology_critical(max_age), headers)
+
+
+def _query_map_clusters(box: Tuple[float, float, float, float], zoom: int, include_inactive: bool) -> respcache.Computed:
+    params: List[Any] = []
+    where = _rtree_where(box, params)
+    if not include_inactive:
+        where.append("(last_seen > 0 OR info_packets > 0)")
+    storage = _storage()
+    db = storage.conn
+    with storage.lock:
+        rows = db.execute(
+            f"""
+            SELECT nodes.node_id, COALESCE(nickname, long_name, short_name, nodes.node_id),
+                   r.min_lat, r.min_lon, nodes.lat IS NULL OR nodes.lon IS NULL
+            FROM nodes{_RTREE_JOIN}
+            WHERE {' AND '.join(where)}
+            """,
+            params,
+        ).fetchall()
+        edges = [(a, b, e[2], e[1]) for a, b, e in storage.topology.snapshot()]
+        ids = sorted({n for a, b, _c, _t in edges for n in (a, b)})
+        positions: Dict[str, Tuple[float, float]] = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i : i + 500]
+            positions.update(
+                (node_id, (lat, lon))
+                for node_id, lat, lon in db.execute(
+                    f"""
+                    SELECT g.node_id, r.min_lat, r.min_lon
+                    FROM node_rtree_ids g JOIN node_rtree r ON r.id = g.id
+                    WHERE g.node_id IN ({','.join('?' for _ in chunk)})
+                    """,
+                    chunk,
+                )
+            )
+    cells = mapcluster.cluster(rows, zoom)
+    return _computed(
+        JSONResponse(
+            {
+                "zoom": zoom,
+                "cell_px": mapcluster.CELL_PX,
+                "clusters": mapcluster.as_list(cells, zoom),
+                "links": mapcluster.bundles(edges, positions, zoom, cells),
+            }
+        )
+    )
+
+
+def _map_clusters_etag(bbox, zoom, include_inactive, **_):
+    try:
+        box = mapcluster.snap_bbox(_parse_bbox(bbox), zoom)
+    except (TypeError, ValueError):
+        return None
+    return ("nodes", "estimates", "topology"), ("map_clusters", box, zoom, bool(include_inactive)), 0
+
+
+@app.get("/api/map/clusters")
+@_db_route("light", etag=_map_clusters_etag)
+def api_map_clusters(
+    bbox: str,
+    zoom: int = Query(..., ge=0, le=mapcluster.MAX_ZOOM),
+    include_inactive: bool = Query(default=False),
+    request: Request = None,
+):
+    """Nodi raggruppati in celle della griglia delle tile (vedi :mod:`mapcluster`).
+
+    Per la mappa a zoom bassi: al posto dei singoli nodi restituisce il
+    numero di nodi e il baricentro di ogni cella, più i collegamenti della
+    topologia riuniti in un fascio per coppia di celle. Il riquadro viene
+    allargato ai bordi delle celle, così piccoli spostamenti della mappa
+    danno la stessa risposta (e lo stesso ETag).
+    """
+    try:
+        box = mapcluster.snap_bbox(_parse_bbox(bbox), zoom)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    tables, key, headers = _validated()
+    return _respond(key, tables, lambda: _query_map_clusters(box, zoom, bool(include_inactive)), headers)
+
+
+def _fts_query(q: str) -> str:
+    """Converte il testo cercato in una query FTS5 sicura (frasi in AND, ``*`` finale = prefisso)."""
+    terms = []
+    for tok in q.split():
+        prefix = tok.endswith("*") and len(tok) > 1
+        tok = tok.rstrip("*")
+        if tok:
+            terms.append('"' + tok.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+@app.get("/api/messages")
+@_db_route("heavy")
+def api_messages(
+    nodes: Optional[str] = Query(default=None, description="Nomi visuali o node_id separati da virgola"),
+    portnum: Optional[str] = Query(default=None),
+    since: Optional[int] = Query(default=None, ge=0),
+    until: Optional[int] = Query(default=None, ge=0),
+    q: Optional[str] = Query(default=None, description="Ricerca full-text nel testo dei messaggi"),
+    cursor: Optional[str] = Query(default=None, description="next_cursor della pagina precedente"),
+    limit: int = Query(default=100, ge=1, le=1000),
+    raw: int = Query(default=0, ge=0, le=1),
+):
+    """Messaggi dal più recente, con filtri e paginazione a cursore (keyset).
+
+    Il cursore è la coppia ``ts:id`` dell'ultimo messaggio restituito: la
+    pagina successiva riparte dall'indice invece di saltare ``OFFSET`` righe.
+    """
+    selected = [s.strip() for s in (nodes.split(",") if nodes else []) if s.strip()]
+    ids = _resolve_ids(selected) if selected else []
+    cols = "m.id, m.ts, m.node_id, m.portnum, m.text" + (", m.raw_json" if raw else "")
+    query = f"SELECT {cols} FROM messages m"
+    where: List[str] = []
+    params: List[Any] = []
+    storage = _storage()
+    db = storage.conn
+    if q and q.strip():
+        with storage.lock:
+            have_fts = db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='messages_fts'"
+            ).fetchone()
+        if have_fts:
+            query += " JOIN messages_fts ON messages_fts.rowid = m.id"
+            where.append("messages_fts MATCH ?")
+            params.append(_fts_query(q))
+        else:
+            for tok in q.split():
+                where.append("m.text LIKE ?")
+                params.append(f"%{tok.rstrip('*')}%")
+    if ids:
+        where.append(f"m.node_id IN ({','.join('?' for _ in ids)})")
+        params.extend(ids)
+    if portnum:
+        where.append("m.portnum = ?")
+        params.append(portnum)
+    if since is not None:
+        where.append("m.ts >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("m.ts < ?")
+        params.append(until)
+    if cursor:
+        try:
+            c_ts, c_id = (int(p) for p in cursor.split(":", 1))
+        except ValueError:
+            return JSONResponse({"error": "invalid cursor"}, status_code=400)
+        where.append("(m.ts, m.id) < (?, ?)")
+        params += [c_ts, c_id]
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY m.ts DESC, m.id DESC LIMIT ?"
+    params.append(limit + 1)
+    with storage.lock:
+        try:
+            rows = db.execute(query, params).fetchall()
+        except sqlite3.OperationalError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    out = []
+    for r in rows:
+        item = {"id": r[0], "ts": r[1], "node_id": r[2], "portnum": r[3], "text": r[4]}
+        if raw:
+            try:
+                item["data"] = fastjson.loads(r[5]) if r[5] else None
+            except Exception:
+                item["data"] = None
+        out.append(item)
+    next_cursor = f"{rows[-1][1]}:{rows[-1][0]}" if more and rows else None
+    return JSONResponse({"messages": out, "next_cursor": next_cursor})
+
+
+def _csv_set(value: Optional[str]) -> Optional[List[str]]:
+    items = [v.strip() for v in (value or "").split(",") if v.strip()]
+    return items or None
+
+
+@app.get("/api/events")
+async def api_events(
+    request: Request,
+    types: Optional[str] = None,
+    nodes: Optional[str] = None,
+    metrics: Optional[str] = None,
+):
+    """Flusso Server-Sent Events con i nuovi campioni, nodi e traceroute.
+
+    ``types``, ``nodes`` (node_id) e ``metrics`` sono liste separate da virgola
+    che filtrano gli eventi lato server. Un client che non consuma abbastanza
+    in fretta riceve ``event: overflow`` e viene scollegato: al ricollegamento
+    deve ricaricare i dati con le API normali.
+    """
+    type_list = _csv_set(types)
+    if type_list and not set(type_list) <= set(events.EVENT_TYPES):
+        return JSONResponse({"error": f"types must be among {', '.join(events.EVENT_TYPES)}"}, status_code=400)
+    try:
+        sub = events.bus.subscribe(
+            asyncio.get_running_loop(), types=type_list, nodes=_csv_set(nodes), metrics=_csv_set(metrics)
+        )
+    except events.TooManySubscribers as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                batch = await sub.get(15.0)
+                if sub.dropped:
+                    yield "event: overflow\ndata: {}\n\n"
+                    break
+                if not batch:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield "".join(f"event: {ev['type']}\ndata: {fastjson.dumps(ev)}\n\n" for ev in batch)
+        finally:
+            events.bus.unsubscribe(sub)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# tentativi per blocco di un download con l'executor saturo, prima di interromperlo
+_STREAM_RETRIES = 3
+
+
+async def _stream_db(kind: str, chunks: Iterator[bytes], cleanup: Optional[Callable[[], None]] = None):
+    """Fa avanzare un generatore di ``bytes`` un blocco alla volta nell'executor DB.
+
+    Lo slot della classe ``kind`` è occupato solo durante la lettura di un
+    blocco, non per tutta la durata del download. Se per :data:`_STREAM_RETRIES`
+    volte di fila non si ottiene uno slot il download viene interrotto: lo
+    stato 200 è già partito, il client vede un trasferimento incompleto.
+    """
+    try:
+        retries = 0
+        while True:
+            try:
+                chunk = await _executor().run(kind, next, chunks, None)
+            except dbexec.Overloaded:
+                retries += 1
+                if retries > _STREAM_RETRIES:
+                    print(f"[API] Download interrotto: executor {kind} saturo")
+                    raise
+                await asyncio.sleep(0.5 * retries)
+                continue
+            retries = 0
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        # chiude solo il cursore: non serve passare dall'executor
+        chunks.close()
+        if cleanup is not None:
+            cleanup()
+
+
+def _export_response(kind: str, fmt: str, produce: Callable[[sqlite3.Connection], Iterator[bytes]]) -> Response:
+    storage = _storage()
+    conn = export.readonly_connection(storage)
+    return StreamingResponse(
+        _stream_db("heavy", produce(conn), conn.close if conn is not storage.conn else None),
+        media_type=export.FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{export.filename(kind, fmt)}"'},
+    )
+
+
+@app.get("/api/export/telemetry")
+async def api_export_telemetry(
+    since: Optional[int] = Query(default=None, ge=0),
+    until: Optional[int] = Query(default=None, ge=0),
+    nodes: Optional[str] = Query(default=None, description="Nomi visuali o node_id separati da virgola"),
+    metrics: Optional[str] = Query(default=None, description="Metriche separate da virgola"),
+    format: str = "csv",
+):
+    """Campioni di telemetria (tutti i livelli di storage) in CSV o NDJSON, a flusso."""
+    if format not in export.FORMATS:
+        return JSONResponse({"error": f"format must be one of {', '.join(export.FORMATS)}"}, status_code=400)
+    selected = [s.strip() for s in (nodes.split(",") if nodes else []) if s.strip()]
+    ids = await _executor().run("light", _resolve_ids, selected) if selected else None
+    wanted = [m.strip() for m in (metrics.split(",") if metrics else []) if m.strip()]
+    storage = _storage()
+
+    def produce(conn: sqlite3.Connection):
+        rows = export.telemetry_rows(storage, conn, since, until, ids, wanted)
+        return export.encode(rows, export.TELEMETRY_COLUMNS, format)
+
+    return _export_response("telemetry", format, produce)
+
+
+@app.get("/api/export/messages")
+async def api_export_messages(
+    since: Optional[int] = Query(default=None, ge=0),
+    until: Optional[int] = Query(default=None, ge=0),
+    nodes: Optional[str] = Query(default=None, description="Nomi visuali o node_id separati da virgola"),
+    portnum: Optional[str] = None,
+    raw: int = Query(default=0, ge=0, le=1),
+    format: str = "csv",
+):
+    """Messaggi in ordine di tempo in CSV o NDJSON, a flusso (``raw=1`` include il JSON originale)."""
+    if format not in export.FORMATS:
+        return JSONResponse({"error": f"format must be one of {', '.join(export.FORMATS)}"}, status_code=400)
+    selected = [s.strip() for s in (nodes.split(",") if nodes else []) if s.strip()]
+    ids = await _executor().run("light", _resolve_ids, selected) if selected else None
+    columns = export.MESSAGE_COLUMNS + (("raw_json",) if raw else ())
+    storage = _storage()
+
+    def produce(conn: sqlite3.Connection):
+        rows = export.message_rows(storage, conn, since, until, ids, portnum, bool(raw))
+        return export.encode(rows, columns, format, json_columns=("raw_json",) if raw else ())
+
+    return _export_response("messages", format, produce)
+
+
 @app.post("/api/nodes/nickname")
 async def api_set_nickname(req: Request):
     data = await req.json()
@@ -281,13 +1043,24 @@ async def api_set_nickname(req: Request):
     nickname = (data.get("nickname") or "").strip() or None
     if not node_id:
         return JSONResponse({"error": "node_id required"}, status_code=400)
-    with DB_LOCK:
-        DB.execute("UPDATE nodes SET nickname=? WHERE node_id=?", (nickname, node_id))
-        DB.commit()
+    try:
+        await _executor().run("light", _set_nickname, node_id, nickname)
+    except dbexec.Overloaded as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "1"})
     return JSONResponse({"status": "ok"})
 
 
+def _set_nickname(node_id: str, nickname: Optional[str]) -> None:
+    storage = _storage()
+    db = storage.conn
+    with storage.lock:
+        db.execute("UPDATE nodes SET nickname=? WHERE node_id=?", (nickname, node_id))
+        db.commit()
+        storage.touch("nodes", node_id=node_id)
+
+
 @app.put("/api/admin/nodes/{node_id}")
+@_db_route("light")
 def api_admin_update_node(node_id: str, payload: Dict[str, Any] = Body(...)):
     allowed = ["short_name", "long_name", "nickname", "lat", "lon", "alt"]
     updates = {k: payload.get(k) for k in allowed if k in payload}
@@ -295,17 +1068,24 @@ def api_admin_update_node(node_id: str, payload: Dict[str, Any] = Body(...)):
         return JSONResponse({"error": "no fields"}, status_code=400)
     set_clause = ", ".join(f"{k}=?" for k in updates)
     params = list(updates.values()) + [node_id]
-    with DB_LOCK:
-        DB.execute(f"UPDATE nodes SET {set_clause} WHERE node_id=?", params)
-        DB.commit()
+    storage = _storage()
+    db = storage.conn
+    with storage.lock:
+        db.execute(f"UPDATE nodes SET {set_clause} WHERE node_id=?", params)
+        if "lat" in updates or "lon" in updates:
+            estimator.position_changed(db, node_id)
+        db.commit()
+        storage.touch("nodes")
     return JSONResponse({"status": "ok"})
 
 
 @app.delete("/api/admin/nodes/empty")
+@_db_route("light")
 def api_admin_delete_empty_nodes():
-    with DB_LOCK:
-        before = DB.total_changes
-        DB.execute(
+    storage = _storage()
+    db = storage.conn
+    with storage.lock:
+        cur = db.execute(
             """
             DELETE FROM nodes
             WHERE COALESCE(TRIM(short_name), '') = ''
@@ -315,41 +1095,260 @@ def api_admin_delete_empty_nodes():
               AND (lon IS NULL OR lon = 0)
             """,
         )
-        DB.commit()
-        deleted = DB.total_changes - before
+        db.commit()
+        storage.touch("nodes")
+        # ``rowcount`` esclude le righe toccate dai trigger (indice R*Tree)
+        deleted = cur.rowcount
     return JSONResponse({"deleted": deleted})
 
 
 @app.delete("/api/admin/nodes/{node_id}")
+@_db_route("light")
 def api_admin_delete_node(node_id: str):
-    with DB_LOCK:
-        DB.execute("DELETE FROM nodes WHERE node_id=?", (node_id,))
-        DB.commit()
+    storage = _storage()
+    db = storage.conn
+    with storage.lock:
+        db.execute("DELETE FROM nodes WHERE node_id=?", (node_id,))
+        db.execute("DELETE FROM positions WHERE node_id=?", (node_id,))
+        # i vicini perdono un riferimento per la stima
+        estimator.refresh(db, estimator.neighbours(db, node_id))
+        db.commit()
+        storage.touch("nodes")
     return JSONResponse({"status": "ok"})
 
+
+def _admin_sql_read(storage: Storage, query: str, params: Any, max_rows: int, timeout_s: float):
+    conn = export.readonly_connection(storage)
+    shared = conn is storage.conn
+    try:
+        read = sqlconsole.ReadQuery(conn, query, params, max_rows, timeout_s, storage.lock if shared else None)
+    except BaseException:
+        if not shared:
+            conn.close()
+        raise
+    return read, (None if shared else conn.close)
+
+
+def _admin_sql_explain(storage: Storage, query: str, params: Any, timeout_s: float) -> Dict[str, Any]:
+    conn = export.readonly_connection(storage)
+    if conn is storage.conn:
+        with storage.lock:
+            return sqlconsole.explain(conn, query, params, time.monotonic() + timeout_s)
+    try:
+        return sqlconsole.explain(conn, query, params, time.monotonic() + timeout_s)
+    finally:
+        conn.close()
+
+
+def _affects_estimates(query: str) -> bool:
+    if sqlconsole.mentions(query, "traceroutes", "node_links", "positions"):
+        return True
+    if not sqlconsole.mentions(query, "nodes"):
+        return False
+    # ``UPDATE nodes SET nickname=...`` non cambia le stime; insert e delete sì
+    return not sqlconsole.mentions(query, "update") or sqlconsole.mentions(query, "lat", "lon", "alt")
+
+
+def _admin_sql_write(storage: Storage, query: str, params: Any, timeout_s: float) -> Dict[str, Any]:
+    db = storage.conn
+    with storage.lock:
+        try:
+            with sqlconsole.time_budget(db, time.monotonic() + timeout_s):
+                cur = db.execute(query, params)
+        except BaseException:
+            db.rollback()
+            raise
+        changes = cur.rowcount
+        # stime e grafo ricostruiti solo se la query tocca le tabelle da cui
+        # dipendono; le versioni sono comunque invalidate
+        if _affects_estimates(query):
+            estimator.rebuild(db)
+        if sqlconsole.mentions(query, "topology_edges"):
+            storage.topology.load(db)
+        db.commit()
+        storage.touch()
+    return {"status": "ok", "changes": changes}
+
+
 @app.post("/api/admin/sql")
-def api_admin_sql(payload: Dict[str, Any] = Body(...)):
+async def api_admin_sql(payload: Dict[str, Any] = Body(...)):
+    """Console SQL: letture isolate e a flusso, scritture con limite di tempo.
+
+    ``SELECT`` (e le altre letture, vedi :func:`sqlconsole.is_read`) girano
+    su una connessione in sola lettura e la risposta ``{"columns", "rows",
+    "row_count", "truncated", "elapsed_ms"}`` è inviata man mano, fermandosi a
+    ``max_rows``. Con ``"explain": true`` restituisce il piano di esecuzione
+    (``EXPLAIN QUERY PLAN``) senza eseguire la query. ``max_rows`` e
+    ``timeout_s`` nel payload possono solo abbassare i limiti di config.
+    """
     query = payload.get("query")
     params = payload.get("params") or []
     if not query:
         return JSONResponse({"error": "query required"}, status_code=400)
-    with DB_LOCK:
-        cur = DB.execute(query, params)
-        if query.strip().lower().startswith("select"):
-            cols = [c[0] for c in cur.description]
-            rows = [dict(zip(cols, r)) for r in cur.fetchall()]
-            return JSONResponse({"rows": rows})
-        DB.commit()
-    return JSONResponse({"status": "ok"})
+    limits = sqlconsole.parse_options(config.ADMIN_SQL)
+    try:
+        max_rows = min(int(payload.get("max_rows") or limits["max_rows"]), limits["max_rows"])
+        timeout_s = min(float(payload.get("timeout_s") or limits["timeout_s"]), limits["timeout_s"])
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "max_rows and timeout_s must be numbers"}, status_code=400)
+    if max_rows < 1 or timeout_s <= 0:
+        return JSONResponse({"error": "max_rows and timeout_s must be positive"}, status_code=400)
+    storage = _storage()
+    try:
+        if payload.get("explain"):
+            return JSONResponse(await _executor().run("admin", _admin_sql_explain, storage, query, params, timeout_s))
+        if not sqlconsole.is_read(query):
+            return JSONResponse(await _executor().run("admin", _admin_sql_write, storage, query, params, timeout_s))
+        read, cleanup = await _executor().run("admin", _admin_sql_read, storage, query, params, max_rows, timeout_s)
+    except dbexec.Overloaded as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "1"})
+    except sqlconsole.Interrupted:
+        return JSONResponse(
+            {"error": f"query interrupted: time budget of {timeout_s:g} s exceeded"}, status_code=400
+        )
+    except sqlite3.Error as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return StreamingResponse(_stream_db("admin", read.chunks(), cleanup), media_type="application/json")
 
 
+@app.post("/api/admin/backup")
+@_db_route("admin")
+def api_admin_backup(payload: Optional[Dict[str, Any]] = Body(default=None)):
+    """Crea uno snapshot online del DB senza fermare l'ingest."""
+    payload = payload or {}
+    try:
+        res = backup.backup(
+            _storage(),
+            config.BACKUP_DIR,
+            pages=int(payload.get("pages", 256)),
+            sleep=float(payload.get("sleep", 0.05)),
+            compress=bool(payload.get("compress", False)),
+            keep=int(payload.get("keep", config.BACKUP_KEEP)),
+        )
+    except backup.BackupInProgress as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    except (TypeError, ValueError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    res["file"] = os.path.basename(res.pop("path"))
+    return JSONResponse(res)
+
+
+@app.get("/api/admin/backups")
+@_db_route("light")
+def api_admin_backups():
+    out = []
+    for path in backup.list_snapshots(config.BACKUP_DIR):
+        st = os.stat(path)
+        out.append({"file": os.path.basename(path), "bytes": st.st_size, "mtime": int(st.st_mtime)})
+    return JSONResponse(out)
+
+
+@app.get("/api/admin/storage")
+@_db_route("light")
+def api_admin_storage():
+    """Stato dello storage: dimensioni, WAL, profilo di tuning, manutenzione e cache."""
+    storage = _storage()
+    db = storage.conn
+    with storage.lock:
+        info = {}
+        for k in ("page_size", "page_count", "freelist_count", "cache_size", "mmap_size", "auto_vacuum"):
+            row = db.execute(f"PRAGMA {k}").fetchone()
+            info[k] = row[0] if row else None
+    info["wal_bytes"] = maintenance.wal_size(storage)
+    info["tuning"] = storage.tuning
+    maint = getattr(app.state, "maintenance", None)
+    info["maintenance"] = maint.last if maint else None
+    cache = _cache()
+    info["response_cache"] = cache.stats() if cache is not None else None
+    info["db_executor"] = _executor().stats()
+    return JSONResponse(info)
+
+
+def _internal_metrics() -> List[Tuple[str, str, str, List[Any]]]:
+    """Grandezze lette al momento di ``/metrics``: SQLite, executor, eventi, cache."""
+    storage = _storage()
+    with storage.lock:
+        pragmas = {
+            k: storage.conn.execute(f"PRAGMA {k}").fetchone()[0] for k in ("page_size", "page_count", "freelist_count")
+        }
+    out: List[Tuple[str, str, str, List[Any]]] = [
+        ("meshplotter_sqlite_page_size_bytes", "gauge", "Dimensione di pagina", [("", {}, pragmas["page_size"])]),
+        ("meshplotter_sqlite_pages", "gauge", "Pagine del database", [("", {}, pragmas["page_count"])]),
+        ("meshplotter_sqlite_freelist_pages", "gauge", "Pagine libere", [("", {}, pragmas["freelist_count"])]),
+        ("meshplotter_sqlite_wal_bytes", "gauge", "Dimensione del file -wal", [("", {}, maintenance.wal_size(storage))]),
+    ]
+    stats = _executor().stats()
+    for field, help_ in (
+        ("running", "Richieste DB in esecuzione per classe"),
+        ("waiting", "Richieste DB in coda per classe"),
+        ("limit", "Richieste DB concorrenti ammesse per classe"),
+    ):
+        out.append(
+            (f"meshplotter_db_executor_{field}", "gauge", help_, [("", {"class": k}, v[field]) for k, v in stats.items()])
+        )
+    out.append(
+        (
+            "meshplotter_db_executor_rejected",
+            "counter",
+            "Richieste DB respinte con 503 per classe",
+            [("meshplotter_db_executor_rejected_total", {"class": k}, v["rejected"]) for k, v in stats.items()],
+        )
+    )
+    bus = events.bus.stats()
+    out.append(("meshplotter_events_subscribers", "gauge", "Client SSE collegati", [("", {}, bus["subscribers"])]))
+    out.append(
+        (
+            "meshplotter_events_published",
+            "counter",
+            "Eventi pubblicati",
+            [("meshplotter_events_published_total", {}, bus["published"])],
+        )
+    )
+    out.append(
+        (
+            "meshplotter_events_dropped",
+            "counter",
+            "Client SSE scollegati per buffer pieno",
+            [("meshplotter_events_dropped_total", {}, bus["dropped"])],
+        )
+    )
+    response_cache = _cache()
+    if response_cache is not None:
+        cache = response_cache.stats()
+        out.append(
+            (
+                "meshplotter_response_cache_requests",
+                "counter",
+                "Risposte servite dalla cache (hit) o calcolate (miss)",
+                [
+                    ("meshplotter_response_cache_requests_total", {"result": "hit"}, cache["hits"]),
+                    ("meshplotter_response_cache_requests_total", {"result": "miss"}, cache["misses"]),
+                ],
+            )
+        )
+        out.append(("meshplotter_response_cache_bytes", "gauge", "Byte in cache", [("", {}, cache["bytes"])]))
+    # i campioni senza nome prendono quello della famiglia
+    return [(name, kind, help_, [(s or name, labels, v) for s, labels, v in samples]) for name, kind, help_, samples in out]
+
+
+instrument.register_collector(_internal_metrics)
+
+
+@app.get("/metrics")
+@_db_route("light")
+def prometheus_metrics():
+    """Metriche interne in formato testuale Prometheus (vedi :mod:`instrument`)."""
+    return Response(instrument.render(), media_type=instrument.CONTENT_TYPE)
+
 
 def _resolve_ids(names: List[str]) -> List[str]:
     if not names:
         return []
     qs = ",".join("?" for _ in names)
-    with DB_LOCK:
-        cur = DB.execute(
+    storage = _storage()
+    db = storage.conn
+    with storage.lock:
+        cur = db.execute(
             f"""
             SELECT node_id FROM nodes
             WHERE COALESCE(nickname, long_name, short_name, node_id) IN ({qs})
@@ -363,14 +1362,97 @@ def _resolve_ids(names: List[str]) -> List[str]:
     return list(dict.fromkeys(ids))
 
 
-@app.get("/api/metrics")
-def api_metrics(
-    nodes: Optional[str] = Query(default=None, description="Nomi visuali o node_id separati da virgola"),
-    since_s: int = Query(default=24 * 3600, ge=0, le=30 * 24 * 3600),
-    use_nick: int = Query(default=0, ge=0, le=1),
-):
-    since_ts = int(time.time()) - since_s
-    selected = [s.strip() for s in (nodes.split(",") if nodes else []) if s.strip()]
+_FAMILY_NAMES = {
+    "temperature": "Temperatura",
+    "humidity": "Umidità",
+    "pressure": "Pressione",
+    "voltage": "Tensione",
+    "current": "Corrente",
+}
+
+
+def _series_label(met: str, disp: str) -> Optional[Tuple[str, str]]:
+    """Famiglia di grafico ed etichetta della serie per una metrica."""
+    fam = metric_family(met)
+    if fam is None:
+        return None
+    if met in config.POWER_V_KEYS:
+        ch = met.replace("ch", "").replace("_voltage", "")
+        return fam, f"{disp} — Tensione ch{ch} (V)"
+    if met in config.POWER_I_KEYS:
+        ch = met.replace("ch", "").replace("_current", "")
+        return fam, f"{disp} — Corrente ch{ch} ({config.UNITS[met]})"
+    return fam, f"{disp} — {_FAMILY_NAMES[fam]} ({config.UNITS[fam]})"
+
+
+def _node_names(node_ids) -> Dict[str, Tuple[Optional[str], Optional[str], Optional[str]]]:
+    """``node_id -> (nickname, long_name, short_name)`` per i nodi indicati."""
+    ids = list(node_ids)
+    if not ids:
+        return {}
+    storage = _storage()
+    with storage.lock:
+        cur = storage.conn.execute(
+            f"SELECT node_id, nickname, long_name, short_name FROM nodes WHERE node_id IN ({','.join('?' for _ in ids)})",
+            ids,
+        )
+        return {r[0]: (r[1], r[2], r[3]) for r in cur.fetchall()}
+
+
+METRICS_FORMATS = ("points", "columnar", "binary")
+METRICS_BINARY_TYPE = "application/vnd.meshplotter.metrics"
+METRICS_BINARY_MAGIC = b"MPM1"
+
+
+def _encode_metrics_binary(
+    units: Dict[str, str], series: Dict[str, List[Dict[str, Any]]], cursor: Optional[int] = None
+) -> bytes:
+    """Serializza le serie in un buffer little-endian leggibile con i typed array.
+
+    Layout: ``b"MPM1"``, lunghezza (uint32) dell'intestazione JSON, il JSON
+    ``{"units", "cursor", "series": [{"family", "node_id", "label", "count"}]}``,
+    padding fino a un multiplo di 8 byte, poi per ogni serie ``count``
+    timestamp in ms (int64) seguiti da ``count`` valori (float64).
+    """
+    meta = []
+    chunks: List[bytes] = []
+    for fam, items in series.items():
+        for ds in items:
+            ts = array("q", ds["ts"])
+            vals = array("d", ds["values"])
+            if sys.byteorder != "little":  # pragma: no cover - piattaforme big-endian
+                ts.byteswap()
+                vals.byteswap()
+            meta.append({"family": fam, "node_id": ds["node_id"], "label": ds["label"], "count": len(ts)})
+            chunks.append(ts.tobytes())
+            chunks.append(vals.tobytes())
+    header = fastjson.dumps_bytes({"units": units, "cursor": cursor, "series": meta})
+    head = METRICS_BINARY_MAGIC + struct.pack("<I", len(header)) + header
+    head += b"\0" * (-len(head) % 8)
+    return head + b"".join(chunks)
+
+
+def _query_metrics(
+    selected: List[str],
+    since_s: int,
+    use_nick: int,
+    max_points: Optional[int],
+    downsample: str,
+    format: str,
+    after_ts: Optional[int],
+) -> respcache.Computed:
+    now = int(time.time())
+    since_ts = now - since_s
+    # il secondo in corso può ancora ricevere campioni: il cursore si ferma a
+    # quello precedente e le richieste incrementali non lo includono, così
+    # nessun campione va perso (al più viene ripetuto quello del secondo in corso)
+    cursor = now - 1
+    until_ts: Optional[int] = None
+    if after_ts is not None:
+        since_ts = max(since_ts, after_ts + 1)
+        until_ts = cursor + 1
+    until_sql = " AND telemetry.ts < ?" if until_ts is not None else ""
+    until_params = (until_ts,) if until_ts is not None else ()
     ids = _resolve_ids(selected) if selected else []
     name_expr = (
         "COALESCE(nodes.nickname, telemetry.node_name, nodes.long_name, nodes.short_name, telemetry.node_id)"
@@ -378,13 +1460,15 @@ def api_metrics(
         else "COALESCE(telemetry.node_name, nodes.long_name, nodes.short_name, telemetry.node_id)"
     )
 
-    with DB_LOCK:
-        old_factory = DB.row_factory
-        DB.row_factory = sqlite3.Row
+    storage = _storage()
+    db = storage.conn
+    with storage.lock:
+        old_factory = db.row_factory
+        db.row_factory = sqlite3.Row
         try:
             if ids:
                 qs = ",".join("?" for _ in ids)
-                cur = DB.execute(
+                cur = db.execute(
                     f"""
                 SELECT
                     telemetry.ts            AS ts,
@@ -394,13 +1478,13 @@ def api_metrics(
                     telemetry.value         AS value
                 FROM telemetry
                 LEFT JOIN nodes ON nodes.node_id = telemetry.node_id
-                WHERE telemetry.ts >= ? AND telemetry.node_id IN ({qs})
+                WHERE telemetry.ts >= ?{until_sql} AND telemetry.node_id IN ({qs})
                 ORDER BY telemetry.ts ASC
             """,
-                    (since_ts, *ids),
+                    (since_ts, *until_params, *ids),
                 )
             else:
-                cur = DB.execute(
+                cur = db.execute(
                     f"""
                 SELECT
                     telemetry.ts            AS ts,
@@ -410,43 +1494,203 @@ def api_metrics(
                     telemetry.value         AS value
                 FROM telemetry
                 LEFT JOIN nodes ON nodes.node_id = telemetry.node_id
-                WHERE telemetry.ts >= ?
+                WHERE telemetry.ts >= ?{until_sql}
                 ORDER BY telemetry.ts ASC
             """,
-                    (since_ts,),
+                    (since_ts, *until_params),
                 )
             rows = cur.fetchall()
         finally:
-            DB.row_factory = old_factory
+            db.row_factory = old_factory
+        # tier freddo e blocchi compressi nella stessa presa del lock: né una
+        # compattazione né una sigillatura possono spostare campioni tra un
+        # livello e l'altro mentre li leggiamo
+        blocks = tsblock.select(db, since_ts, ids or None, until_ts)
+        cold = coldstore.snapshot(storage, since_ts, ids or None, until_ts)
 
     fams = {"temperature": [], "humidity": [], "pressure": [], "voltage": [], "current": []}
     acc: Dict[Tuple[str, str], Dict[str, Any]] = {}
 
-    def add(fam: str, node_id: str, label: str, ts: int, val: float):
-        acc.setdefault((fam, node_id), {"node_id": node_id, "label": label, "data": []})["data"].append(
-            {"x": ts * 1000, "y": float(val)}
-        )
+    def series(fam: str, node_id: str, label: str) -> Dict[str, Any]:
+        return acc.setdefault((fam, node_id), {"node_id": node_id, "label": label, "ts": [], "values": []})
+
+    # campioni più vecchi delle righe in telemetry
+    warm = itertools.chain(cold, tsblock.blocks(blocks, since_ts, until_ts))
+    names: Dict[str, Tuple[Optional[str], Optional[str], Optional[str]]] = {}
+    for node_id, node_name, met, seg_ts, seg_vals in warm:
+        if node_id not in names:
+            names.update(_node_names([node_id]))
+            names.setdefault(node_id, (None, None, None))
+        nick, long_name, short_name = names[node_id]
+        disp = (nick if use_nick else None) or node_name or long_name or short_name or node_id
+        fam_label = _series_label(met, disp)
+        if not fam_label:
+            continue
+        ds = series(fam_label[0], node_id, fam_label[1])
+        ds["ts"].extend(seg_ts)
+        ds["values"].extend(seg_vals)
 
     for r in rows:
-        ts, node_id, disp, met, val = int(r["ts"]), r["node_id"], r["disp"], r["metric"], float(r["value"])
-        if met == "temperature":
-            add("temperature", node_id, f"{disp} — Temperatura ({UNITS['temperature']})", ts, val)
-        elif met == "humidity":
-            add("humidity", node_id, f"{disp} — Umidità ({UNITS['humidity']})", ts, val)
-        elif met == "pressure":
-            add("pressure", node_id, f"{disp} — Pressione ({UNITS['pressure']})", ts, val)
-        elif met == "voltage":
-            add("voltage", node_id, f"{disp} — Tensione ({UNITS['voltage']})", ts, val)
-        elif met == "current":
-            add("current", node_id, f"{disp} — Corrente ({UNITS['current']})", ts, val)
-        elif met in POWER_V_KEYS:
-            ch = met.replace("ch", "").replace("_voltage", "")
-            add("voltage", node_id, f"{disp} — Tensione ch{ch} (V)", ts, val)
-        elif met in POWER_I_KEYS:
-            ch = met.replace("ch", "").replace("_current", "")
-            add("current", node_id, f"{disp} — Corrente ch{ch} ({UNITS[met]})", ts, val)
+        fam_label = _series_label(r["metric"], r["disp"])
+        if fam_label:
+            ds = series(fam_label[0], r["node_id"], fam_label[1])
+            ds["ts"].append(int(r["ts"]))
+            ds["values"].append(float(r["value"]))
 
     out = {k: [] for k in fams}
     for (fam, _node_id), ds in acc.items():
+        ts, vals = ds.pop("ts"), ds.pop("values")
+        if max_points and len(ts) > max_points:
+            if any(b < a for a, b in zip(ts, itertools.islice(ts, 1, None))):
+                pairs = sorted(zip(ts, vals), key=lambda p: p[0])
+                ts, vals = [p[0] for p in pairs], [p[1] for p in pairs]
+            ts, vals = _downsample.reduce(ts, vals, max_points, downsample)
+        if format == "points":
+            ds["data"] = [{"x": t * 1000, "y": v} for t, v in zip(ts, vals)]
+        else:
+            ds["ts"] = [t * 1000 for t in ts]
+            ds["values"] = vals
         out[fam].append(ds)
-    return JSONResponse({"units": UNITS, "series": out})
+    if format == "binary":
+        res: Response = Response(_encode_metrics_binary(config.UNITS, out, cursor), media_type=METRICS_BINARY_TYPE)
+    else:
+        res = JSONResponse({"units": config.UNITS, "series": out, "cursor": cursor})
+    # con un filtro la risposta dipende solo dalle scritture di quei nodi
+    return _computed(res, ids or None)
+
+
+def _csv(value: Optional[str]) -> List[str]:
+    """Valori distinti e ordinati di un parametro separato da virgole."""
+    return sorted({s.strip() for s in (value.split(",") if value else []) if s.strip()})
+
+
+def _metrics_etag(nodes, since_s, use_nick, max_points, downsample, format, after_ts, **_):
+    key = ("metrics", tuple(_csv(nodes)), since_s, use_nick, max_points, downsample, format, after_ts)
+    return ("telemetry", "nodes"), key, 60
+
+
+@app.get("/api/metrics")
+@_db_route("heavy", etag=_metrics_etag)
+def api_metrics(
+    nodes: Optional[str] = Query(default=None, description="Nomi visuali o node_id separati da virgola"),
+    since_s: int = Query(default=24 * 3600, ge=0, le=30 * 24 * 3600),
+    use_nick: int = Query(default=0, ge=0, le=1),
+    max_points: Optional[int] = None,
+    downsample: str = "lttb",
+    format: str = "points",
+    after_ts: Optional[int] = None,
+    request: Request = None,
+):
+    """Serie di telemetria per grafico.
+
+    Con ``max_points`` ogni serie viene ridotta sul server (LTTB o min/max
+    per intervallo), così il peso della risposta dipende dalla larghezza del
+    grafico e non dal numero di campioni nella finestra.
+
+    ``format`` sceglie la forma delle serie: ``points`` (``data`` come lista
+    di ``{"x", "y"}``), ``columnar`` (array paralleli ``ts``/``values``) o
+    ``binary`` (vedi :func:`_encode_metrics_binary`).
+
+    La risposta include ``cursor``: l'ultimo secondo concluso incluso nella
+    risposta. Passandolo come ``after_ts`` si ottengono solo i campioni più
+    recenti, da accodare a quelli già scaricati.
+
+    Come ``/api/nodes`` e ``/api/traceroutes`` risponde con ``ETag`` e
+    ``Last-Modified``: se nulla è cambiato restituisce 304 senza leggere il DB.
+    """
+    selected = _csv(nodes)
+    tables, key, headers = _validated()
+    if format not in METRICS_FORMATS:
+        return JSONResponse({"error": f"format must be one of {', '.join(METRICS_FORMATS)}"}, status_code=400)
+    if max_points is not None and not 3 <= max_points <= 100000:
+        return JSONResponse({"error": "max_points must be between 3 and 100000"}, status_code=400)
+    if downsample not in _downsample.METHODS:
+        return JSONResponse({"error": f"downsample must be one of {', '.join(_downsample.METHODS)}"}, status_code=400)
+    return _respond(
+        key,
+        tables,
+        lambda: _query_metrics(selected, since_s, use_nick, max_points, downsample, format, after_ts),
+        headers,
+    )
+
+
+def _query_metric_summary(selected: List[str], metrics: List[str], since_s: int, use_nick: int) -> respcache.Computed:
+    now = int(time.time())
+    since_ts = now - since_s
+    # finestra allineata all'ora: gli aggregati sono orari
+    from_ts = since_ts - since_ts % ROLLUP_BUCKET_S
+    ids = _resolve_ids(selected) if selected else []
+    if selected and not ids:
+        return _computed(JSONResponse({"since": from_ts, "bucket_s": ROLLUP_BUCKET_S, "summary": []}))
+    where = ["l.ts >= ?"]
+    params: List[Any] = [from_ts, from_ts]
+    if ids:
+        where.append(f"l.node_id IN ({','.join('?' for _ in ids)})")
+        params.extend(ids)
+    if metrics:
+        where.append(f"l.metric IN ({','.join('?' for _ in metrics)})")
+        params.extend(metrics)
+    storage = _storage()
+    with storage.lock:
+        # una riga per serie da ``latest_metric``, poi la finestra dei soli bucket orari
+        rows = storage.conn.execute(
+            f"""
+            SELECT l.node_id, l.metric, l.ts, l.value,
+                   SUM(r.count), SUM(r.sum), MIN(r.min), MAX(r.max),
+                   n.nickname, n.long_name, n.short_name
+            FROM latest_metric l
+            JOIN metric_rollup r
+              ON r.node_id = l.node_id AND r.metric = l.metric AND r.bucket_ts >= ?
+            LEFT JOIN nodes n ON n.node_id = l.node_id
+            WHERE {' AND '.join(where)}
+            GROUP BY l.node_id, l.metric
+            ORDER BY l.node_id, l.metric
+            """,
+            params,
+        ).fetchall()
+    out = []
+    for node_id, metric, ts, value, count, total, vmin, vmax, nick, long_name, short_name in rows:
+        family = metric_family(metric)
+        out.append(
+            {
+                "node_id": node_id,
+                "label": (nick if use_nick else None) or long_name or short_name or node_id,
+                "metric": metric,
+                "family": family,
+                "unit": config.UNITS.get(metric) or config.UNITS.get(family or ""),
+                "latest": value,
+                "latest_ts": ts,
+                "min": vmin,
+                "max": vmax,
+                "avg": total / count,
+                "count": count,
+            }
+        )
+    res = JSONResponse({"since": from_ts, "bucket_s": ROLLUP_BUCKET_S, "summary": out})
+    return _computed(res, ids or None)
+
+
+def _metrics_summary_etag(nodes, metrics, since_s, use_nick, **_):
+    key = ("metrics_summary", tuple(_csv(nodes)), tuple(_csv(metrics)), since_s, use_nick)
+    return ("telemetry", "nodes"), key, 60
+
+
+@app.get("/api/metrics/summary")
+@_db_route("light", etag=_metrics_summary_etag)
+def api_metrics_summary(
+    nodes: Optional[str] = Query(default=None, description="Nomi visuali o node_id separati da virgola"),
+    metrics: Optional[str] = Query(default=None, description="Metriche separate da virgola"),
+    since_s: int = Query(default=24 * 3600, ge=0, le=30 * 24 * 3600),
+    use_nick: int = Query(default=0, ge=0, le=1),
+    request: Request = None,
+):
+    """Ultimo valore, minimo, massimo, media e numero di campioni per nodo e metrica.
+
+    Letto da ``latest_metric`` e ``metric_rollup`` (aggiornati dall'ingest),
+    senza scorrere ``telemetry``: il costo dipende dal numero di serie e di
+    ore nella finestra, non dai campioni. La finestra parte dall'inizio
+    dell'ora che contiene ``now - since_s`` (campo ``since``).
+    """
+    selected, wanted = _csv(nodes), _csv(metrics)
+    tables, key, headers = _validated()
+    return _respond(key, tables, lambda: _query_metric_summary(selected, wanted, since_s, use_nick), headers)
@@ -1,6 +1,8 @@
+from typing import TYPE_CHECKING, Any
+
+import config
 from api import app
-from config import WEB_HOST, WEB_PORT, EMBEDDED_BROKER
-from database import DB, DB_LOCK
+from database import get_storage
 from mqtt_client import start_mqtt
 from processing import process_mqtt_message
 from auto_update import maybe_auto_update
@@ -15,10 +17,28 @@ __all__ = [
     "DB_LOCK",
 ]
 
+if TYPE_CHECKING:
+    import sqlite3
+
+    from instrument import TimedLock
+
+    DB: sqlite3.Connection
+    DB_LOCK: TimedLock
+
+
+def __getattr__(name: str) -> Any:
+    # ``DB``/``DB_LOCK`` restano disponibili ma il DB si apre solo al primo accesso
+    if name == "DB":
+        return get_storage().conn
+    if name == "DB_LOCK":
+        return get_storage().lock
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
     import uvicorn
 
     maybe_auto_update()
-    if EMBEDDED_BROKER:
+    if config.EMBEDDED_BROKER:
         start_broker()
-    uvicorn.run(app, host=WEB_HOST, port=WEB_PORT, log_level="info")
+    uvicorn.run(app, host=config.WEB_HOST, port=config.WEB_PORT, log_level="info")
@@ -0,0 +1,147 @@
+"""Backup online del database SQLite tramite l'API di backup.
+
+La copia avviene a blocchi di pagine con una pausa tra un blocco e l'altro,
+così l'ingest continua a scrivere durante il backup. Il file può essere
+compresso con gzip e le copie più vecchie vengono ruotate.
+
+Uso da riga di comando::
+
+    python backup.py [--dest DIR] [--compress] [--keep N] [--pages N] [--sleep S]
+"""
+
+import argparse
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from database import Storage
+
+SNAPSHOT_RE = re.compile(r"^telemetry-\d{8}-\d{6}\.db(\.gz)?$")
+_RUNNING = threading.Lock()
+
+
+class BackupInProgress(RuntimeError):
+    """Un altro backup è già in corso."""
+
+
+def list_snapshots(dest_dir: str) -> List[str]:
+    """Snapshot presenti in ``dest_dir``, dal più recente al più vecchio."""
+    if not os.path.isdir(dest_dir):
+        return []
+    names = sorted((n for n in os.listdir(dest_dir) if SNAPSHOT_RE.match(n)), reverse=True)
+    return [os.path.join(dest_dir, n) for n in names]
+
+
+def rotate(dest_dir: str, keep: int) -> List[str]:
+    """Elimina gli snapshot oltre i ``keep`` più recenti; restituisce i file rimossi."""
+    if keep <= 0:
+        return []
+    removed = list_snapshots(dest_dir)[keep:]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def _gzip(path: str) -> str:
+    out = path + ".gz"
+    with open(path, "rb") as src, gzip.open(out + ".tmp", "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(out + ".tmp", out)
+    os.remove(path)
+    return out
+
+
+def backup(
+    storage: Storage,
+    dest_dir: str,
+    *,
+    pages: int = 256,
+    sleep: float = 0.05,
+    compress: bool = False,
+    keep: int = 0,
+) -> Dict[str, Any]:
+    """Crea uno snapshot di ``storage`` in ``dest_dir``.
+
+    Usa la connessione condivisa come sorgente: le scritture dell'ingest fatte
+    sulla stessa connessione vengono riportate nella copia senza farla
+    ripartire. Restituisce percorso, pagine copiate, durata e dimensione.
+    """
+    if not _RUNNING.acquire(blocking=False):
+        raise BackupInProgress("backup già in corso")
+    try:
+        os.makedirs(dest_dir, exist_ok=True)
+        name = time.strftime("telemetry-%Y%m%d-%H%M%S.db", time.gmtime())
+        path = os.path.join(dest_dir, name)
+        tmp = path + ".tmp"
+        stats = {"steps": 0, "pages": 0, "restarts": 0}
+        last_remaining: Optional[int] = None
+
+        def progress(status: int, remaining: int, total: int) -> None:
+            nonlocal last_remaining
+            stats["steps"] += 1
+            stats["pages"] = total
+            if last_remaining is not None and remaining > last_remaining:
+                stats["restarts"] += 1
+            last_remaining = remaining
+
+        started = time.monotonic()
+        target = sqlite3.connect(tmp)
+        try:
+            storage.conn.backup(target, pages=pages, progress=progress, sleep=sleep)
+        finally:
+            target.close()
+        os.replace(tmp, path)
+        if compress:
+            path = _gzip(path)
+        elapsed = time.monotonic() - started
+        removed = rotate(dest_dir, keep)
+        return {
+            "path": path,
+            "pages": stats["pages"],
+            "steps": stats["steps"],
+            "restarts": stats["restarts"],
+            "seconds": round(elapsed, 3),
+            "bytes": os.path.getsize(path),
+            "rotated": [os.path.basename(p) for p in removed],
+        }
+    finally:
+        _RUNNING.release()
+
+
+def main() -> int:
+    from config import BACKUP_DIR, BACKUP_KEEP
+    from database import open_storage
+
+    parser = argparse.ArgumentParser(description="Backup online di telemetry.db")
+    parser.add_argument("--dest", default=BACKUP_DIR, help="directory degli snapshot")
+    parser.add_argument("--compress", action="store_true", help="comprimi con gzip")
+    parser.add_argument("--keep", type=int, default=BACKUP_KEEP, help="snapshot da conservare (0 = tutti)")
+    parser.add_argument("--pages", type=int, default=256, help="pagine per passo (-1 = tutte insieme)")
+    parser.add_argument("--sleep", type=float, default=0.05, help="pausa tra i passi in secondi")
+    args = parser.parse_args()
+
+    storage = open_storage()
+    try:
+        res = backup(
+            storage, args.dest, pages=args.pages, sleep=args.sleep, compress=args.compress, keep=args.keep
+        )
+    finally:
+        storage.close()
+    print(
+        f"[BACKUP] {res['path']}: {res['pages']} pagine in {res['steps']} passi, "
+        f"{res['seconds']} s, {res['bytes']} byte"
+    )
+    if res["restarts"]:
+        print(f"[BACKUP] Ripartito {res['restarts']} volte per scritture concorrenti")
+    for name in res["rotated"]:
+        print(f"[BACKUP] Rimosso {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
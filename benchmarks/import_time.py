@@ -0,0 +1,65 @@
+"""Misura il tempo di import dei moduli principali con ``python -X importtime``.
+
+Uso::
+
+    python benchmarks/import_time.py                 # api, target 1000 ms
+    python benchmarks/import_time.py --module processing --target-ms 300
+
+Esce con codice 1 se il tempo cumulativo supera il target.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import List, Tuple
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module: str) -> Tuple[int, List[Tuple[int, str]]]:
+    """Restituisce (cumulativo µs di ``module``, [(cumulativo µs, dipendenza diretta)])."""
+    # sempre la config dei test (DB in memoria): un TP_CONFIG reale nell'ambiente
+    # farebbe creare il file SQLite a chi misura
+    env = dict(os.environ, TP_CONFIG=os.path.join(ROOT, "tests", "test.config.yml"))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0
+    deps: List[Tuple[int, str]] = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if not m:
+            continue
+        # l'indentazione cresce di due spazi per ogni livello di import
+        depth = (len(m.group(3)) - 1) // 2
+        if depth == 0 and m.group(4) == module:
+            total = int(m.group(2))
+        elif depth == 1:
+            deps.append((int(m.group(2)), m.group(4)))
+    return total, deps
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="api")
+    parser.add_argument("--target-ms", type=float, default=1000.0)
+    parser.add_argument("--top", type=int, default=10, help="moduli più lenti da mostrare")
+    args = parser.parse_args()
+
+    total_us, deps = measure(args.module)
+    print(f"import {args.module}: {total_us / 1000:.1f} ms (target {args.target_ms:.0f} ms)")
+    for us, name in sorted(deps, reverse=True)[: args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+    return 0 if total_us / 1000 <= args.target_ms else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Confronta i backend JSON (stdlib e orjson) sui payload di ``/api/metrics``.
+
+Costruisce la risposta di ``/api/metrics`` per una finestra con molti
+campioni, nei formati ``points`` e ``columnar``, e misura codifica e
+decodifica con ciascun backend disponibile. Misura anche il ciclo di ingest
+(decodifica del payload MQTT e ricodifica per ``raw_json``).
+
+Uso::
+
+    python benchmarks/json_backends.py
+    python benchmarks/json_backends.py --series 40 --points 20000 --repeat 5
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import fastjson  # noqa: E402
+
+FAMILIES = ("temperature", "humidity", "pressure", "voltage", "current")
+
+
+@contextlib.contextmanager
+def backend(name: str):
+    """Forza il backend di ``fastjson`` per la durata del blocco."""
+    saved = fastjson.orjson
+    if name == "json":
+        fastjson.orjson = None
+    try:
+        yield
+    finally:
+        fastjson.orjson = saved
+
+
+def metrics_payload(series: int, points: int, fmt: str) -> dict:
+    now_ms = int(time.time()) * 1000
+    out = {fam: [] for fam in FAMILIES}
+    for i in range(series):
+        ts = [now_ms - (points - k) * 30_000 for k in range(points)]
+        vals = [20.0 + (k % 97) / 7 + i for k in range(points)]
+        ds = {"node_id": f"{i:08x}", "label": f"Nodo {i} Temperatura"}
+        if fmt == "points":
+            ds["data"] = [{"x": t, "y": v} for t, v in zip(ts, vals)]
+        else:
+            ds["ts"] = ts
+            ds["values"] = vals
+        out[FAMILIES[i % len(FAMILIES)]].append(ds)
+    return {"units": {"temperature": "°C"}, "series": out, "cursor": now_ms // 1000}
+
+
+def mqtt_payload() -> bytes:
+    return (
+        b'{"from": 2882400001, "to": 4294967295, "channel": 0, "id": 123456789, "rxTime": 1700000000,'
+        b' "decoded": {"portnum": "TELEMETRY_APP", "payload": {"time": 1700000000,'
+        b' "environmentMetrics": {"temperature": 21.5, "relativeHumidity": 48.25,'
+        b' "barometricPressure": 1013.2, "voltage": 4.12, "current": 35.0}}},'
+        b' "hopLimit": 3, "rxSnr": 6.25, "rxRssi": -87}'
+    )
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--series", type=int, default=20, help="serie nella risposta")
+    parser.add_argument("--points", type=int, default=10_000, help="campioni per serie")
+    parser.add_argument("--repeat", type=int, default=3, help="ripetizioni (vale il tempo migliore)")
+    parser.add_argument("--messages", type=int, default=20_000, help="payload MQTT per il test di ingest")
+    args = parser.parse_args()
+
+    backends = ["json"] + (["orjson"] if fastjson.orjson is not None else [])
+    if len(backends) == 1:
+        print("[BENCH] orjson non installato: misuro solo la stdlib (pip install orjson)")
+
+    print(f"{'caso':<22} {'backend':<8} {'MiB':>8} {'encode ms':>10} {'decode ms':>10}")
+    for fmt in ("points", "columnar"):
+        payload = metrics_payload(args.series, args.points, fmt)
+        for name in backends:
+            with backend(name):
+                body = fastjson.dumps_bytes(payload)
+                enc = timed(lambda: fastjson.dumps_bytes(payload), args.repeat)
+                dec = timed(lambda: fastjson.loads(body), args.repeat)
+            print(
+                f"{'/api/metrics ' + fmt:<22} {name:<8} {len(body) / 2**20:>8.2f} "
+                f"{enc * 1000:>10.1f} {dec * 1000:>10.1f}"
+            )
+
+    raw = mqtt_payload()
+    for name in backends:
+        with backend(name):
+
+            def ingest():
+                for _ in range(args.messages):
+                    fastjson.dumps(fastjson.loads(raw))
+
+            elapsed = timed(ingest, args.repeat)
+        print(f"{'ingest (loads+dumps)':<22} {name:<8} {'':>8} {elapsed * 1000:>10.1f} {args.messages / elapsed:>9.0f}/s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,78 @@
+"""Confronta i profili di tuning SQLite su un DB temporaneo.
+
+Per ogni profilo crea un DB nuovo, inserisce telemetria sintetica e misura
+il tempo di inserimento e quello di una query in stile ``/api/metrics``.
+
+Uso::
+
+    python benchmarks/tuning_profiles.py                  # tutti i profili
+    python benchmarks/tuning_profiles.py --rows 500000 --profiles default large
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import maintenance  # noqa: E402
+from database import Storage  # noqa: E402
+
+METRICS = ("temperature", "humidity", "voltage", "battery_level")
+
+
+def run(profile: str, rows: int, nodes: int) -> dict:
+    settings = maintenance.resolve_profile(profile)
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(os.path.join(tmp, "bench.db"), tuning=settings)
+        db = storage.conn
+        now = int(time.time()) - rows
+        started = time.perf_counter()
+        batch = []
+        for i in range(rows):
+            node = f"!{i % nodes:08x}"
+            batch.append((now + i, node, node, METRICS[i % len(METRICS)], float(i % 100)))
+            if len(batch) == 5000:
+                db.executemany("INSERT INTO telemetry(ts, node_id, node_name, metric, value) VALUES(?,?,?,?,?)", batch)
+                db.commit()
+                batch.clear()
+        if batch:
+            db.executemany("INSERT INTO telemetry(ts, node_id, node_name, metric, value) VALUES(?,?,?,?,?)", batch)
+            db.commit()
+        insert_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(5):
+            db.execute(
+                "SELECT ts, node_id, node_name, metric, value FROM telemetry WHERE ts >= ? ORDER BY ts ASC",
+                (now + rows // 2,),
+            ).fetchall()
+        query_s = (time.perf_counter() - started) / 5
+        maint = maintenance.Maintenance(storage, optimize_every=0)
+        report = maint.run_once()
+        storage.close()
+    return {"insert_s": insert_s, "query_s": query_s, "maintenance_s": report["seconds"]}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000, help="righe di telemetria da inserire")
+    parser.add_argument("--nodes", type=int, default=50, help="nodi distinti")
+    parser.add_argument("--profiles", nargs="*", default=sorted(maintenance.PROFILES))
+    args = parser.parse_args()
+
+    print(f"{'profilo':<10} {'insert s':>10} {'righe/s':>10} {'query ms':>10} {'maint ms':>10}")
+    for name in args.profiles:
+        res = run(name, args.rows, args.nodes)
+        print(
+            f"{name:<10} {res['insert_s']:>10.2f} {args.rows / res['insert_s']:>10.0f} "
+            f"{res['query_s'] * 1000:>10.1f} {res['maintenance_s'] * 1000:>10.1f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
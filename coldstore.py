@@ -0,0 +1,390 @@
+"""Archivio freddo colonnare per la telemetria storica.
+
+Gli intervalli chiusi (giorni UTC più vecchi di ``storage.cold_after_days``)
+vengono spostati da SQLite in file segmento, uno per nodo/metrica/giorno::
+
+    <cold_path>/<node_id>/<metric>/<start_ts>.seg
+
+Ogni segmento è un header di 16 byte (magic + numero di campioni) seguito da
+due array contigui little-endian: i timestamp (int64) e i valori (float64).
+La tabella ``cold_segments`` fa da indice. In lettura i file sono mappati con
+``mmap`` e affettati tramite ``memoryview``, senza copiare i dati.
+"""
+
+import bisect
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from array import array
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import tsblock
+from database import Storage
+
+MAGIC = b"MPSEG1\0\0"
+HEADER = struct.Struct("<8sQ")
+DAY = 24 * 3600
+
+# Segmento letto: (node_id, node_name, metric, timestamp, valori)
+SegmentSlice = Tuple[str, Optional[str], str, Sequence[int], Sequence[float]]
+
+
+def _safe(name: str) -> str:
+    return re.sub(r"[^0-9A-Za-z_.-]", "_", name) or "_"
+
+
+def segment_path(root: str, node_id: str, metric: str, start_ts: int) -> str:
+    return os.path.join(root, _safe(node_id), _safe(metric), f"{int(start_ts)}.seg")
+
+
+def _le(arr: array) -> bytes:
+    if sys.byteorder != "little":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _fsync_dir(path: str) -> None:
+    # rende persistente il rename; non tutti i sistemi aprono le directory
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_tmp(path: str, ts: Sequence[int], values: Sequence[float]) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(ts)))
+        f.write(_le(array("q", ts)))
+        f.write(_le(array("d", values)))
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp
+
+
+def _install(tmp: str, path: str) -> None:
+    os.replace(tmp, path)
+    _fsync_dir(os.path.dirname(path))
+
+
+def write_segment(path: str, ts: Sequence[int], values: Sequence[float]) -> None:
+    """Scrive un segmento in modo atomico (file temporaneo + rename).
+
+    Al ritorno il file è su disco (fsync): chi lo chiama può cancellare le
+    righe d'origine.
+    """
+    _install(_write_tmp(path, ts, values), path)
+
+
+class Segment:
+    """Segmento mappato in memoria; ``ts`` e ``values`` sono viste senza copia."""
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"segmento non valido: {path}")
+        if sys.byteorder != "little":  # pragma: no cover - piattaforme big-endian
+            raw_ts = array("q", self._map[HEADER.size : HEADER.size + 8 * count])
+            raw_ts.byteswap()
+            raw_vals = array("d", self._map[HEADER.size + 8 * count : HEADER.size + 16 * count])
+            raw_vals.byteswap()
+            self._views: List[memoryview] = []
+            self.ts: Sequence[int] = raw_ts
+            self.values: Sequence[float] = raw_vals
+            return
+        buf = memoryview(self._map)
+        ts_view = buf[HEADER.size : HEADER.size + 8 * count].cast("q")
+        val_view = buf[HEADER.size + 8 * count : HEADER.size + 16 * count].cast("d")
+        self._views = [buf, ts_view, val_view]
+        self.ts = ts_view
+        self.values = val_view
+
+    def __enter__(self) -> "Segment":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def slice(self, since_ts: Optional[int] = None, until_ts: Optional[int] = None):
+        """Restituisce ``(ts, values)`` ristretti a ``since_ts <= ts < until_ts``."""
+        lo = bisect.bisect_left(self.ts, since_ts) if since_ts is not None else 0
+        hi = bisect.bisect_left(self.ts, until_ts) if until_ts is not None else len(self.ts)
+        return self.ts[lo:hi], self.values[lo:hi]
+
+    def close(self) -> None:
+        for v in reversed(getattr(self, "_views", [])):
+            v.release()
+        self._views = []
+        try:
+            self._map.close()
+        except (AttributeError, BufferError):
+            pass
+        self._file.close()
+
+
+def _next_ts(db: sqlite3.Connection, node_id: str, metric: str, from_ts: int, before_ts: int) -> Optional[int]:
+    """Primo campione da sigillare della coppia a partire da ``from_ts``."""
+    return db.execute(
+        """
+        SELECT MIN(t) FROM (
+          SELECT MIN(ts) AS t FROM telemetry
+          WHERE node_id = ? AND metric = ? AND ts >= ? AND ts < ?
+          UNION ALL
+          SELECT MIN(first_ts) FROM telemetry_blocks
+          WHERE node_id = ? AND metric = ? AND hour_ts >= ? AND first_ts < ?
+        )
+        """,
+        (node_id, metric, from_ts, before_ts, node_id, metric, from_ts, before_ts),
+    ).fetchone()[0]
+
+
+def seal(storage: Storage, before_ts: int, root: Optional[str] = None) -> int:
+    """Sposta nell'archivio freddo i giorni interi precedenti a ``before_ts``.
+
+    Raccoglie sia le righe di ``telemetry`` sia gli eventuali blocchi compressi
+    di ``telemetry_blocks`` (vedi ``tsblock``). Lavora un giorno di una coppia nodo/metrica alla volta, tenendo il lock
+    solo per la lettura e per la cancellazione delle righe archiviate.
+    Si cancellano solo le righe e i blocchi letti: quelle arrivate durante la
+    scrittura del segmento restano e vengono unite alla sigillatura successiva.
+    Restituisce il numero di campioni spostati; 0 finché ci sono backfill
+    pendenti, perché le righe non ancora corrette (ts, nomi delle metriche)
+    resterebbero congelate nei segmenti. Si ferma anche durante un export
+    (vedi ``Storage.hold_tiers``).
+    """
+    root = root or storage.cold_path
+    if not root or storage.pending_backfills() or storage.tier_holds:
+        return 0
+    before_ts -= before_ts % DAY
+    db = storage.conn
+    with storage.lock:
+        pairs = db.execute(
+            """
+            SELECT node_id, metric, MIN(t) FROM (
+              SELECT node_id, metric, ts AS t FROM telemetry WHERE ts < ?
+              UNION ALL
+              SELECT node_id, metric, first_ts FROM telemetry_blocks WHERE first_ts < ?
+            ) GROUP BY node_id, metric
+            """,
+            (before_ts, before_ts),
+        ).fetchall()
+
+    moved = 0
+    for node_id, metric, first_ts in pairs:
+        if node_id is None:
+            continue
+        cursor: Optional[int] = first_ts
+        while cursor is not None and cursor < before_ts:
+            start = cursor - cursor % DAY
+            end = start + DAY
+            with storage.lock:
+                rows = db.execute(
+                    """
+                    SELECT ts, value, node_name, id FROM telemetry
+                    WHERE node_id = ? AND metric = ? AND ts >= ? AND ts < ?
+                    ORDER BY ts
+                    """,
+                    (node_id, metric, start, end),
+                ).fetchall()
+                blocks = db.execute(
+                    """
+                    SELECT data, node_name, hour_ts, count FROM telemetry_blocks
+                    WHERE node_id = ? AND metric = ? AND hour_ts >= ? AND hour_ts < ?
+                    """,
+                    (node_id, metric, start, end),
+                ).fetchall()
+                seg = db.execute(
+                    "SELECT path FROM cold_segments WHERE node_id=? AND metric=? AND start_ts=?",
+                    (node_id, metric, start),
+                ).fetchone()
+            # limiti di quanto letto: ciò che arriva dopo resta per il prossimo giro
+            max_id = max((r[3] for r in rows), default=0)
+            read_blocks = sorted((b[2], b[3]) for b in blocks)
+            ts = [int(r[0]) for r in rows]
+            vals = [float(r[1]) for r in rows]
+            node_name = next((r[2] for r in reversed(rows) if r[2]), None)
+            node_name = node_name or next((b[1] for b in blocks if b[1]), None)
+            path = segment_path(root, node_id, metric, start)
+            parts = [(ts, vals)] + [tsblock.decode(b[0]) for b in blocks]
+            count = sum(len(p[0]) for p in parts)
+            if not count:
+                # dati cancellati dopo l'elenco delle coppie (nodo rimosso,
+                # altra sigillatura): niente da spostare, si passa al giorno dopo
+                with storage.lock:
+                    cursor = _next_ts(db, node_id, metric, end, before_ts)
+                continue
+            if seg and os.path.isfile(seg[0]):
+                # righe arrivate dopo una sigillatura precedente: unisci
+                with Segment(seg[0]) as old:
+                    parts.append((list(old.ts), list(old.values)))
+            if len(parts) > 1:
+                merged = sorted(
+                    ((t, v) for p_ts, p_vals in parts for t, v in zip(p_ts, p_vals)), key=lambda p: p[0]
+                )
+                ts = [p[0] for p in merged]
+                vals = [p[1] for p in merged]
+            tmp = _write_tmp(path, ts, vals)
+            with storage.lock:
+                if storage.tier_holds:
+                    os.remove(tmp)
+                    return moved
+                # righe lette spostate in un blocco o blocchi riscritti da una
+                # compattazione nel frattempo: il segmento non è più esatto,
+                # si scarta e si rifà il giorno
+                still = db.execute(
+                    """
+                    SELECT COUNT(*) FROM telemetry
+                    WHERE node_id = ? AND metric = ? AND ts >= ? AND ts < ? AND id <= ?
+                    """,
+                    (node_id, metric, start, end, max_id),
+                ).fetchone()[0]
+                now_blocks = db.execute(
+                    """
+                    SELECT hour_ts, count FROM telemetry_blocks
+                    WHERE node_id = ? AND metric = ? AND hour_ts >= ? AND hour_ts < ?
+                    ORDER BY hour_ts
+                    """,
+                    (node_id, metric, start, end),
+                ).fetchall()
+                if still != len(rows) or [tuple(b) for b in now_blocks] != read_blocks:
+                    os.remove(tmp)
+                    continue
+                _install(tmp, path)
+                db.execute(
+                    """
+                    INSERT INTO cold_segments(node_id, metric, start_ts, end_ts, count, node_name, path)
+                    VALUES(?,?,?,?,?,?,?)
+                    ON CONFLICT(node_id, metric, start_ts) DO UPDATE SET
+                      end_ts = excluded.end_ts,
+                      count = excluded.count,
+                      node_name = COALESCE(excluded.node_name, cold_segments.node_name),
+                      path = excluded.path
+                    """,
+                    (node_id, metric, start, ts[-1], len(ts), node_name, path),
+                )
+                db.execute(
+                    "DELETE FROM telemetry WHERE node_id = ? AND metric = ? AND ts >= ? AND ts < ? AND id <= ?",
+                    (node_id, metric, start, end, max_id),
+                )
+                db.executemany(
+                    "DELETE FROM telemetry_blocks WHERE node_id = ? AND metric = ? AND hour_ts = ?",
+                    [(node_id, metric, hour_ts) for hour_ts, _ in read_blocks],
+                )
+                db.commit()
+                # i campioni cambiano livello: ETag e cache delle metriche vanno rinnovati
+                storage.touch("telemetry", node_id=node_id)
+                cursor = _next_ts(db, node_id, metric, end, before_ts)
+            moved += count
+    return moved
+
+
+def _segments(
+    storage: Storage, since_ts: int, node_ids: Optional[List[str]], until_ts: Optional[int]
+) -> List[Tuple[str, Optional[str], str, str]]:
+    params: List = [since_ts]
+    where = "end_ts >= ?"
+    if until_ts is not None:
+        where += " AND start_ts < ?"
+        params.append(until_ts)
+    if node_ids:
+        where += f" AND node_id IN ({','.join('?' for _ in node_ids)})"
+        params.extend(node_ids)
+    return storage.conn.execute(
+        f"SELECT node_id, node_name, metric, path FROM cold_segments WHERE {where} ORDER BY start_ts",
+        params,
+    ).fetchall()
+
+
+def _slices(
+    segs: List[Tuple[str, Optional[str], str, str]], since_ts: int, until_ts: Optional[int], copy: bool
+) -> Iterator[SegmentSlice]:
+    for node_id, node_name, metric, path in segs:
+        try:
+            seg = Segment(path)
+        except (OSError, ValueError) as e:
+            print(f"[COLD] Segmento illeggibile {path}: {e}")
+            continue
+        try:
+            ts, vals = seg.slice(since_ts, until_ts)
+            if len(ts) and copy:
+                yield node_id, node_name, metric, array("q", ts), array("d", vals)
+            elif len(ts):
+                yield node_id, node_name, metric, ts, vals
+            if isinstance(ts, memoryview):
+                ts.release()
+                vals.release()
+        finally:
+            seg.close()
+
+
+def snapshot(
+    storage: Storage,
+    since_ts: int,
+    node_ids: Optional[List[str]] = None,
+    until_ts: Optional[int] = None,
+) -> List[SegmentSlice]:
+    """Copie delle fette della finestra; va chiamato con il lock acquisito.
+
+    Serve a chi legge più livelli di storage nella stessa presa del lock: una
+    sigillatura non può spostare campioni tra un livello e l'altro a metà
+    lettura. Per letture lunghe conviene :func:`read`, che non copia.
+    """
+    if not storage.cold_path:
+        return []
+    return list(_slices(_segments(storage, since_ts, node_ids, until_ts), since_ts, until_ts, copy=True))
+
+
+def read(
+    storage: Storage,
+    since_ts: int,
+    node_ids: Optional[List[str]] = None,
+    until_ts: Optional[int] = None,
+) -> Iterator[SegmentSlice]:
+    """Itera sulle fette di segmento che cadono nella finestra richiesta.
+
+    Le viste restituite sono valide solo fino al passo successivo
+    dell'iterazione: chi ne ha bisogno più a lungo deve copiarle.
+    """
+    if not storage.cold_path:
+        return
+    with storage.lock:
+        segs = _segments(storage, since_ts, node_ids, until_ts)
+    yield from _slices(segs, since_ts, until_ts, copy=False)
+
+
+def start_archiver(storage: Storage, after_days: int, interval: int = 3600) -> Optional[threading.Thread]:
+    """Sigilla periodicamente la telemetria più vecchia di ``after_days`` giorni."""
+    if not storage.cold_path or after_days <= 0:
+        return None
+
+    def run():
+        while True:
+            try:
+                moved = seal(storage, int(time.time()) - after_days * DAY)
+                if moved:
+                    print(f"[COLD] Archiviati {moved} campioni")
+            except Exception as e:
+                print(f"[COLD] Archiviazione fallita: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="cold-archiver", daemon=True)
+    thread.start()
+    return thread
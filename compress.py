@@ -0,0 +1,184 @@
+"""Compressione negoziata (brotli/gzip) delle risposte HTTP.
+
+Middleware ASGI: comprime le risposte di tipo testuale (JSON, CSV, JS, SVG,
+formato binario di ``/api/metrics``) quando il client la accetta e il corpo
+supera ``min_size`` byte. Le risposte in streaming sono compresse a pezzi,
+con un flush per ogni blocco, così un export lungo arriva man mano. Restano
+escluse le risposte già codificate (asset precompressi, vedi
+:mod:`webassets`) e gli eventi SSE, che devono arrivare subito.
+
+``brotli`` è opzionale (``pip install brotli``): senza, si usa solo gzip.
+"""
+
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    brotli = None
+
+DEFAULTS: Dict[str, Any] = {
+    "enabled": True,
+    # sotto questa dimensione la compressione non ripaga
+    "min_size": 1024,
+    "gzip_level": 6,
+    # qualità brotli "dinamica": veloce, comunque meglio di gzip
+    "brotli_quality": 4,
+}
+
+COMPRESSIBLE = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "image/svg+xml",
+    "application/vnd.meshplotter.",
+)
+# gli eventi SSE non vanno mai trattenuti in un buffer
+EXCLUDED = ("text/event-stream",)
+
+
+def parse_options(cfg: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    opts = dict(DEFAULTS)
+    opts.update(cfg or {})
+    opts["enabled"] = bool(opts["enabled"])
+    opts["min_size"] = max(0, int(opts["min_size"]))
+    opts["gzip_level"] = int(opts["gzip_level"])
+    opts["brotli_quality"] = int(opts["brotli_quality"])
+    if not 1 <= opts["gzip_level"] <= 9:
+        raise ValueError("compression.gzip_level deve essere tra 1 e 9")
+    if not 0 <= opts["brotli_quality"] <= 11:
+        raise ValueError("compression.brotli_quality deve essere tra 0 e 11")
+    return opts
+
+
+def _qvalues(header: str) -> Dict[str, float]:
+    """Codifiche di ``Accept-Encoding`` con il loro peso ``q`` (1 se assente)."""
+    out: Dict[str, float] = {}
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for p in params.split(";"):
+            k, _, v = p.partition("=")
+            if k.strip().lower() == "q":
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        out[name] = q
+    return out
+
+
+def choose(header: str, available: Iterable[str]) -> Optional[str]:
+    """Codifica di ``available`` col peso più alto; a pari peso vale l'ordine di ``available``."""
+    weights = _qvalues(header)
+    star = weights.get("*", 0.0)
+    best: Optional[Tuple[float, str]] = None
+    for enc in available:
+        q = weights.get(enc, star)
+        if q > 0 and (best is None or q > best[0]):
+            best = (q, enc)
+    return best[1] if best else None
+
+
+def available_encodings() -> Tuple[str, ...]:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+class _Encoder:
+    def __init__(self, encoding: str, opts: Dict[str, Any]) -> None:
+        self.encoding = encoding
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=opts["brotli_quality"])
+        else:
+            self._gz = zlib.compressobj(opts["gzip_level"], zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes, last: bool) -> bytes:
+        if self.encoding == "br":
+            out = self._br.process(data) if data else b""
+            return out + (self._br.finish() if last else self._br.flush())
+        out = self._gz.compress(data)
+        return out + self._gz.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for k, v in headers:
+        if k.lower() == name:
+            return v
+    return None
+
+
+class CompressionMiddleware:
+    """Comprime le risposte secondo ``Accept-Encoding`` (vedi modulo)."""
+
+    def __init__(self, app, **options: Any) -> None:
+        self.app = app
+        self.opts = parse_options(options)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not self.opts["enabled"]:
+            await self.app(scope, receive, send)
+            return
+        accept = (_header(scope["headers"], b"accept-encoding") or b"").decode("latin-1")
+        encoding = choose(accept, available_encodings()) if accept else None
+        start: Optional[Dict[str, Any]] = None
+        encoder: Optional[_Encoder] = None
+        passthrough = False
+
+        async def wrapped(message: Dict[str, Any]) -> None:
+            nonlocal start, encoder, passthrough
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                ctype = (_header(headers, b"content-type") or b"").decode("latin-1").lower()
+                compressible = ctype.startswith(COMPRESSIBLE) and not ctype.startswith(EXCLUDED)
+                if (
+                    not compressible
+                    or _header(headers, b"content-encoding") is not None
+                    or message["status"] in (204, 206, 304)
+                    or scope["method"] == "HEAD"
+                ):
+                    passthrough = True
+                    await send(message)
+                    return
+                # la risposta dipende dall'header del client: le cache lo devono sapere
+                vary = _header(headers, b"vary")
+                if vary is None:
+                    headers.append((b"vary", b"Accept-Encoding"))
+                elif b"accept-encoding" not in vary.lower():
+                    headers = [(k, v + b", Accept-Encoding" if k.lower() == b"vary" else v) for k, v in headers]
+                message = {**message, "headers": headers}
+                if encoding is None:
+                    passthrough = True
+                    await send(message)
+                    return
+                start = message  # inviato col primo blocco di corpo
+                return
+
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if encoder is None:
+                if not more and len(body) < self.opts["min_size"]:
+                    await send(start)
+                    await send(message)
+                    passthrough = True
+                    return
+                encoder = _Encoder(encoding, self.opts)
+                headers = [(k, v) for k, v in start["headers"] if k.lower() != b"content-length"]
+                headers.append((b"content-encoding", encoding.encode("ascii")))
+                if not more:
+                    data = encoder.chunk(body, True)
+                    headers.append((b"content-length", str(len(data)).encode("ascii")))
+                    await send({**start, "headers": headers})
+                    await send({"type": "http.response.body", "body": data})
+                    return
+                await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": encoder.chunk(body, not more), "more_body": more})
+
+        await self.app(scope, receive, wrapped)
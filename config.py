@@ -1,14 +1,43 @@
+import importlib.util
 import os
-import yaml
-from typing import List
+from typing import Any, List
 
 # ---------- CONFIG: SOLO config.yml ----------
-CFG_PATH = os.getenv("TP_CONFIG", "config.yml")
-if not os.path.isfile(CFG_PATH):
-    raise SystemExit(f"config.yml non trovato: {os.path.abspath(CFG_PATH)}")
-
-with open(CFG_PATH, "r", encoding="utf-8") as f:
-    cfg = yaml.safe_load(f)
+# Impostazioni caricate pigramente da ``load()`` (vedi ``__getattr__``).
+_SETTINGS = {
+    "cfg",
+    "CFG_PATH",
+    "MQTT_HOST",
+    "MQTT_PORT",
+    "MQTT_USER",
+    "MQTT_PASS",
+    "MQTT_CLIENT_ID",
+    "MQTT_PROTO",
+    "MQTT_TOPICS",
+    "TLS_CFG",
+    "EMBEDDED_BROKER",
+    "DB_PATH",
+    "COLD_PATH",
+    "COLD_AFTER_DAYS",
+    "COMPRESSION",
+    "BACKUP_DIR",
+    "BACKUP_KEEP",
+    "TUNING_PROFILE",
+    "TUNING_PROFILES",
+    "MAINTENANCE",
+    "WEB_HOST",
+    "WEB_PORT",
+    "ALLOW_CORS",
+    "RESPONSE_CACHE_MB",
+    "DB_EXECUTOR",
+    "HTTP_COMPRESSION",
+    "HTML_MAX_AGE",
+    "ADMIN_SQL",
+    "TRACEROUTE_TTL",
+    "PROTOBUF_DECODE",
+    "HAVE_MESHTASTIC",
+}
+_LOADED = False
 
 
 def _normalize_topics(raw) -> List[str]:
@@ -26,63 +55,132 @@ def _normalize_topics(raw) -> List[str]:
         return out
     return []
 
-# Sezioni richieste
-if "mqtt" not in cfg or "storage" not in cfg or "web" not in cfg:
-    raise SystemExit(f"config.yml mancante sezioni mqtt/storage/web. File: {os.path.abspath(CFG_PATH)}")
-
-MQTT_HOST = cfg["mqtt"].get("host")
-MQTT_PORT = int(cfg["mqtt"].get("port", 0))
-MQTT_USER = cfg["mqtt"].get("username") or None
-MQTT_PASS = cfg["mqtt"].get("password") or None
-MQTT_CLIENT_ID = cfg["mqtt"].get("client_id", "telemetry-plotter")
-MQTT_PROTO = (cfg["mqtt"].get("protocol", "v311") or "v311").lower()
-MQTT_TOPICS = _normalize_topics(cfg["mqtt"].get("topics"))
-TLS_CFG = cfg["mqtt"].get("tls") or {"enabled": False}
-EMBEDDED_BROKER = bool(cfg["mqtt"].get("embedded_broker", False))
-
-# Percorso SQLite relativo al file di config
-_raw_db_path = cfg["storage"].get("sqlite_path")
-if not _raw_db_path:
-    raise SystemExit("[CFG] storage.sqlite_path mancante in config.yml")
-if _raw_db_path == ":memory:":
-    DB_PATH = _raw_db_path
-else:
-    cfg_dir = os.path.dirname(os.path.abspath(CFG_PATH))
-    DB_PATH = os.path.abspath(os.path.join(cfg_dir, _raw_db_path))
-
-WEB_HOST = cfg["web"].get("host", "0.0.0.0")
-WEB_PORT = int(cfg["web"].get("port", 8080))
-ALLOW_CORS = bool(cfg["web"].get("allow_cors", True))
-# Rimuove automaticamente le tracce di traceroute più vecchie di 12 ore
-# se non diversamente specificato nella configurazione.
-TRACEROUTE_TTL = int(cfg["web"].get("traceroute_ttl", 12 * 3600))
-
-# Diagnostica avvio (no password)
-print(f"[CFG] Loaded: {os.path.abspath(CFG_PATH)}")
-print(f"[CFG] MQTT host={MQTT_HOST} port={MQTT_PORT} client_id={MQTT_CLIENT_ID} proto={MQTT_PROTO}")
-print(f"[CFG] Topics (raw type={type(cfg['mqtt'].get('topics')).__name__}): {cfg['mqtt'].get('topics')!r}")
-print(f"[CFG] Topics (normalized): {MQTT_TOPICS}")
-print(f"[CFG] SQLite DB: {DB_PATH}")
-print(f"[CFG] Embedded broker: {EMBEDDED_BROKER}")
-
-if not MQTT_HOST or not MQTT_PORT:
-    raise SystemExit("[CFG] mqtt.host/port mancanti in config.yml")
-if not MQTT_TOPICS:
-    raise SystemExit("[CFG] mqtt.topics è vuoto. In config.yml usa: topics: \"#\" oppure una lista di topic.")
-
-# --------- Protobuf decode ON di default ----------
-PROTOBUF_DECODE = bool(cfg.get("protobuf_decode", True))
-HAVE_MESHTASTIC = False
-if PROTOBUF_DECODE:
+
+def _module_available(name: str) -> bool:
     try:
-        from google.protobuf.json_format import MessageToDict  # noqa: F401
-        from meshtastic import telemetry_pb2, mesh_pb2, portnums_pb2  # noqa: F401
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def load() -> None:
+    """Legge ``config.yml`` e pubblica le impostazioni come attributi del modulo.
+
+    Viene chiamata automaticamente al primo accesso a un'impostazione, così un
+    semplice ``import config`` non costa nulla.
+    """
+    global _LOADED
+    CFG_PATH = os.getenv("TP_CONFIG", "config.yml")
+    if not os.path.isfile(CFG_PATH):
+        raise SystemExit(f"config.yml non trovato: {os.path.abspath(CFG_PATH)}")
+
+    import yaml
+
+    with open(CFG_PATH, "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+
+    # Sezioni richieste
+    if "mqtt" not in cfg or "storage" not in cfg or "web" not in cfg:
+        raise SystemExit(f"config.yml mancante sezioni mqtt/storage/web. File: {os.path.abspath(CFG_PATH)}")
+
+    MQTT_HOST = cfg["mqtt"].get("host")
+    MQTT_PORT = int(cfg["mqtt"].get("port", 0))
+    MQTT_USER = cfg["mqtt"].get("username") or None
+    MQTT_PASS = cfg["mqtt"].get("password") or None
+    MQTT_CLIENT_ID = cfg["mqtt"].get("client_id", "telemetry-plotter")
+    MQTT_PROTO = (cfg["mqtt"].get("protocol", "v311") or "v311").lower()
+    MQTT_TOPICS = _normalize_topics(cfg["mqtt"].get("topics"))
+    TLS_CFG = cfg["mqtt"].get("tls") or {"enabled": False}
+    EMBEDDED_BROKER = bool(cfg["mqtt"].get("embedded_broker", False))
+
+    # Percorso SQLite relativo al file di config
+    _raw_db_path = cfg["storage"].get("sqlite_path")
+    if not _raw_db_path:
+        raise SystemExit("[CFG] storage.sqlite_path mancante in config.yml")
+    if _raw_db_path == ":memory:":
+        DB_PATH = _raw_db_path
+    else:
+        cfg_dir = os.path.dirname(os.path.abspath(CFG_PATH))
+        DB_PATH = os.path.abspath(os.path.join(cfg_dir, _raw_db_path))
+
+    # Archivio freddo (segmenti colonnari), disattivato se cold_path manca
+    _raw_cold_path = cfg["storage"].get("cold_path")
+    COLD_PATH = (
+        os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(CFG_PATH)), _raw_cold_path))
+        if _raw_cold_path
+        else None
+    )
+    COLD_AFTER_DAYS = int(cfg["storage"].get("cold_after_days", 7))
+    # Snapshot del DB (endpoint /api/admin/backup e ``python backup.py``)
+    _raw_backup_dir = cfg["storage"].get("backup_dir") or "./backups"
+    BACKUP_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(CFG_PATH)), _raw_backup_dir))
+    BACKUP_KEEP = int(cfg["storage"].get("backup_keep", 7))
+    # Profili PRAGMA (vedi maintenance.PROFILES) e scheduler di manutenzione
+    _tuning = cfg["storage"].get("tuning") or {}
+    TUNING_PROFILE = _tuning.get("profile") or "default"
+    TUNING_PROFILES = _tuning.get("profiles") or {}
+    MAINTENANCE = cfg["storage"].get("maintenance") or {}
+    # Compressione delle ore chiuse in blocchi delta-of-delta/XOR ("gorilla")
+    COMPRESSION = (cfg["storage"].get("compression") or "none").lower()
+    if COMPRESSION not in ("none", "gorilla"):
+        raise SystemExit(f"[CFG] storage.compression non valido: {COMPRESSION!r} (usa none o gorilla)")
+
+    WEB_HOST = cfg["web"].get("host", "0.0.0.0")
+    WEB_PORT = int(cfg["web"].get("port", 8080))
+    ALLOW_CORS = bool(cfg["web"].get("allow_cors", True))
+    # Cache delle risposte di /api/nodes, /api/traceroutes e /api/metrics (0 = disattivata)
+    RESPONSE_CACHE_MB = float(cfg["web"].get("response_cache_mb", 32))
+    # Limiti per classe di endpoint dell'executor DB (vedi dbexec.DEFAULT_LIMITS)
+    DB_EXECUTOR = cfg["web"].get("db_executor") or {}
+    # Compressione gzip/brotli delle risposte (vedi compress.DEFAULTS)
+    HTTP_COMPRESSION = cfg["web"].get("compression") or {}
+    # Durata in cache (secondi) delle pagine HTML; gli asset hashati sono immutabili
+    HTML_MAX_AGE = int(cfg["web"].get("html_max_age", 60))
+    # Limiti della console SQL di amministrazione (vedi sqlconsole.DEFAULTS)
+    ADMIN_SQL = cfg["web"].get("admin_sql") or {}
+    # Rimuove automaticamente le tracce di traceroute più vecchie di 12 ore
+    # se non diversamente specificato nella configurazione.
+    TRACEROUTE_TTL = int(cfg["web"].get("traceroute_ttl", 12 * 3600))
+
+    # Diagnostica avvio (no password)
+    print(f"[CFG] Loaded: {os.path.abspath(CFG_PATH)}")
+    print(f"[CFG] MQTT host={MQTT_HOST} port={MQTT_PORT} client_id={MQTT_CLIENT_ID} proto={MQTT_PROTO}")
+    print(f"[CFG] Topics (raw type={type(cfg['mqtt'].get('topics')).__name__}): {cfg['mqtt'].get('topics')!r}")
+    print(f"[CFG] Topics (normalized): {MQTT_TOPICS}")
+    print(f"[CFG] SQLite DB: {DB_PATH}")
+    print(f"[CFG] Cold archive: {COLD_PATH or 'disabled'}")
+    print(f"[CFG] SQLite tuning profile: {TUNING_PROFILE}")
+    print(f"[CFG] Embedded broker: {EMBEDDED_BROKER}")
+
+    if not MQTT_HOST or not MQTT_PORT:
+        raise SystemExit("[CFG] mqtt.host/port mancanti in config.yml")
+    if not MQTT_TOPICS:
+        raise SystemExit("[CFG] mqtt.topics è vuoto. In config.yml usa: topics: \"#\" oppure una lista di topic.")
+
+    # --------- Protobuf decode ON di default ----------
+    # Solo verifica di presenza: i moduli vengono importati da ``processing``
+    # al primo payload protobuf, non all'avvio.
+    PROTOBUF_DECODE = bool(cfg.get("protobuf_decode", True))
+    HAVE_MESHTASTIC = False
+    if PROTOBUF_DECODE:
+        missing = [m for m in ("google.protobuf", "meshtastic") if not _module_available(m)]
+        if missing:
+            raise SystemExit(
+                "protobuf_decode=true ma mancano i pacchetti. Esegui:\n"
+                "  pip install meshtastic protobuf\nDettagli: " + ", ".join(missing)
+            )
         HAVE_MESHTASTIC = True
-    except Exception as e:
-        raise SystemExit(
-            "protobuf_decode=true ma mancano i pacchetti. Esegui:\n"
-            "  pip install meshtastic protobuf\nDettagli: " + str(e)
-        )
+
+    globals().update({k: v for k, v in locals().items() if k in _SETTINGS})
+    _LOADED = True
+
+
+def __getattr__(name: str) -> Any:
+    if name in _SETTINGS and not _LOADED:
+        load()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # ---------- Unità ----------
 POWER_V_KEYS = [f"ch{i}_voltage" for i in range(1, 9)]
@@ -1,205 +1,896 @@
+import math
 import sqlite3
 import threading
-from typing import List, Optional
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
-from config import DB_PATH
+import estimator
+import instrument
+import maintenance
+import topology
 
-# ---------- DB + migrazioni ----------
-DB_LOCK = threading.Lock()
-DB = sqlite3.connect(DB_PATH, check_same_thread=False)
-DB.execute("PRAGMA journal_mode=WAL")
-DB.execute("PRAGMA synchronous=NORMAL")
 
+class _Connection(sqlite3.Connection):
+    """Connessione condivisa che misura la durata dei commit (vedi :mod:`instrument`)."""
+
+    def commit(self) -> None:
+        with instrument.DB_COMMIT_SECONDS.time():
+            super().commit()
 
-def _cols(table: str) -> List[str]:
-    cur = DB.execute(f"PRAGMA table_info('{table}')")
+
+# ---------- DB + migrazioni ----------
+def _cols(db: sqlite3.Connection, table: str) -> List[str]:
+    cur = db.execute(f"PRAGMA table_info('{table}')")
     return [r[1] for r in cur.fetchall()]
 
 
-def migrate() -> None:
-    with DB_LOCK:
-        # tabelle base
-        DB.execute(
-            """
-            CREATE TABLE IF NOT EXISTS telemetry (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              ts INTEGER,
-              node_id TEXT,
-              node_name TEXT,
-              metric TEXT NOT NULL,
-              value REAL NOT NULL,
-              ts_ms INTEGER, topic TEXT, node TEXT, raw_json TEXT
-            )
-            """,
+def _table_exists(db: sqlite3.Connection, table: str) -> bool:
+    cur = db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,))
+    return cur.fetchone() is not None
+
+
+def _schedule_backfill(db: sqlite3.Connection, name: str, table: str) -> None:
+    """Registra un backfill da eseguire a blocchi in background.
+
+    Il limite superiore è fissato al ``MAX(id)`` attuale: le righe inserite
+    dopo la migrazione sono già nel formato nuovo e non vanno toccate.
+    """
+    max_id = db.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0]
+    if max_id is None:
+        return
+    db.execute(
+        "INSERT OR IGNORE INTO schema_backfills(name, table_name, last_id, max_id) VALUES(?,?,0,?)",
+        (name, table, max_id),
+    )
+
+
+def _migration_1(db: sqlite3.Connection, legacy: bool) -> None:
+    """Schema di base: tabelle, colonne aggiunte nel tempo e indici."""
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS telemetry (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          ts INTEGER,
+          node_id TEXT,
+          node_name TEXT,
+          metric TEXT NOT NULL,
+          value REAL NOT NULL,
+          ts_ms INTEGER, topic TEXT, node TEXT, raw_json TEXT
         )
+        """,
+    )
 
-        DB.execute(
-            """
-            CREATE TABLE IF NOT EXISTS nodes (
-              node_id TEXT PRIMARY KEY,
-              short_name TEXT,
-              long_name TEXT,
-              nickname TEXT,
-              last_seen INTEGER,
-              info_packets INTEGER DEFAULT 0,
-              lat REAL,
-              lon REAL,
-              alt REAL
-            )
-            """,
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS nodes (
+          node_id TEXT PRIMARY KEY,
+          short_name TEXT,
+          long_name TEXT,
+          nickname TEXT,
+          last_seen INTEGER,
+          info_packets INTEGER DEFAULT 0,
+          lat REAL,
+          lon REAL,
+          alt REAL
+        )
+        """,
+    )
+
+    # colonne telemetry
+    tcols = _cols(db, "telemetry")
+    if "ts" not in tcols:
+        db.execute("ALTER TABLE telemetry ADD COLUMN ts INTEGER")
+    if "node_id" not in tcols:
+        db.execute("ALTER TABLE telemetry ADD COLUMN node_id TEXT")
+    if "node_name" not in tcols:
+        db.execute("ALTER TABLE telemetry ADD COLUMN node_name TEXT")
+
+    # colonne nodes (aggiungi se mancano)
+    ncols = _cols(db, "nodes")
+    if "short_name" not in ncols:
+        db.execute("ALTER TABLE nodes ADD COLUMN short_name TEXT")
+    if "long_name" not in ncols:
+        db.execute("ALTER TABLE nodes ADD COLUMN long_name TEXT")
+    if "nickname" not in ncols:
+        db.execute("ALTER TABLE nodes ADD COLUMN nickname TEXT")
+    if "last_seen" not in ncols:
+        db.execute("ALTER TABLE nodes ADD COLUMN last_seen INTEGER")
+    if "info_packets" not in ncols:
+        db.execute("ALTER TABLE nodes ADD COLUMN info_packets INTEGER DEFAULT 0")
+    if "lat" not in ncols:
+        db.execute("ALTER TABLE nodes ADD COLUMN lat REAL")
+    if "lon" not in ncols:
+        db.execute("ALTER TABLE nodes ADD COLUMN lon REAL")
+    if "alt" not in ncols:
+        db.execute("ALTER TABLE nodes ADD COLUMN alt REAL")
+    if "pos_ts" not in ncols:
+        db.execute("ALTER TABLE nodes ADD COLUMN pos_ts INTEGER")
+    if legacy:
+        # la tabella nodes resta piccola: la correzione si fa subito, una volta sola
+        db.execute("UPDATE nodes SET last_seen = 0 WHERE last_seen IS NULL")
+        db.execute("UPDATE nodes SET info_packets = 0 WHERE info_packets IS NULL")
+
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS traceroutes (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          ts INTEGER,
+          src_id TEXT,
+          dest_id TEXT,
+          route TEXT,
+          hop_count INTEGER,
+          radio TEXT
         )
+        """,
+    )
+
+    if "radio" not in _cols(db, "traceroutes"):
+        db.execute("ALTER TABLE traceroutes ADD COLUMN radio TEXT")
 
-        # colonne telemetry
-        tcols = _cols("telemetry")
-        if "ts" not in tcols:
-            DB.execute("ALTER TABLE telemetry ADD COLUMN ts INTEGER")
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          ts INTEGER,
+          node_id TEXT,
+          portnum TEXT,
+          raw_json TEXT
+        )
+        """,
+    )
+
+    # indici
+    db.execute("CREATE INDEX IF NOT EXISTS idx_telem_ts ON telemetry(ts)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_telem_nodeid ON telemetry(node_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_telem_metric ON telemetry(metric)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_nodes_name ON nodes(COALESCE(nickname, long_name, short_name))")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_traceroutes_ts ON traceroutes(ts)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages(ts)")
+
+    # backfill delle righe telemetry storiche: eseguiti a blocchi in background
+    if legacy:
         if "ts_ms" in tcols:
-            DB.execute("UPDATE telemetry SET ts = COALESCE(ts, ts_ms/1000)")
-        if "node_id" not in tcols:
-            DB.execute("ALTER TABLE telemetry ADD COLUMN node_id TEXT")
+            _schedule_backfill(db, "telemetry_ts_from_ts_ms", "telemetry")
         if "node" in tcols:
-            DB.execute("UPDATE telemetry SET node_id = COALESCE(node_id, node)")
-        if "node_name" not in tcols:
-            DB.execute("ALTER TABLE telemetry ADD COLUMN node_name TEXT")
-        DB.execute("UPDATE telemetry SET metric='humidity' WHERE metric='relative_humidity'")
-        DB.execute("UPDATE telemetry SET metric='pressure'  WHERE metric='barometric_pressure'")
-
-        # colonne nodes (aggiungi se mancano)
-        ncols = _cols("nodes")
-        if "short_name" not in ncols:
-            DB.execute("ALTER TABLE nodes ADD COLUMN short_name TEXT")
-        if "long_name" not in ncols:
-            DB.execute("ALTER TABLE nodes ADD COLUMN long_name TEXT")
-        if "nickname" not in ncols:
-            DB.execute("ALTER TABLE nodes ADD COLUMN nickname TEXT")
-        if "last_seen" not in ncols:
-            DB.execute("ALTER TABLE nodes ADD COLUMN last_seen INTEGER")
-        if "info_packets" not in ncols:
-            DB.execute("ALTER TABLE nodes ADD COLUMN info_packets INTEGER DEFAULT 0")
-        if "lat" not in ncols:
-            DB.execute("ALTER TABLE nodes ADD COLUMN lat REAL")
-        if "lon" not in ncols:
-            DB.execute("ALTER TABLE nodes ADD COLUMN lon REAL")
-        if "alt" not in ncols:
-            DB.execute("ALTER TABLE nodes ADD COLUMN alt REAL")
-        if "pos_ts" not in ncols:
-            DB.execute("ALTER TABLE nodes ADD COLUMN pos_ts INTEGER")
-        DB.execute("UPDATE nodes SET last_seen = 0 WHERE last_seen IS NULL")
-        DB.execute("UPDATE nodes SET info_packets = 0 WHERE info_packets IS NULL")
-
-        DB.execute(
-            """
-            CREATE TABLE IF NOT EXISTS traceroutes (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              ts INTEGER,
-              src_id TEXT,
-              dest_id TEXT,
-              route TEXT,
-              hop_count INTEGER,
-              radio TEXT
-            )
-            """,
+            _schedule_backfill(db, "telemetry_node_id_from_node", "telemetry")
+        _schedule_backfill(db, "telemetry_metric_names", "telemetry")
+
+
+def _migration_2(db: sqlite3.Connection, legacy: bool) -> None:
+    """Indice dei segmenti colonnari dell'archivio freddo (vedi ``coldstore``)."""
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cold_segments (
+          node_id TEXT NOT NULL,
+          metric TEXT NOT NULL,
+          start_ts INTEGER NOT NULL,
+          end_ts INTEGER NOT NULL,
+          count INTEGER NOT NULL,
+          node_name TEXT,
+          path TEXT NOT NULL,
+          PRIMARY KEY (node_id, metric, start_ts)
         )
+        """,
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_cold_segments_end ON cold_segments(end_ts)")
 
-        tcols = [c[1] for c in DB.execute("PRAGMA table_info(traceroutes)").fetchall()]
-        if "radio" not in tcols:
-            DB.execute("ALTER TABLE traceroutes ADD COLUMN radio TEXT")
 
-        DB.execute(
-            """
-            CREATE TABLE IF NOT EXISTS messages (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              ts INTEGER,
-              node_id TEXT,
-              portnum TEXT,
-              raw_json TEXT
-            )
-            """,
+def _migration_3(db: sqlite3.Connection, legacy: bool) -> None:
+    """Blocchi compressi di telemetria per nodo/metrica/ora (vedi ``tsblock``)."""
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS telemetry_blocks (
+          node_id TEXT NOT NULL,
+          metric TEXT NOT NULL,
+          hour_ts INTEGER NOT NULL,
+          first_ts INTEGER NOT NULL,
+          last_ts INTEGER NOT NULL,
+          count INTEGER NOT NULL,
+          node_name TEXT,
+          data BLOB NOT NULL,
+          PRIMARY KEY (node_id, metric, hour_ts)
         )
+        """,
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_blocks_last_ts ON telemetry_blocks(last_ts)")
 
-        # indici
-        DB.execute("CREATE INDEX IF NOT EXISTS idx_telem_ts ON telemetry(ts)")
-        DB.execute("CREATE INDEX IF NOT EXISTS idx_telem_nodeid ON telemetry(node_id)")
-        DB.execute("CREATE INDEX IF NOT EXISTS idx_telem_metric ON telemetry(metric)")
-        DB.execute("CREATE INDEX IF NOT EXISTS idx_nodes_name ON nodes(COALESCE(nickname, long_name, short_name))")
-        DB.execute("CREATE INDEX IF NOT EXISTS idx_traceroutes_ts ON traceroutes(ts)")
-        DB.execute("CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages(ts)")
-        DB.commit()
-
-
-migrate()
-
-
-def upsert_node(
-    node_id: Optional[str],
-    short_name: Optional[str],
-    long_name: Optional[str],
-    ts: int,
-    info_packet: bool = False,
-    lat: Optional[float] = None,
-    lon: Optional[float] = None,
-    alt: Optional[float] = None,
-    pos_ts: Optional[int] = None,
-) -> None:
-    if not node_id and not (short_name or long_name):
-        return
-    short_name = (short_name or "").strip() or None
-    long_name = (long_name or "").strip() or None
-    inc = 1 if info_packet else 0
-    with DB_LOCK:
-        DB.execute(
-            """
-          INSERT INTO nodes(node_id, short_name, long_name, nickname, last_seen, info_packets, lat, lon, alt, pos_ts)
-          VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-          ON CONFLICT(node_id) DO UPDATE SET
-            short_name = COALESCE(excluded.short_name, nodes.short_name),
-            long_name  = COALESCE(excluded.long_name, nodes.long_name),
-            last_seen  = MAX(nodes.last_seen, excluded.last_seen),
-
-            info_packets = nodes.info_packets + excluded.info_packets,
-            lat = CASE
-                    WHEN nodes.pos_ts IS NULL THEN excluded.lat
-                    WHEN excluded.pos_ts >= nodes.pos_ts THEN excluded.lat
-                    ELSE nodes.lat
-                  END,
-            lon = CASE
-                    WHEN nodes.pos_ts IS NULL THEN excluded.lon
-                    WHEN excluded.pos_ts >= nodes.pos_ts THEN excluded.lon
-                    ELSE nodes.lon
-                  END,
-            alt = CASE
-                    WHEN nodes.pos_ts IS NULL THEN excluded.alt
-                    WHEN excluded.pos_ts >= nodes.pos_ts THEN excluded.alt
-                    ELSE nodes.alt
-                  END,
-            pos_ts = CASE
-                    WHEN nodes.pos_ts IS NULL THEN excluded.pos_ts
-                    WHEN excluded.pos_ts >= nodes.pos_ts THEN excluded.pos_ts
-                    ELSE nodes.pos_ts
-                  END
+
+def _migration_4(db: sqlite3.Connection, legacy: bool) -> None:
+    """Storico delle posizioni e indice R*Tree sulle posizioni correnti dei nodi.
+
+    ``node_rtree`` usa come id quello stabile di ``node_rtree_ids`` (il rowid
+    di ``nodes`` può cambiare con ``VACUUM``) ed è tenuto allineato da trigger
+    su ``nodes``, così ogni scrittura di ``lat``/``lon`` aggiorna l'indice.
+    """
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS positions (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          node_id TEXT NOT NULL,
+          ts INTEGER NOT NULL,
+          lat REAL NOT NULL,
+          lon REAL NOT NULL,
+          alt REAL
+        )
         """,
-            (node_id, short_name, long_name, None, ts, inc, lat, lon, alt, pos_ts),
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_positions_node_ts ON positions(node_id, ts)")
+    db.execute(
+        """
+        INSERT INTO positions(node_id, ts, lat, lon, alt)
+        SELECT node_id, pos_ts, lat, lon, alt FROM nodes
+        WHERE lat IS NOT NULL AND lon IS NOT NULL AND pos_ts > 0
+          AND NOT EXISTS (SELECT 1 FROM positions p WHERE p.node_id = nodes.node_id)
+        """
+    )
+
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS node_rtree_ids (id INTEGER PRIMARY KEY, node_id TEXT NOT NULL UNIQUE)"
+    )
+    db.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS node_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)"
+    )
+    # niente INSERT OR IGNORE/REPLACE nei trigger: la politica di conflitto
+    # dell'istruzione esterna (es. l'UPSERT di ``upsert_node``) la sovrascriverebbe
+    db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS nodes_rtree_insert AFTER INSERT ON nodes
+        WHEN NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL
+        BEGIN
+          INSERT INTO node_rtree_ids(node_id)
+            SELECT NEW.node_id WHERE NOT EXISTS (SELECT 1 FROM node_rtree_ids WHERE node_id = NEW.node_id);
+          DELETE FROM node_rtree WHERE id = (SELECT id FROM node_rtree_ids WHERE node_id = NEW.node_id);
+          INSERT INTO node_rtree
+            SELECT id, NEW.lat, NEW.lat, NEW.lon, NEW.lon FROM node_rtree_ids WHERE node_id = NEW.node_id;
+        END
+        """
+    )
+    db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS nodes_rtree_update AFTER UPDATE OF lat, lon ON nodes
+        BEGIN
+          DELETE FROM node_rtree WHERE id = (SELECT id FROM node_rtree_ids WHERE node_id = OLD.node_id);
+          INSERT INTO node_rtree_ids(node_id)
+            SELECT NEW.node_id WHERE NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM node_rtree_ids WHERE node_id = NEW.node_id);
+          INSERT INTO node_rtree
+            SELECT id, NEW.lat, NEW.lat, NEW.lon, NEW.lon FROM node_rtree_ids
+            WHERE node_id = NEW.node_id AND NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL;
+        END
+        """
+    )
+    db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS nodes_rtree_delete AFTER DELETE ON nodes
+        BEGIN
+          DELETE FROM node_rtree WHERE id = (SELECT id FROM node_rtree_ids WHERE node_id = OLD.node_id);
+          DELETE FROM node_rtree_ids WHERE node_id = OLD.node_id;
+        END
+        """
+    )
+    db.execute(
+        """
+        INSERT OR IGNORE INTO node_rtree_ids(node_id)
+        SELECT node_id FROM nodes WHERE lat IS NOT NULL AND lon IS NOT NULL
+        """
+    )
+    db.execute(
+        """
+        INSERT OR REPLACE INTO node_rtree
+        SELECT g.id, n.lat, n.lat, n.lon, n.lon
+        FROM nodes n JOIN node_rtree_ids g ON g.node_id = n.node_id
+        WHERE n.lat IS NOT NULL AND n.lon IS NOT NULL
+        """
+    )
+
+
+def _migration_5(db: sqlite3.Connection, legacy: bool) -> None:
+    """Indici per il browser dei messaggi e ricerca full-text sui testi.
+
+    Il testo dei messaggi è copiato nella colonna ``messages.text``; se SQLite
+    è compilato con FTS5 la tabella ``messages_fts`` (a contenuto esterno) lo
+    indicizza tramite trigger. Senza FTS5 la ricerca ripiega su ``LIKE``.
+    """
+    if "text" not in _cols(db, "messages"):
+        db.execute("ALTER TABLE messages ADD COLUMN text TEXT")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_messages_node_ts ON messages(node_id, ts)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_messages_portnum_ts ON messages(portnum, ts)")
+    try:
+        db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(text, content='messages', content_rowid='id')"
+        )
+    except sqlite3.OperationalError as e:
+        print(f"[DB] FTS5 non disponibile, ricerca messaggi senza indice: {e}")
+    else:
+        db.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+            WHEN NEW.text IS NOT NULL
+            BEGIN
+              INSERT INTO messages_fts(rowid, text) VALUES (NEW.id, NEW.text);
+            END
+            """
         )
-        name_to_set = long_name or short_name
-        if node_id and name_to_set:
-            DB.execute(
+        db.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+            WHEN OLD.text IS NOT NULL
+            BEGIN
+              INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', OLD.id, OLD.text);
+            END
+            """
+        )
+        db.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF text ON messages
+            BEGIN
+              INSERT INTO messages_fts(messages_fts, rowid, text)
+                SELECT 'delete', OLD.id, OLD.text WHERE OLD.text IS NOT NULL;
+              INSERT INTO messages_fts(rowid, text) SELECT NEW.id, NEW.text WHERE NEW.text IS NOT NULL;
+            END
+            """
+        )
+    if _table_exists(db, "messages"):
+        _schedule_backfill(db, "messages_text", "messages")
+
+
+def _migration_6(db: sqlite3.Connection, legacy: bool) -> None:
+    """Posizioni stimate separate da quelle reali, con indice di adiacenza.
+
+    Le stime (vedi ``estimator``) vanno in ``est_lat``/``est_lon``/``est_alt``.
+    Le versioni precedenti le scrivevano direttamente in ``lat``/``lon`` con
+    ``pos_ts = 0``: quelle righe tornano senza posizione reale e la stima
+    viene ricalcolata. L'R*Tree indicizza la posizione reale o, in mancanza,
+    quella stimata.
+    """
+    cols = _cols(db, "nodes")
+    for col in ("est_lat", "est_lon", "est_alt"):
+        if col not in cols:
+            db.execute(f"ALTER TABLE nodes ADD COLUMN {col} REAL")
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS node_links (
+          a TEXT NOT NULL,
+          b TEXT NOT NULL,
+          routes INTEGER NOT NULL,
+          PRIMARY KEY (a, b)
+        ) WITHOUT ROWID
+        """
+    )
+    db.execute(
+        """
+        UPDATE nodes SET lat = NULL, lon = NULL, alt = NULL, pos_ts = NULL
+        WHERE pos_ts = 0 AND NOT EXISTS (SELECT 1 FROM positions p WHERE p.node_id = nodes.node_id)
+        """
+    )
+
+    db.execute("DROP TRIGGER IF EXISTS nodes_rtree_insert")
+    db.execute("DROP TRIGGER IF EXISTS nodes_rtree_update")
+    db.execute(
+        """
+        CREATE TRIGGER nodes_rtree_insert AFTER INSERT ON nodes
+        WHEN COALESCE(NEW.lat, NEW.est_lat) IS NOT NULL AND COALESCE(NEW.lon, NEW.est_lon) IS NOT NULL
+        BEGIN
+          INSERT INTO node_rtree_ids(node_id)
+            SELECT NEW.node_id WHERE NOT EXISTS (SELECT 1 FROM node_rtree_ids WHERE node_id = NEW.node_id);
+          DELETE FROM node_rtree WHERE id = (SELECT id FROM node_rtree_ids WHERE node_id = NEW.node_id);
+          INSERT INTO node_rtree
+            SELECT id, COALESCE(NEW.lat, NEW.est_lat), COALESCE(NEW.lat, NEW.est_lat),
+                   COALESCE(NEW.lon, NEW.est_lon), COALESCE(NEW.lon, NEW.est_lon)
+            FROM node_rtree_ids WHERE node_id = NEW.node_id;
+        END
+        """
+    )
+    db.execute(
+        """
+        CREATE TRIGGER nodes_rtree_update AFTER UPDATE OF lat, lon, est_lat, est_lon ON nodes
+        BEGIN
+          DELETE FROM node_rtree WHERE id = (SELECT id FROM node_rtree_ids WHERE node_id = OLD.node_id);
+          INSERT INTO node_rtree_ids(node_id)
+            SELECT NEW.node_id
+            WHERE COALESCE(NEW.lat, NEW.est_lat) IS NOT NULL AND COALESCE(NEW.lon, NEW.est_lon) IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM node_rtree_ids WHERE node_id = NEW.node_id);
+          INSERT INTO node_rtree
+            SELECT id, COALESCE(NEW.lat, NEW.est_lat), COALESCE(NEW.lat, NEW.est_lat),
+                   COALESCE(NEW.lon, NEW.est_lon), COALESCE(NEW.lon, NEW.est_lon)
+            FROM node_rtree_ids
+            WHERE node_id = NEW.node_id
+              AND COALESCE(NEW.lat, NEW.est_lat) IS NOT NULL AND COALESCE(NEW.lon, NEW.est_lon) IS NOT NULL;
+        END
+        """
+    )
+    # la ricostruzione aggiorna ``est_*``: i trigger qui sopra allineano l'R*Tree
+    estimator.rebuild(db)
+
+
+def _migration_7(db: sqlite3.Connection, legacy: bool) -> None:
+    """Aggregati di telemetria mantenuti dall'ingest (vedi :meth:`Storage.store_metric`).
+
+    ``latest_metric`` tiene l'ultimo campione di ogni coppia nodo/metrica,
+    ``metric_rollup`` conteggio, somma, minimo e massimo per ora. Le righe
+    già presenti in ``telemetry`` vengono aggregate da due backfill a blocchi.
+    """
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS latest_metric (
+          node_id TEXT NOT NULL,
+          metric TEXT NOT NULL,
+          ts INTEGER NOT NULL,
+          value REAL NOT NULL,
+          PRIMARY KEY (node_id, metric)
+        ) WITHOUT ROWID
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metric_rollup (
+          node_id TEXT NOT NULL,
+          metric TEXT NOT NULL,
+          bucket_ts INTEGER NOT NULL,
+          count INTEGER NOT NULL,
+          sum REAL NOT NULL,
+          min REAL NOT NULL,
+          max REAL NOT NULL,
+          PRIMARY KEY (node_id, metric, bucket_ts)
+        ) WITHOUT ROWID
+        """
+    )
+    _schedule_backfill(db, "telemetry_latest_metric", "telemetry")
+    _schedule_backfill(db, "telemetry_metric_rollup", "telemetry")
+
+
+def _migration_8(db: sqlite3.Connection, legacy: bool) -> None:
+    """Archi della topologia (vedi :mod:`topology`), ricavati dai traceroute presenti."""
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS topology_edges (
+          src TEXT NOT NULL,
+          dst TEXT NOT NULL,
+          first_seen INTEGER NOT NULL,
+          last_seen INTEGER NOT NULL,
+          count INTEGER NOT NULL,
+          hop INTEGER NOT NULL,
+          snr REAL,
+          rssi REAL,
+          PRIMARY KEY (src, dst)
+        ) WITHOUT ROWID
+        """
+    )
+    # i traceroute sono pochi (uno per coppia, con scadenza): basta una passata
+    topology.Graph().rebuild(db)
+
+
+# Migrazioni versionate: (versione, funzione). La versione applicata è salvata
+# in ``PRAGMA user_version``; ogni migrazione viene eseguita una sola volta.
+MIGRATIONS: List[Tuple[int, Callable[[sqlite3.Connection, bool], None]]] = [
+    (1, _migration_1),
+    (2, _migration_2),
+    (3, _migration_3),
+    (4, _migration_4),
+    (5, _migration_5),
+    (6, _migration_6),
+    (7, _migration_7),
+    (8, _migration_8),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Backfill a blocchi: ``name -> UPDATE`` limitato all'intervallo ``id > ? AND id <= ?``.
+BACKFILLS: Dict[str, str] = {
+    "telemetry_ts_from_ts_ms": (
+        "UPDATE telemetry SET ts = ts_ms/1000 WHERE ts IS NULL AND id > ? AND id <= ?"
+    ),
+    "telemetry_node_id_from_node": (
+        "UPDATE telemetry SET node_id = node WHERE node_id IS NULL AND id > ? AND id <= ?"
+    ),
+    "telemetry_metric_names": (
+        """
+        UPDATE telemetry SET metric = CASE metric
+            WHEN 'relative_humidity' THEN 'humidity'
+            WHEN 'barometric_pressure' THEN 'pressure'
+          END
+        WHERE metric IN ('relative_humidity', 'barometric_pressure') AND id > ? AND id <= ?
+        """
+    ),
+    "messages_text": (
+        """
+        UPDATE messages SET text = COALESCE(
+            json_extract(raw_json, '$.decoded.payload.text'),
+            json_extract(raw_json, '$.payload.text'),
+            json_extract(raw_json, '$.text')
+          )
+        WHERE text IS NULL AND json_valid(raw_json) AND id > ? AND id <= ?
+        """
+    ),
+}
+# Aggregati orari (``metric_rollup``): stessa upsert per ingest e backfill.
+ROLLUP_BUCKET_S = 3600
+_LATEST_UPSERT = """
+    ON CONFLICT(node_id, metric) DO UPDATE SET ts = excluded.ts, value = excluded.value
+    WHERE excluded.ts >= latest_metric.ts
+"""
+_ROLLUP_UPSERT = """
+    ON CONFLICT(node_id, metric, bucket_ts) DO UPDATE SET
+      count = metric_rollup.count + excluded.count,
+      sum = metric_rollup.sum + excluded.sum,
+      min = MIN(metric_rollup.min, excluded.min),
+      max = MAX(metric_rollup.max, excluded.max)
+"""
+BACKFILLS["telemetry_latest_metric"] = f"""
+    INSERT INTO latest_metric(node_id, metric, ts, value)
+    SELECT node_id, metric, ts, value FROM telemetry
+    WHERE ts IS NOT NULL AND node_id IS NOT NULL AND id > ? AND id <= ?
+    {_LATEST_UPSERT}
+"""
+BACKFILLS["telemetry_metric_rollup"] = f"""
+    INSERT INTO metric_rollup(node_id, metric, bucket_ts, count, sum, min, max)
+    SELECT node_id, metric, ts - ts % {ROLLUP_BUCKET_S}, COUNT(*), SUM(value), MIN(value), MAX(value)
+    FROM telemetry
+    WHERE ts IS NOT NULL AND node_id IS NOT NULL AND id > ? AND id <= ?
+    GROUP BY node_id, metric, ts - ts % {ROLLUP_BUCKET_S}
+    {_ROLLUP_UPSERT}
+"""
+BACKFILL_CHUNK = 5000
+BACKFILL_TABLES = {name: name.split("_", 1)[0] for name in BACKFILLS}
+
+# Soglie di deduplica dello storico posizioni: un nuovo punto viene salvato
+# solo se il nodo si è spostato di almeno ``POSITION_MIN_DISTANCE_M`` metri o
+# se dal punto precedente sono passati almeno ``POSITION_MIN_INTERVAL_S`` secondi.
+POSITION_MIN_DISTANCE_M = 25.0
+POSITION_MIN_INTERVAL_S = 3600
+
+
+def distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distanza in metri tra due coordinate (formula dell'emisenoverso)."""
+    r = 6371000.0
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * r * math.asin(min(1.0, math.sqrt(a)))
+
+
+class Storage:
+    """Connessione SQLite condivisa, con il lock che la protegge.
+
+    Nessuna connessione viene aperta all'import del modulo: l'oggetto è creato
+    esplicitamente (``lifespan`` dell'API o CLI) e passato a ``processing`` e
+    alle route, oppure ottenuto on demand con :func:`get_storage`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        migrate: bool = True,
+        cold_path: Optional[str] = None,
+        tuning: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.path = path
+        self.position_min_distance_m = POSITION_MIN_DISTANCE_M
+        self.position_min_interval_s = POSITION_MIN_INTERVAL_S
+        # directory dei segmenti dell'archivio freddo; ``None`` lo disabilita
+        self.cold_path = cold_path
+        # PRAGMA del profilo di tuning attivo (vedi ``maintenance.PROFILES``)
+        self.tuning = dict(tuning or {})
+        # l'attesa per il lock finisce in ``meshplotter_db_lock_wait_seconds``
+        self.lock = instrument.TimedLock(instrument.DB_LOCK_WAIT_SECONDS)
+        # versioni per tabella, incrementate a ogni scrittura (vedi :meth:`touch`);
+        # ``epoch`` distingue le istanze, perché i contatori ripartono da zero
+        self.epoch = uuid.uuid4().hex[:8]
+        self.versions: Dict[Any, int] = {}
+        self.modified: Dict[str, float] = {}
+        self.opened_at = time.time()
+        # letture in corso di tutti i livelli di telemetria (vedi :meth:`hold_tiers`)
+        self.tier_holds = 0
+        self._opened_mono = time.monotonic()
+        self.conn = sqlite3.connect(path, check_same_thread=False, factory=_Connection)
+        # grafo dei collegamenti radio, specchio di ``topology_edges``
+        self.topology = topology.Graph()
+        if path != ":memory:" and not _table_exists(self.conn, "telemetry"):
+            # DB nuovo: page_size e auto_vacuum si possono scegliere solo ora
+            if self.tuning.get("page_size"):
+                self.conn.execute(f"PRAGMA page_size = {int(self.tuning['page_size'])}")
+            self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        maintenance.apply_tuning(self.conn, {k: v for k, v in self.tuning.items() if k != "page_size"})
+        if migrate:
+            self.migrate()
+        if _table_exists(self.conn, "topology_edges"):
+            self.topology.load(self.conn)
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+    def touch(self, *tables: str, node_id: Optional[str] = None) -> None:
+        """Segnala una modifica alle tabelle indicate (senza argomenti: a tutte).
+
+        Con ``node_id`` la modifica riguarda un solo nodo: chi dipende da altri
+        nodi (vedi ``data_version``) non la vede.
+        """
+        # orologio monotono: l'ora di sistema serve solo in ``data_version``
+        now = time.monotonic()
+        for table in tables or ("*",):
+            self.versions[table] = self.versions.get(table, 0) + 1
+            scoped = (table, node_id or "")
+            self.versions[scoped] = self.versions.get(scoped, 0) + 1
+            self.modified[table] = now
+
+    def data_version(
+        self,
+        tables: Tuple[str, ...],
+        node_ids: Optional[List[str]] = None,
+        versions: Optional[Dict[Any, int]] = None,
+    ) -> Tuple[int, float]:
+        """Somma delle versioni e ultima modifica delle tabelle (più quelle globali).
+
+        Con ``node_ids`` contano solo le modifiche a quei nodi e quelle senza
+        nodo. ``versions`` è una copia presa in precedenza con ``versions.copy()``.
+        """
+        v = self.versions if versions is None else versions
+        version = v.get("*", 0)
+        for t in tables:
+            if node_ids is None:
+                version += v.get(t, 0)
+            else:
+                version += v.get((t, ""), 0) + sum(v.get((t, n), 0) for n in node_ids)
+        keys = (*tables, "*")
+        mono = max(self.modified.get(t, self._opened_mono) for t in keys)
+        return version, self.opened_at + (mono - self._opened_mono)
+
+    def migrate(self) -> None:
+        """Porta lo schema all'ultima versione.
+
+        Il costo è costante rispetto alla dimensione dei dati: le migrazioni
+        già applicate vengono saltate e gli aggiornamenti sulle tabelle grandi
+        sono solo registrati in ``schema_backfills`` (vedi :meth:`run_backfills`).
+        """
+        db = self.conn
+        with self.lock:
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_backfills (
+                  name TEXT PRIMARY KEY,
+                  table_name TEXT NOT NULL,
+                  last_id INTEGER NOT NULL DEFAULT 0,
+                  max_id INTEGER NOT NULL
+                )
+                """,
+            )
+            # un DB senza user_version ma con dati proviene da uno schema non versionato
+            legacy = version == 0 and _table_exists(db, "telemetry")
+            for ver, fn in MIGRATIONS:
+                if ver <= version:
+                    continue
+                fn(db, legacy)
+                db.execute(f"PRAGMA user_version = {int(ver)}")
+                db.commit()
+
+    @contextmanager
+    def hold_tiers(self) -> Iterator[None]:
+        """Sospende compattazione e sigillatura finché il blocco è attivo.
+
+        Un export lungo legge archivio freddo, blocchi e righe in momenti
+        diversi: nel frattempo nessun campione deve cambiare livello.
+        """
+        with self.lock:
+            self.tier_holds += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.tier_holds -= 1
+
+    def pending_backfills(self) -> List[Tuple[str, int, int]]:
+        """Restituisce ``(name, last_id, max_id)`` per i backfill non completati."""
+        with self.lock:
+            cur = self.conn.execute(
+                # in ordine di registrazione: gli aggregati seguono le correzioni di ts e metric
+                "SELECT name, last_id, max_id FROM schema_backfills WHERE last_id < max_id ORDER BY rowid"
+            )
+            return [tuple(r) for r in cur.fetchall()]
+
+    def run_backfills(self, chunk: int = BACKFILL_CHUNK, pause: float = 0.0) -> int:
+        """Esegue i backfill pendenti a blocchi di ``chunk`` righe.
+
+        Ogni blocco è una transazione breve che salva anche l'avanzamento, così
+        l'ingest non resta bloccato e un riavvio riprende da dove si era fermato.
+        Restituisce il numero di blocchi elaborati.
+        """
+        done = 0
+        for name, last_id, max_id in self.pending_backfills():
+            sql = BACKFILLS.get(name)
+            while sql and last_id < max_id:
+                upper = min(last_id + chunk, max_id)
+                with self.lock:
+                    self.conn.execute(sql, (last_id, upper))
+                    self.conn.execute("UPDATE schema_backfills SET last_id=? WHERE name=?", (upper, name))
+                    self.conn.commit()
+                    self.touch(BACKFILL_TABLES.get(name, "*"))
+                last_id = upper
+                done += 1
+                if pause:
+                    time.sleep(pause)
+        return done
+
+    def start_backfills(self, chunk: int = BACKFILL_CHUNK, pause: float = 0.05) -> Optional[threading.Thread]:
+        """Avvia i backfill pendenti in un thread in background, se ce ne sono."""
+        if not self.pending_backfills():
+            return None
+
+        def run():
+            try:
+                self.run_backfills(chunk, pause)
+            except Exception as e:
+                print(f"[DB] Backfill interrotto: {e}")
+
+        thread = threading.Thread(target=run, name="db-backfill", daemon=True)
+        thread.start()
+        return thread
+
+    def upsert_node(
+        self,
+        node_id: Optional[str],
+        short_name: Optional[str],
+        long_name: Optional[str],
+        ts: int,
+        info_packet: bool = False,
+        lat: Optional[float] = None,
+        lon: Optional[float] = None,
+        alt: Optional[float] = None,
+        pos_ts: Optional[int] = None,
+    ) -> None:
+        if not node_id and not (short_name or long_name):
+            return
+        short_name = (short_name or "").strip() or None
+        long_name = (long_name or "").strip() or None
+        inc = 1 if info_packet else 0
+        with self.lock:
+            self.conn.execute(
                 """
-              UPDATE telemetry SET node_name = ?
-              WHERE node_id = ? AND (node_name IS NULL OR node_name = '')
+              INSERT INTO nodes(node_id, short_name, long_name, nickname, last_seen, info_packets, lat, lon, alt, pos_ts)
+              VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+              ON CONFLICT(node_id) DO UPDATE SET
+                short_name = COALESCE(excluded.short_name, nodes.short_name),
+                long_name  = COALESCE(excluded.long_name, nodes.long_name),
+                last_seen  = MAX(nodes.last_seen, excluded.last_seen),
+
+                info_packets = nodes.info_packets + excluded.info_packets,
+                lat = CASE
+                        WHEN nodes.pos_ts IS NULL THEN excluded.lat
+                        WHEN excluded.pos_ts >= nodes.pos_ts THEN excluded.lat
+                        ELSE nodes.lat
+                      END,
+                lon = CASE
+                        WHEN nodes.pos_ts IS NULL THEN excluded.lon
+                        WHEN excluded.pos_ts >= nodes.pos_ts THEN excluded.lon
+                        ELSE nodes.lon
+                      END,
+                alt = CASE
+                        WHEN nodes.pos_ts IS NULL THEN excluded.alt
+                        WHEN excluded.pos_ts >= nodes.pos_ts THEN excluded.alt
+                        ELSE nodes.alt
+                      END,
+                pos_ts = CASE
+                        WHEN nodes.pos_ts IS NULL THEN excluded.pos_ts
+                        WHEN excluded.pos_ts >= nodes.pos_ts THEN excluded.pos_ts
+                        ELSE nodes.pos_ts
+                      END
             """,
-                (name_to_set, node_id),
+                (node_id, short_name, long_name, None, ts, inc, lat, lon, alt, pos_ts),
             )
+            if node_id and lat is not None and lon is not None and pos_ts:
+                self._record_position(node_id, pos_ts, lat, lon, alt)
+                estimator.position_changed(self.conn, node_id)
+            elif node_id:
+                # nodo appena comparso ma già visto nei traceroute
+                estimator.refresh(self.conn, [node_id], only_missing=True)
+            name_to_set = long_name or short_name
+            if node_id and name_to_set:
+                self.conn.execute(
+                    """
+                  UPDATE telemetry SET node_name = ?
+                  WHERE node_id = ? AND (node_name IS NULL OR node_name = '')
+                """,
+                    (name_to_set, node_id),
+                )
 
-        DB.commit()
+            self.conn.commit()
+            self.touch("nodes", node_id=node_id)
 
+    def _record_position(self, node_id: str, ts: int, lat: float, lon: float, alt: Optional[float]) -> bool:
+        """Aggiunge un punto allo storico se supera le soglie di deduplica.
 
-def store_metric(ts: int, node_id: str, metric: str, value: float) -> None:
-    with DB_LOCK:
-        cur = DB.execute("SELECT long_name, short_name FROM nodes WHERE node_id=?", (node_id,))
-        row = cur.fetchone()
-        node_name = (row[0] or row[1]) if row else None
-        DB.execute(
-            "INSERT INTO telemetry(ts, node_id, node_name, metric, value) VALUES(?,?,?,?,?)",
-            (ts, node_id, node_name, metric, float(value)),
+        Il confronto è con il punto immediatamente precedente a ``ts``, così
+        anche le posizioni arrivate fuori ordine vengono deduplicate.
+        Va chiamato con il lock già acquisito.
+        """
+        prev = self.conn.execute(
+            "SELECT ts, lat, lon FROM positions WHERE node_id = ? AND ts <= ? ORDER BY ts DESC LIMIT 1",
+            (node_id, ts),
+        ).fetchone()
+        if prev:
+            if prev[0] == ts:
+                return False
+            near = distance_m(prev[1], prev[2], lat, lon) < self.position_min_distance_m
+            if near and ts - prev[0] < self.position_min_interval_s:
+                return False
+        self.conn.execute(
+            "INSERT INTO positions(node_id, ts, lat, lon, alt) VALUES(?,?,?,?,?)",
+            (node_id, ts, lat, lon, alt),
+        )
+        return True
+
+    def _update_aggregates(self, ts: int, node_id: str, metric: str, value: float) -> None:
+        """Aggiorna ``latest_metric`` e ``metric_rollup``; va chiamato con il lock acquisito."""
+        self.conn.execute(
+            f"INSERT INTO latest_metric(node_id, metric, ts, value) VALUES(?,?,?,?) {_LATEST_UPSERT}",
+            (node_id, metric, ts, value),
+        )
+        self.conn.execute(
+            f"""
+            INSERT INTO metric_rollup(node_id, metric, bucket_ts, count, sum, min, max)
+            VALUES(?,?,?,1,?,?,?) {_ROLLUP_UPSERT}
+            """,
+            (node_id, metric, ts - ts % ROLLUP_BUCKET_S, value, value, value),
         )
-        DB.commit()
+
+    def store_metric(self, ts: int, node_id: str, metric: str, value: float) -> None:
+        with self.lock:
+            cur = self.conn.execute("SELECT long_name, short_name FROM nodes WHERE node_id=?", (node_id,))
+            row = cur.fetchone()
+            node_name = (row[0] or row[1]) if row else None
+            self.conn.execute(
+                "INSERT INTO telemetry(ts, node_id, node_name, metric, value) VALUES(?,?,?,?,?)",
+                (ts, node_id, node_name, metric, float(value)),
+            )
+            self._update_aggregates(ts, node_id, metric, float(value))
+            self.conn.commit()
+            self.touch("telemetry", node_id=node_id)
+
+
+_default: Optional[Storage] = None
+_default_lock = threading.Lock()
+
+
+def open_storage(path: Optional[str] = None) -> Storage:
+    """Apre (e migra) il DB indicato o quello di ``config.yml``."""
+    from config import COLD_PATH, TUNING_PROFILE, TUNING_PROFILES
+
+    if path is None:
+        from config import DB_PATH
+
+        path = DB_PATH
+    tuning = maintenance.resolve_profile(TUNING_PROFILE, TUNING_PROFILES)
+    return Storage(path, cold_path=COLD_PATH, tuning=tuning)
+
+
+def get_storage() -> Storage:
+    """Restituisce lo storage predefinito, aprendolo al primo utilizzo."""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = open_storage()
+    return _default
+
+
+def set_storage(storage: Optional[Storage]) -> None:
+    """Imposta (o azzera con ``None``) lo storage predefinito."""
+    global _default
+    with _default_lock:
+        _default = storage
+
+
+def __getattr__(name: str) -> Any:
+    # compatibilità: ``database.DB`` / ``database.DB_LOCK`` aprono lo storage predefinito
+    if name == "DB":
+        return get_storage().conn
+    if name == "DB_LOCK":
+        return get_storage().lock
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
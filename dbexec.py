@@ -0,0 +1,137 @@
+"""Executor dedicato al lavoro sul DB per gli handler async dell'API.
+
+Gli handler ``async`` non bloccano l'event loop: le query vanno in un pool
+di thread separato dal threadpool di AnyIO, così file statici e pagine HTML
+non restano mai in coda dietro a query pesanti.
+
+Ogni classe di endpoint ha un limite di richieste in esecuzione e un tempo
+massimo di attesa in coda. Il pool ha tanti thread quanti la somma dei
+limiti: una classe satura (es. ``heavy``) non può occupare i thread riservati
+alle altre. Chi attende oltre il timeout riceve :class:`Overloaded` (l'API
+risponde 503 con ``Retry-After``).
+"""
+
+import asyncio
+import functools
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# classe -> (richieste in esecuzione, attesa massima in coda in secondi)
+DEFAULT_LIMITS: Dict[str, Tuple[int, float]] = {
+    # letture puntuali e scritture brevi (nodi, traceroute, nickname)
+    "light": (8, 5.0),
+    # serie storiche, ricerca nei messaggi, esportazioni
+    "heavy": (2, 15.0),
+    # SQL arbitrario e backup
+    "admin": (1, 30.0),
+}
+
+
+class Overloaded(RuntimeError):
+    """Nessuno slot libero entro il tempo massimo di attesa."""
+
+    def __init__(self, kind: str, timeout: float) -> None:
+        super().__init__(f"troppe richieste {kind} in corso (attesa oltre {timeout:g} s)")
+        self.kind = kind
+        self.timeout = timeout
+
+
+def parse_limits(cfg: Optional[Dict[str, Any]] = None) -> Dict[str, Tuple[int, float]]:
+    """Limiti predefiniti aggiornati con ``{classe: {workers, queue_timeout}}``."""
+    limits = dict(DEFAULT_LIMITS)
+    for kind, opts in (cfg or {}).items():
+        workers, timeout = limits.get(kind, (1, 10.0))
+        opts = opts or {}
+        workers = int(opts.get("workers", workers))
+        timeout = float(opts.get("queue_timeout", timeout))
+        if workers < 1:
+            raise ValueError(f"db_executor.{kind}.workers deve essere almeno 1")
+        limits[kind] = (workers, timeout)
+    return limits
+
+
+class DBExecutor:
+    """Pool di thread con limiti di concorrenza e di attesa per classe."""
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[int, float]]] = None) -> None:
+        self.limits = dict(limits or DEFAULT_LIMITS)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        # un semaforo per classe e per event loop (i test ne usano più d'uno)
+        self._sems: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.running = {k: 0 for k in self.limits}
+        self.waiting = {k: 0 for k in self.limits}
+        self.rejected = {k: 0 for k in self.limits}
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        # creato al primo uso: importare l'API non avvia thread
+        with self._pool_lock:
+            if self._pool is None:
+                workers = sum(n for n, _ in self.limits.values())
+                self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+            return self._pool
+
+    def _semaphore(self, kind: str) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        sems = self._sems.setdefault(loop, {})
+        if kind not in sems:
+            sems[kind] = asyncio.Semaphore(self.limits[kind][0])
+        return sems[kind]
+
+    async def run(self, kind: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Esegue ``fn`` nel pool rispettando i limiti della classe ``kind``."""
+        timeout = self.limits[kind][1]
+        sem = self._semaphore(kind)
+        self.waiting[kind] += 1
+        try:
+            await asyncio.wait_for(sem.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.rejected[kind] += 1
+            raise Overloaded(kind, timeout) from None
+        finally:
+            self.waiting[kind] -= 1
+        loop = asyncio.get_running_loop()
+        self.running[kind] += 1
+
+        def release() -> None:
+            self.running[kind] -= 1
+            sem.release()
+
+        def done(_fut) -> None:
+            # lo slot si libera quando il thread ha finito davvero, anche se
+            # nel frattempo il client si è scollegato
+            try:
+                loop.call_soon_threadsafe(release)
+            except RuntimeError:  # loop già chiuso
+                pass
+
+        try:
+            fut = self.pool.submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            release()
+            raise
+        fut.add_done_callback(done)
+        return await asyncio.wrap_future(fut)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            kind: {
+                "limit": limit,
+                "queue_timeout": timeout,
+                "running": self.running[kind],
+                "waiting": self.waiting[kind],
+                "rejected": self.rejected[kind],
+            }
+            for kind, (limit, timeout) in self.limits.items()
+        }
+
+    def shutdown(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
@@ -0,0 +1,103 @@
+"""Riduzione delle serie temporali per la visualizzazione.
+
+* :func:`lttb` – Largest-Triangle-Three-Buckets: conserva la forma della
+  curva scegliendo in ogni bucket il punto che forma il triangolo più ampio
+  con il punto scelto prima e con la media del bucket successivo.
+* :func:`minmax` – per ogni intervallo di tempo tiene il minimo e il massimo,
+  così picchi e buchi restano visibili.
+
+Entrambe lavorano su sequenze parallele di timestamp e valori già ordinate e
+restituiscono nuove liste; se la serie è già abbastanza corta la restituiscono
+intatta.
+"""
+
+from typing import List, Sequence, Tuple
+
+Series = Tuple[List[int], List[float]]
+
+METHODS = ("lttb", "minmax")
+
+
+def lttb(ts: Sequence[int], values: Sequence[float], threshold: int) -> Series:
+    """Riduce la serie a ``threshold`` punti con l'algoritmo LTTB."""
+    n = len(ts)
+    if threshold >= n or threshold < 3:
+        return list(ts), list(values)
+    out_ts = [ts[0]]
+    out_vals = [values[0]]
+    # i punti interni sono divisi in threshold-2 bucket di ampiezza ``every``
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        nxt_start = end
+        nxt_end = min(int((i + 2) * every) + 1, n)
+        if nxt_start >= nxt_end:
+            # ultimo bucket: il "successivo" è l'ultimo punto
+            avg_t, avg_v = ts[n - 1], values[n - 1]
+        else:
+            cnt = nxt_end - nxt_start
+            avg_t = sum(ts[nxt_start:nxt_end]) / cnt
+            avg_v = sum(values[nxt_start:nxt_end]) / cnt
+        at, av = ts[a], values[a]
+        dt = avg_t - at
+        dv = av - avg_v
+        best = start
+        best_area = -1.0
+        # area (x2) del triangolo a, j, media del bucket successivo
+        for j in range(start, end):
+            area = abs(dv * (ts[j] - at) + dt * (values[j] - av))
+            if area > best_area:
+                best_area = area
+                best = j
+        out_ts.append(ts[best])
+        out_vals.append(values[best])
+        a = best
+    out_ts.append(ts[n - 1])
+    out_vals.append(values[n - 1])
+    return out_ts, out_vals
+
+
+def minmax(ts: Sequence[int], values: Sequence[float], max_points: int) -> Series:
+    """Tiene minimo e massimo di ognuno dei ``max_points // 2`` intervalli di tempo."""
+    n = len(ts)
+    buckets = max_points // 2
+    if max_points >= n or buckets < 1:
+        return list(ts), list(values)
+    t0 = ts[0]
+    span = ts[n - 1] - t0
+    width = span / buckets if span > 0 else 1
+    out_ts: List[int] = []
+    out_vals: List[float] = []
+    cur = -1
+    lo = hi = 0
+
+    def flush() -> None:
+        for k in sorted({lo, hi}):
+            out_ts.append(ts[k])
+            out_vals.append(values[k])
+
+    for i in range(n):
+        b = min(int((ts[i] - t0) / width), buckets - 1)
+        if b != cur:
+            if cur >= 0:
+                flush()
+            cur, lo, hi = b, i, i
+            continue
+        v = values[i]
+        if v < values[lo]:
+            lo = i
+        elif v > values[hi]:
+            hi = i
+    flush()
+    return out_ts, out_vals
+
+
+def reduce(ts: Sequence[int], values: Sequence[float], max_points: int, method: str = "lttb") -> Series:
+    """Applica il metodo richiesto (``lttb`` o ``minmax``)."""
+    if method == "minmax":
+        return minmax(ts, values, max_points)
+    if method == "lttb":
+        return lttb(ts, values, max_points)
+    raise ValueError(f"metodo di riduzione sconosciuto: {method!r}")
@@ -0,0 +1,119 @@
+"""Stima incrementale delle posizioni dei nodi senza GPS.
+
+I traceroute descrivono collegamenti radio diretti tra hop consecutivi.
+``node_links`` ne è l'indice di adiacenza: per ogni coppia di nodi (in
+entrambe le direzioni) conta quanti traceroute memorizzati la contengono.
+
+Un nodo senza posizione reale viene collocato:
+
+* appena scostato dall'unico vicino con posizione nota;
+* nel baricentro dei vicini, se sono due o più.
+
+La stima va in ``nodes.est_lat``/``est_lon``/``est_alt`` senza toccare le
+coordinate reali ed è ricalcolata solo per i nodi interessati: quelli di un
+traceroute aggiunto o rimosso e i vicini di un nodo che cambia posizione.
+Le funzioni lavorano sulla connessione passata e vanno chiamate con il lock
+dello storage già acquisito; il commit resta al chiamante.
+"""
+
+import sqlite3
+from typing import Iterable, List, Optional, Sequence, Set, Tuple
+
+import fastjson
+
+# scostamento (in gradi) dall'unico vicino noto
+OFFSET = 0.001
+_CHUNK = 500
+
+_ESTIMATE_SQL = """
+    UPDATE nodes SET (est_lat, est_lon, est_alt) = (
+      SELECT
+        CASE WHEN COUNT(*) = 1 THEN MIN(k.lat) + :offset ELSE AVG(k.lat) END,
+        CASE WHEN COUNT(*) = 1 THEN MIN(k.lon) + :offset ELSE AVG(k.lon) END,
+        AVG(k.alt)
+      FROM node_links l JOIN nodes k ON k.node_id = l.b
+      WHERE l.a = nodes.node_id
+        AND k.lat IS NOT NULL AND k.lon IS NOT NULL
+        AND (nodes.lat IS NULL OR nodes.lon IS NULL)
+    )
+"""
+
+
+def route_path(src: Optional[str], route: Sequence[str], dest: Optional[str]) -> List[str]:
+    """Percorso completo di un traceroute: sorgente, hop intermedi, destinazione."""
+    path: List[str] = [src] if src else []
+    path.extend(r for r in route if r)
+    if dest and dest not in path:
+        path.append(dest)
+    return path
+
+
+def parse_route(route_json: Optional[str]) -> List[str]:
+    try:
+        route = fastjson.loads(route_json) if route_json else []
+    except ValueError:
+        return []
+    return [str(r) for r in route] if isinstance(route, list) else []
+
+
+def links(path: Sequence[str]) -> Set[Tuple[str, str]]:
+    """Coppie di hop consecutivi del percorso, in entrambe le direzioni."""
+    out: Set[Tuple[str, str]] = set()
+    for a, b in zip(path, path[1:]):
+        if a != b:
+            out.add((a, b))
+            out.add((b, a))
+    return out
+
+
+def add_route(db: sqlite3.Connection, path: Sequence[str], delta: int = 1) -> Set[str]:
+    """Aggiunge (``delta=1``) o toglie (``delta=-1``) un percorso dall'indice.
+
+    Restituisce i nodi i cui vicini sono cambiati.
+    """
+    pairs = links(path)
+    if not pairs:
+        return set()
+    if delta > 0:
+        db.executemany(
+            """
+            INSERT INTO node_links(a, b, routes) VALUES(?, ?, ?)
+            ON CONFLICT(a, b) DO UPDATE SET routes = node_links.routes + excluded.routes
+            """,
+            [(a, b, delta) for a, b in pairs],
+        )
+    else:
+        db.executemany(
+            "UPDATE node_links SET routes = routes + ? WHERE a = ? AND b = ?",
+            [(delta, a, b) for a, b in pairs],
+        )
+        db.executemany("DELETE FROM node_links WHERE a = ? AND b = ? AND routes <= 0", pairs)
+    return {n for pair in pairs for n in pair}
+
+
+def neighbours(db: sqlite3.Connection, node_id: str) -> Set[str]:
+    return {r[0] for r in db.execute("SELECT b FROM node_links WHERE a = ?", (node_id,))}
+
+
+def refresh(db: sqlite3.Connection, node_ids: Iterable[str], only_missing: bool = False) -> None:
+    """Ricalcola la stima dei nodi indicati (con ``only_missing`` solo se manca)."""
+    ids = list(dict.fromkeys(node_ids))
+    extra = " AND lat IS NULL AND est_lat IS NULL" if only_missing else ""
+    for i in range(0, len(ids), _CHUNK):
+        chunk = ids[i : i + _CHUNK]
+        params = {"offset": OFFSET, **{f"n{j}": nid for j, nid in enumerate(chunk)}}
+        marks = ",".join(f":n{j}" for j in range(len(chunk)))
+        db.execute(f"{_ESTIMATE_SQL} WHERE node_id IN ({marks}){extra}", params)
+
+
+def position_changed(db: sqlite3.Connection, node_id: str) -> None:
+    """Un nodo ha (o non ha più) una posizione reale: aggiorna lui e i vicini."""
+    refresh(db, [node_id, *neighbours(db, node_id)])
+
+
+def rebuild(db: sqlite3.Connection) -> None:
+    """Ricostruisce indice e stime da zero a partire da ``traceroutes``."""
+    db.execute("DELETE FROM node_links")
+    for src, dest, route_json in db.execute("SELECT src_id, dest_id, route FROM traceroutes").fetchall():
+        add_route(db, route_path(src, parse_route(route_json), dest))
+    db.execute(_ESTIMATE_SQL, {"offset": OFFSET})
@@ -0,0 +1,136 @@
+"""Bus di eventi in memoria per il push live verso i browser.
+
+La pipeline di ingest (``processing``) pubblica qui i nuovi campioni, gli
+aggiornamenti dei nodi e i traceroute; ``/api/events`` li inoltra ai client
+collegati via Server-Sent Events.
+
+Ogni iscritto ha i propri filtri (tipi di evento, nodi, metriche) e un buffer
+limitato: un client troppo lento che lo riempie viene scollegato invece di
+far crescere la memoria o rallentare l'ingest.
+"""
+
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set
+
+EVENT_TYPES = ("telemetry", "node", "traceroute")
+BUFFER_SIZE = 1000
+MAX_SUBSCRIBERS = 200
+
+
+class TooManySubscribers(RuntimeError):
+    """Raggiunto il numero massimo di client collegati."""
+
+
+class Subscriber:
+    """Un client collegato: filtri, buffer limitato e segnale di risveglio."""
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        types: Optional[Iterable[str]] = None,
+        nodes: Optional[Iterable[str]] = None,
+        metrics: Optional[Iterable[str]] = None,
+        maxsize: int = BUFFER_SIZE,
+    ) -> None:
+        self.types: Set[str] = set(types or EVENT_TYPES)
+        self.nodes: Optional[Set[str]] = set(nodes) if nodes else None
+        self.metrics: Optional[Set[str]] = set(metrics) if metrics else None
+        self.maxsize = maxsize
+        self.dropped = False
+        self.delivered = 0
+        self._buf: Deque[Dict[str, Any]] = deque()
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._wake = asyncio.Event()
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if event["type"] not in self.types:
+            return False
+        if self.nodes is not None:
+            ids = event.get("node_ids") or (event.get("node_id"),)
+            if not self.nodes.intersection(ids):
+                return False
+        if self.metrics is not None and event["type"] == "telemetry" and event.get("metric") not in self.metrics:
+            return False
+        return True
+
+    def offer(self, event: Dict[str, Any]) -> None:
+        """Accoda un evento (da qualunque thread); a buffer pieno il client è scartato."""
+        with self._lock:
+            if self.dropped:
+                return
+            if len(self._buf) >= self.maxsize:
+                self.dropped = True
+                self._buf.clear()
+            else:
+                self._buf.append(event)
+        try:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        except RuntimeError:  # loop già chiuso
+            pass
+
+    async def get(self, timeout: float) -> List[Dict[str, Any]]:
+        """Attende fino a ``timeout`` secondi e restituisce gli eventi accodati."""
+        if not self._buf and not self.dropped:
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        with self._lock:
+            out = list(self._buf)
+            self._buf.clear()
+        self.delivered += len(out)
+        return out
+
+
+class EventBus:
+    """Distribuisce gli eventi agli iscritti che li accettano."""
+
+    def __init__(self, max_subscribers: int = MAX_SUBSCRIBERS) -> None:
+        self.max_subscribers = max_subscribers
+        self._subs: List[Subscriber] = []
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, loop: asyncio.AbstractEventLoop, **filters: Any) -> Subscriber:
+        with self._lock:
+            if len(self._subs) >= self.max_subscribers:
+                raise TooManySubscribers(f"massimo {self.max_subscribers} client collegati")
+            sub = Subscriber(loop, **filters)
+            self._subs.append(sub)
+            return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        with self._lock:
+            if sub in self._subs:
+                self._subs.remove(sub)
+
+    def publish(self, type_: str, **data: Any) -> None:
+        """Pubblica un evento; costa solo un controllo se nessuno è in ascolto."""
+        if not self._subs:
+            return
+        event = {"type": type_, **data}
+        self.published += 1
+        with self._lock:
+            subs = list(self._subs)
+        for sub in subs:
+            if sub.matches(event):
+                sub.offer(event)
+                if sub.dropped:
+                    self.dropped += 1
+                    self.unsubscribe(sub)
+
+    def stats(self) -> Dict[str, int]:
+        return {"subscribers": len(self._subs), "published": self.published, "dropped": self.dropped}
+
+
+bus = EventBus()
+
+
+def publish(type_: str, **data: Any) -> None:
+    """Pubblica sul bus predefinito."""
+    bus.publish(type_, **data)
@@ -0,0 +1,216 @@
+"""Esportazione a flusso di telemetria e messaggi in CSV o NDJSON.
+
+Le righe sono lette da una connessione SQLite in sola lettura con
+``fetchmany`` a blocchi di :data:`CHUNK_ROWS` e codificate un blocco alla
+volta: la memoria usata non dipende dalla dimensione dell'export. La
+telemetria comprende tutti i livelli di storage, nell'ordine archivio freddo,
+blocchi compressi e righe recenti di ``telemetry``, letti in un'unica
+transazione mentre compattazione e sigillatura restano sospese.
+
+Le funzioni qui sono generatori sincroni di ``bytes``; l'API li fa avanzare
+un blocco alla volta nell'executor DB (vedi ``api._stream_db``).
+"""
+
+import csv
+import io
+import sqlite3
+import time
+from contextlib import nullcontext
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+import coldstore
+import fastjson
+import tsblock
+from database import Storage
+
+CHUNK_ROWS = 5000
+FORMATS = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+TELEMETRY_COLUMNS = ("ts", "node_id", "node_name", "metric", "value")
+MESSAGE_COLUMNS = ("id", "ts", "node_id", "portnum", "text")
+
+
+def readonly_connection(storage: Storage) -> sqlite3.Connection:
+    """Connessione dedicata in sola lettura (la condivisa per i DB in memoria)."""
+    if storage.path == ":memory:":
+        return storage.conn
+    conn = sqlite3.connect(
+        f"file:{quote(storage.path)}?mode=ro", uri=True, check_same_thread=False, timeout=30
+    )
+    conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+def _rows(
+    storage: Storage, conn: sqlite3.Connection, sql: str, params: Sequence[Any], size: int
+) -> Iterator[Tuple]:
+    # sulla connessione condivisa il lock serve a ogni lettura, non per tutto l'export
+    lock = storage.lock if conn is storage.conn else nullcontext()
+    with lock:
+        cur = conn.execute(sql, params)
+    try:
+        while True:
+            with lock:
+                batch = cur.fetchmany(size)
+            if not batch:
+                return
+            yield from batch
+    finally:
+        with lock:
+            cur.close()
+
+
+def _where(
+    column_ts: str,
+    since: Optional[int],
+    until: Optional[int],
+    node_ids: Optional[List[str]],
+    extra: Iterable[Tuple[str, List[Any]]] = (),
+) -> Tuple[str, List[Any]]:
+    where: List[str] = []
+    params: List[Any] = []
+    if since is not None:
+        where.append(f"{column_ts} >= ?")
+        params.append(since)
+    if until is not None:
+        where.append(f"{column_ts} < ?")
+        params.append(until)
+    if node_ids:
+        where.append(f"node_id IN ({','.join('?' for _ in node_ids)})")
+        params.extend(node_ids)
+    for clause, values in extra:
+        where.append(clause)
+        params.extend(values)
+    return (" WHERE " + " AND ".join(where) if where else ""), params
+
+
+def telemetry_rows(
+    storage: Storage,
+    conn: sqlite3.Connection,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    node_ids: Optional[List[str]] = None,
+    metrics: Optional[List[str]] = None,
+    size: Optional[int] = None,
+) -> Iterator[Tuple]:
+    """``(ts, node_id, node_name, metric, value)`` da tutti i livelli di storage."""
+    size = size or CHUNK_ROWS
+    wanted = set(metrics or ())
+    metric_filter = [(f"metric IN ({','.join('?' for _ in wanted)})", sorted(wanted))] if wanted else []
+
+    # nessuna compattazione o sigillatura finché l'export è in corso: l'indice
+    # dei segmenti, i blocchi e le righe restano quelli letti all'inizio
+    with storage.hold_tiers():
+        snapshot = conn is not storage.conn
+        if snapshot:
+            # blocchi e righe dalla stessa transazione di lettura
+            conn.execute("BEGIN")
+        try:
+            if storage.cold_path:
+                for node_id, node_name, metric, ts, vals in coldstore.read(storage, since or 0, node_ids, until):
+                    if wanted and metric not in wanted:
+                        continue
+                    for t, v in zip(ts, vals):
+                        yield int(t), node_id, node_name, metric, float(v)
+
+            where, params = _where("last_ts", since, None, node_ids, metric_filter)
+            if until is not None:
+                where += (" AND " if where else " WHERE ") + "first_ts < ?"
+                params.append(until)
+            blocks = _rows(
+                storage,
+                conn,
+                f"SELECT node_id, node_name, metric, data FROM telemetry_blocks{where} ORDER BY hour_ts",
+                params,
+                # un blocco contiene un'ora di campioni: ne bastano pochi per volta
+                max(1, size // 100),
+            )
+            for node_id, node_name, metric, data in blocks:
+                ts, vals = tsblock.decode(data)
+                for t, v in zip(ts, vals):
+                    if (since is None or t >= since) and (until is None or t < until):
+                        yield t, node_id, node_name, metric, v
+
+            where, params = _where("ts", since, until, node_ids, metric_filter)
+            yield from _rows(
+                storage,
+                conn,
+                f"SELECT ts, node_id, node_name, metric, value FROM telemetry{where} ORDER BY ts, id",
+                params,
+                size,
+            )
+        finally:
+            if snapshot and conn.in_transaction:
+                conn.rollback()
+
+
+def message_rows(
+    storage: Storage,
+    conn: sqlite3.Connection,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    node_ids: Optional[List[str]] = None,
+    portnum: Optional[str] = None,
+    raw: bool = False,
+    size: Optional[int] = None,
+) -> Iterator[Tuple]:
+    """``(id, ts, node_id, portnum, text[, raw_json])`` in ordine di tempo."""
+    extra = [("portnum = ?", [portnum])] if portnum else []
+    where, params = _where("ts", since, until, node_ids, extra)
+    cols = ", ".join(MESSAGE_COLUMNS) + (", raw_json" if raw else "")
+    return _rows(storage, conn, f"SELECT {cols} FROM messages{where} ORDER BY ts, id", params, size or CHUNK_ROWS)
+
+
+def encode(
+    rows: Iterable[Tuple],
+    columns: Sequence[str],
+    fmt: str,
+    size: Optional[int] = None,
+    json_columns: Sequence[str] = (),
+) -> Iterator[bytes]:
+    """Codifica ``rows`` in blocchi di ``size`` righe (CSV con intestazione o NDJSON).
+
+    Le colonne in ``json_columns`` contengono JSON: in NDJSON diventano
+    oggetti annidati, in CSV restano testo.
+    """
+    size = size or CHUNK_ROWS
+    parse = [columns.index(c) for c in json_columns]
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n") if fmt == "csv" else None
+    out: List[bytes] = []
+    if writer is not None:
+        writer.writerow(columns)
+    count = 0
+    for row in rows:
+        if writer is not None:
+            writer.writerow(row)
+        else:
+            obj = dict(zip(columns, row))
+            for i in parse:
+                try:
+                    obj[columns[i]] = fastjson.loads(row[i]) if row[i] else None
+                except ValueError:
+                    pass
+            out.append(fastjson.dumps_bytes(obj))
+            out.append(b"\n")
+        count += 1
+        if count % size == 0:
+            yield _flush(buf, out)
+    chunk = _flush(buf, out)
+    if chunk:
+        yield chunk
+
+
+def _flush(buf: io.StringIO, out: List[bytes]) -> bytes:
+    if buf.tell():
+        data = buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+        return data
+    data = b"".join(out)
+    out.clear()
+    return data
+
+
+def filename(kind: str, fmt: str) -> str:
+    return f"{kind}-{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}.{fmt}"
@@ -0,0 +1,65 @@
+"""Codifica e decodifica JSON con ``orjson`` se installato, altrimenti stdlib.
+
+Usato dall'API (corpo delle risposte) e dall'ingest (payload MQTT, colonne
+``raw_json``, ``route`` e ``radio``). I due backend producono lo stesso
+formato compatto, così il contenuto del DB non dipende da quale è in uso.
+``orjson`` è opzionale: ``pip install orjson``.
+"""
+
+import json
+import math
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+_SEPARATORS = (",", ":")
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """Decodifica JSON da byte UTF-8 o stringa; errori come ``ValueError``."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # la stdlib accetta anche NaN/Infinity: riprova prima di arrendersi
+            pass
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode("utf-8")
+    return json.loads(data)
+
+
+def _finite(obj: Any) -> Any:
+    """Sostituisce NaN/Infinity con ``None``, come fa orjson."""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {k: _finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(v) for v in obj]
+    return obj
+
+
+def _encode(obj: Any) -> bytes:
+    if orjson is not None:
+        try:
+            # orjson scrive NaN/Infinity come null
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # interi oltre 64 bit, tipi non supportati: ci pensa la stdlib
+            pass
+    return json.dumps(_finite(obj), ensure_ascii=False, allow_nan=False, separators=_SEPARATORS).encode("utf-8")
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """JSON compatto in UTF-8 per le risposte HTTP; NaN/Infinity diventano ``null``."""
+    return _encode(obj)
+
+
+def dumps(obj: Any) -> str:
+    """JSON compatto come ``str`` per le colonne TEXT del DB; NaN/Infinity diventano ``null``."""
+    return _encode(obj).decode("utf-8")
@@ -0,0 +1,256 @@
+"""Contatori e istogrammi interni esposti in formato Prometheus su ``/metrics``.
+
+Le metriche sono oggetti di modulo aggiornati dal codice di ingest, dal DB
+e dall'API. Aggiornarle costa una lettura di dizionario e una somma: niente
+lock, così la strumentazione non introduce contese nel percorso caldo. Con il
+GIL un aggiornamento concorrente alla stessa serie può raramente andare
+perso; per il monitoraggio è accettabile.
+
+Le grandezze che si leggono meglio al momento della richiesta (dimensione
+del WAL, code dell'executor, iscritti agli eventi) sono fornite da funzioni
+registrate con :func:`register_collector`.
+"""
+
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# secondi: dalle query brevi alle richieste lente
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# attese sul lock e commit: quasi sempre sotto il millisecondo
+FAST_BUCKETS = (0.00001, 0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5, 1.0, 5.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Sample = Tuple[str, Dict[str, str], float]
+_REGISTRY: List["_Metric"] = []
+_COLLECTORS: List[Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        _REGISTRY.append(self)
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Valore che cresce soltanto; ``inc("TEXT_MESSAGE_APP")`` con i valori delle etichette."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help_, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[Sample]:
+        # copia prima di ordinare: altri thread possono aggiungere serie
+        return [
+            (f"{self.name}_total", dict(zip(self.labelnames, key)), v) for key, v in sorted(list(self._values.items()))
+        ]
+
+
+class Histogram(_Metric):
+    """Distribuzione di durate in secondi, a bucket cumulativi come in Prometheus."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help_: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, help_, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per serie: conteggi per bucket (non cumulativi, l'ultimo è +Inf), somma
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        """``with HIST.time(...):`` osserva la durata del blocco."""
+        return _Timer(self, labels)
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def samples(self) -> List[Sample]:
+        out: List[Sample] = []
+        # copie di dizionario e conteggi: gli aggiornamenti concorrenti non
+        # cambiano la lista sotto i piedi né rendono i bucket incoerenti
+        for key, (counts, total) in sorted(list(self._series.items())):
+            counts = list(counts)
+            labels = dict(zip(self.labelnames, key))
+            running = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                running += n
+                out.append((f"{self.name}_bucket", {**labels, "le": _number(bound)}, running))
+            out.append((f"{self.name}_sum", labels, total))
+            out.append((f"{self.name}_count", labels, running))
+        return out
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "start")
+
+    def __init__(self, hist: Histogram, labels: Tuple[str, ...]) -> None:
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.hist.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class TimedLock:
+    """``threading.Lock`` che registra in ``hist`` l'attesa di ogni acquisizione."""
+
+    def __init__(self, hist: Histogram) -> None:
+        self._lock = threading.Lock()
+        self.hist = hist
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        # caso comune, lock libero: nessuna misura del tempo
+        if self._lock.acquire(False):
+            self.hist.observe(0.0)
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        ok = self._lock.acquire(True, timeout)
+        if ok:
+            self.hist.observe(time.perf_counter() - start)
+        return ok
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *exc: Any) -> None:
+        self._lock.release()
+
+
+_LABEL_VALUE = re.compile(r"^[A-Za-z0-9_]{1,48}$")
+
+
+def label(value: Optional[str], default: str = "unknown") -> str:
+    """Valore di etichetta sicuro per dati esterni: niente serie illimitate."""
+    if not value:
+        return default
+    return value if _LABEL_VALUE.match(value) else "other"
+
+
+def register_collector(fn: Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]) -> None:
+    """``fn`` restituisce ``(nome, tipo, help, campioni)`` letti al momento di ``/metrics``."""
+    _COLLECTORS.append(fn)
+
+
+def render() -> str:
+    """Tutte le metriche nel formato testuale di Prometheus (0.0.4)."""
+    families: List[Tuple[str, str, str, List[Sample]]] = [(m.name, m.kind, m.help, m.samples()) for m in _REGISTRY]
+    for fn in _COLLECTORS:
+        try:
+            families.extend(fn())
+        except Exception as e:  # una sorgente guasta non deve nascondere le altre
+            print(f"[METRICS] collector {getattr(fn, '__name__', fn)}: {e}")
+    lines: List[str] = []
+    for name, kind, help_, samples in families:
+        lines.append(f"# HELP {name} {help_}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample, labels, value in samples:
+            lines.append(f"{sample}{_labels(labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class HTTPMetricsMiddleware:
+    """Durata delle richieste per metodo, route (il modello del path) e stato.
+
+    La durata arriva fino all'ultimo blocco del corpo: per le risposte a
+    flusso comprende tutto il trasferimento. Gli eventi SSE restano aperti
+    per definizione e non sono misurati.
+    """
+
+    def __init__(self, app, exclude: Sequence[str] = ("/api/events",)) -> None:
+        self.app = app
+        self.exclude = tuple(exclude)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude):
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def wrapped(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, wrapped)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "other"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, scope["method"], route, str(status))
+
+
+# ---------- metriche di MeshPlotter ----------
+
+MQTT_MESSAGES = Counter("meshplotter_mqtt_messages_received", "Messaggi MQTT ricevuti")
+MQTT_BYTES = Counter("meshplotter_mqtt_received_bytes", "Byte di payload MQTT ricevuti")
+MESSAGES_DECODED = Counter("meshplotter_messages_decoded", "Messaggi decodificati per portnum", ("portnum",))
+MESSAGES_FAILED = Counter(
+    "meshplotter_messages_failed", "Messaggi non elaborati per portnum e fase (decode, store)", ("portnum", "stage")
+)
+DECODE_SECONDS = Histogram("meshplotter_decode_seconds", "Durata della decodifica (JSON o Protobuf)")
+PROCESS_SECONDS = Histogram(
+    "meshplotter_message_store_seconds", "Durata del salvataggio di un messaggio decodificato", ("portnum",)
+)
+DB_COMMIT_SECONDS = Histogram("meshplotter_db_commit_seconds", "Durata dei commit SQLite", buckets=FAST_BUCKETS)
+DB_LOCK_WAIT_SECONDS = Histogram(
+    "meshplotter_db_lock_wait_seconds", "Attesa per acquisire il lock della connessione condivisa", buckets=FAST_BUCKETS
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "meshplotter_http_request_seconds", "Durata delle richieste HTTP", ("method", "route", "status")
+)
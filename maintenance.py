@@ -0,0 +1,180 @@
+"""Manutenzione dello storage SQLite fuori dal percorso di ingest.
+
+* **Profili di tuning** – insiemi nominati di PRAGMA (``cache_size``,
+  ``mmap_size``, ``temp_store``, ``page_size``, ``wal_autocheckpoint``)
+  selezionabili da ``storage.tuning`` in ``config.yml``.
+* **Scheduler** – un thread che esegue checkpoint del WAL (PASSIVE, oppure
+  TRUNCATE quando il file supera una soglia), ``PRAGMA optimize`` e
+  ``incremental_vacuum`` su una connessione dedicata, così l'ingest non paga
+  il costo dei checkpoint automatici e i lettori lunghi non bloccano nessuno.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+if TYPE_CHECKING:  # pragma: no cover - solo per i type hint
+    from database import Storage
+
+# Profili predefiniti; quelli in ``storage.tuning.profiles`` li estendono o sostituiscono.
+PROFILES: Dict[str, Dict[str, Any]] = {
+    # valori di default di SQLite
+    "default": {},
+    # uso tipico: cache da 64 MiB, mmap da 256 MiB, temporanei in memoria
+    "balanced": {
+        "cache_size": -65536,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "memory",
+        "wal_autocheckpoint": 1000,
+    },
+    # checkpoint affidati solo allo scheduler: nessun picco di latenza sull'ingest
+    "ingest": {
+        "cache_size": -32768,
+        "temp_store": "memory",
+        "wal_autocheckpoint": 0,
+    },
+    # DB molto grandi con query storiche lunghe
+    "large": {
+        "cache_size": -262144,
+        "mmap_size": 1024 * 1024 * 1024,
+        "temp_store": "memory",
+        "page_size": 8192,
+        "wal_autocheckpoint": 0,
+    },
+}
+
+_PRAGMAS = ("page_size", "cache_size", "mmap_size", "temp_store", "wal_autocheckpoint")
+_TEMP_STORE = {"default": 0, "file": 1, "memory": 2}
+
+
+def resolve_profile(name: Optional[str], custom: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Restituisce i PRAGMA del profilo ``name`` (predefinito o personalizzato)."""
+    profiles = {**PROFILES, **(custom or {})}
+    name = name or "default"
+    if name not in profiles:
+        raise ValueError(f"profilo di tuning sconosciuto: {name!r} (disponibili: {', '.join(sorted(profiles))})")
+    unknown = set(profiles[name]) - set(_PRAGMAS)
+    if unknown:
+        raise ValueError(f"PRAGMA non supportati nel profilo {name!r}: {', '.join(sorted(unknown))}")
+    return dict(profiles[name])
+
+
+def apply_tuning(conn: sqlite3.Connection, settings: Dict[str, Any]) -> None:
+    """Applica i PRAGMA di un profilo a una connessione.
+
+    ``page_size`` ha effetto solo su un DB nuovo (o dopo ``VACUUM``): per
+    questo va applicato prima di creare le tabelle.
+    """
+    for key in _PRAGMAS:
+        if key not in settings or settings[key] is None:
+            continue
+        val = settings[key]
+        if key == "temp_store" and isinstance(val, str):
+            val = _TEMP_STORE[val.lower()]
+        conn.execute(f"PRAGMA {key} = {int(val)}")
+
+
+def wal_size(storage: "Storage") -> int:
+    """Dimensione in byte del file ``-wal`` (0 per DB in memoria o senza WAL)."""
+    if storage.path == ":memory:":
+        return 0
+    try:
+        return os.path.getsize(storage.path + "-wal")
+    except OSError:
+        return 0
+
+
+class Maintenance:
+    """Scheduler di manutenzione per uno :class:`database.Storage`."""
+
+    def __init__(
+        self,
+        storage: "Storage",
+        interval: float = 60.0,
+        wal_truncate_bytes: int = 64 * 1024 * 1024,
+        optimize_every: float = 3600.0,
+        vacuum_pages: int = 1000,
+    ) -> None:
+        self.storage = storage
+        self.interval = interval
+        self.wal_truncate_bytes = wal_truncate_bytes
+        self.optimize_every = optimize_every
+        self.vacuum_pages = vacuum_pages
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_optimize = time.monotonic()
+        self.last: Dict[str, Any] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        # connessione dedicata: i checkpoint non passano dal lock dell'ingest
+        conn = sqlite3.connect(self.storage.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout = 30000")
+        return conn
+
+    def run_once(self) -> Dict[str, Any]:
+        """Esegue un giro di manutenzione e ne restituisce il resoconto."""
+        report: Dict[str, Any] = {"ts": int(time.time()), "wal_bytes_before": wal_size(self.storage)}
+        started = time.monotonic()
+        if self.storage.path == ":memory:":
+            # niente WAL né file: solo optimize sulla connessione condivisa
+            with self.storage.lock:
+                self.storage.conn.execute("PRAGMA optimize")
+            report["optimize"] = True
+        else:
+            conn = self._connect()
+            try:
+                if time.monotonic() - self._last_optimize >= self.optimize_every:
+                    conn.execute("PRAGMA optimize")
+                    self._last_optimize = time.monotonic()
+                    report["optimize"] = True
+                if self.vacuum_pages and conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                    if free:
+                        # il pragma libera una pagina a ogni step; ``execute`` ne fa uno solo
+                        # (nessuna colonna nel risultato), ``executescript`` arriva in fondo
+                        conn.executescript(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)});")
+                        report["vacuumed_pages"] = free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+                # checkpoint per ultimo, così include anche le pagine liberate dal vacuum
+                mode = "TRUNCATE" if report["wal_bytes_before"] >= self.wal_truncate_bytes else "PASSIVE"
+                busy, log, ckpt = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+                report["checkpoint"] = {"mode": mode, "busy": busy, "log_frames": log, "checkpointed": ckpt}
+            finally:
+                conn.close()
+        report["wal_bytes_after"] = wal_size(self.storage)
+        report["seconds"] = round(time.monotonic() - started, 4)
+        self.last = report
+        return report
+
+    def start(self) -> threading.Thread:
+        def run():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print(f"[MAINT] Manutenzione fallita: {e}")
+
+        self._thread = threading.Thread(target=run, name="db-maintenance", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def start_maintenance(storage: "Storage", cfg: Optional[Dict[str, Any]] = None) -> Optional[Maintenance]:
+    """Avvia lo scheduler con le opzioni di ``storage.maintenance`` (``interval: 0`` lo disattiva)."""
+    cfg = cfg or {}
+    interval = float(cfg.get("interval", 60))
+    if interval <= 0:
+        return None
+    maint = Maintenance(
+        storage,
+        interval=interval,
+        wal_truncate_bytes=int(float(cfg.get("wal_truncate_mb", 64)) * 1024 * 1024),
+        optimize_every=float(cfg.get("optimize_every", 3600)),
+        vacuum_pages=int(cfg.get("vacuum_pages", 1000)),
+    )
+    maint.start()
+    return maint
@@ -0,0 +1,147 @@
+"""Raggruppamento dei nodi per la mappa a zoom bassi.
+
+La griglia è quella delle tile Web Mercator: allo zoom ``z`` ogni tile da
+256 px è divisa in celle di :data:`CELL_PX` pixel, quindi sullo schermo le
+celle sono quadrate e restano le stesse spostando la mappa (l'id
+``z/x/y`` è stabile). I nodi arrivano già filtrati dall'R*Tree delle
+posizioni; qui si contano per cella. I collegamenti della topologia tra
+celle diverse diventano un fascio per coppia di celle.
+"""
+
+import math
+from typing import Any, Dict, Iterable, List, Tuple
+
+CELL_PX = 64
+TILE_PX = 256
+# oltre questa latitudine la proiezione di Mercatore diverge
+MAX_LAT = 85.05112878
+MAX_ZOOM = 22
+
+Cell = Tuple[int, int]
+
+
+def cells_per_side(zoom: int) -> int:
+    return (1 << zoom) * (TILE_PX // CELL_PX)
+
+
+def cell_of(lat: float, lon: float, zoom: int) -> Cell:
+    n = cells_per_side(zoom)
+    lat = max(-MAX_LAT, min(MAX_LAT, lat))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def cell_bounds(cell: Cell, zoom: int) -> List[float]:
+    """``[ovest, sud, est, nord]`` della cella."""
+    n = cells_per_side(zoom)
+    x, y = cell
+
+    def lat(row: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return [x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)]
+
+
+def snap_bbox(bbox: Tuple[float, float, float, float], zoom: int) -> Tuple[float, float, float, float]:
+    """Allarga il riquadro ai bordi delle celle: le celle ai margini restano complete."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    w, s, _e, _n = cell_bounds(cell_of(min_lat, min_lon, zoom), zoom)
+    _w, _s, e, n = cell_bounds(cell_of(max_lat, max_lon, zoom), zoom)
+    if min_lon > max_lon:  # a cavallo dell'antimeridiano: solo la latitudine
+        return min_lon, s, max_lon, n
+    return w, s, e, n
+
+
+def cluster(rows: Iterable[Tuple[str, str, float, float, bool]], zoom: int) -> Dict[Cell, Dict[str, Any]]:
+    """Celle da righe ``(node_id, nome, lat, lon, stimata)``: conteggio e baricentro."""
+    cells: Dict[Cell, Dict[str, Any]] = {}
+    for node_id, name, lat, lon, estimated in rows:
+        cell = cell_of(lat, lon, zoom)
+        c = cells.get(cell)
+        if c is None:
+            c = cells[cell] = {"count": 0, "estimated": 0, "lat": 0.0, "lon": 0.0, "node_id": node_id, "name": name}
+        c["count"] += 1
+        c["estimated"] += 1 if estimated else 0
+        c["lat"] += lat
+        c["lon"] += lon
+    for c in cells.values():
+        c["lat"] /= c["count"]
+        c["lon"] /= c["count"]
+    return cells
+
+
+def bundles(
+    edges: Iterable[Tuple[str, str, int, int]],
+    positions: Dict[str, Tuple[float, float]],
+    zoom: int,
+    visible: Dict[Cell, Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """Fasci di collegamenti tra celle diverse, con almeno un estremo visibile.
+
+    ``edges`` sono ``(a, b, osservazioni, ultimo ts)``; i due versi di un
+    collegamento contano una volta sola in ``links``.
+    """
+    pairs: Dict[Tuple[Cell, Cell], Dict[str, Any]] = {}
+    outside: Dict[Cell, List[float]] = {}
+    for a, b, count, last_seen in edges:
+        pa, pb = positions.get(a), positions.get(b)
+        if pa is None or pb is None:
+            continue
+        ca, cb = cell_of(*pa, zoom), cell_of(*pb, zoom)
+        if ca == cb or (ca not in visible and cb not in visible):
+            continue
+        for c, p in ((ca, pa), (cb, pb)):
+            if c not in visible:
+                acc = outside.setdefault(c, [0.0, 0.0, 0])
+                acc[0] += p[0]
+                acc[1] += p[1]
+                acc[2] += 1
+        key = (ca, cb) if ca < cb else (cb, ca)
+        bundle = pairs.setdefault(key, {"pairs": set(), "count": 0, "last_seen": 0})
+        bundle["pairs"].add((a, b) if a < b else (b, a))
+        bundle["count"] += count
+        bundle["last_seen"] = max(bundle["last_seen"], last_seen)
+
+    def centre(c: Cell) -> List[float]:
+        if c in visible:
+            return [visible[c]["lat"], visible[c]["lon"]]
+        lat, lon, k = outside[c]
+        return [lat / k, lon / k]
+
+    return [
+        {
+            "source": cell_id(ca, zoom),
+            "target": cell_id(cb, zoom),
+            "from": centre(ca),
+            "to": centre(cb),
+            "links": len(b["pairs"]),
+            "count": b["count"],
+            "last_seen": b["last_seen"],
+        }
+        for (ca, cb), b in sorted(pairs.items())
+    ]
+
+
+def cell_id(cell: Cell, zoom: int) -> str:
+    return f"{zoom}/{cell[0]}/{cell[1]}"
+
+
+def as_list(cells: Dict[Cell, Dict[str, Any]], zoom: int) -> List[Dict[str, Any]]:
+    out = []
+    for cell, c in sorted(cells.items()):
+        item: Dict[str, Any] = {
+            "id": cell_id(cell, zoom),
+            "lat": c["lat"],
+            "lon": c["lon"],
+            "count": c["count"],
+            "estimated": c["estimated"],
+            "bbox": cell_bounds(cell, zoom),
+        }
+        # un nodo isolato si può disegnare subito come tale
+        if c["count"] == 1:
+            item["node_id"] = c["node_id"]
+            item["name"] = c["name"]
+        out.append(item)
+    return out
+
@@ -3,11 +3,10 @@ import threading
 
 from amqtt.broker import Broker
 
-from config import MQTT_HOST, MQTT_PORT
-
 
 def start_broker() -> Broker:
     """Avvia un broker MQTT embedded tramite amqtt in un thread dedicato."""
+    from config import MQTT_HOST, MQTT_PORT
 
     config = {
         "listeners": {
@@ -1,12 +1,20 @@
 import ssl
+from typing import Optional
+
 from paho.mqtt.client import Client as MQTTClient, CallbackAPIVersion, MQTTv311, MQTTv5
 
-from config import MQTT_HOST, MQTT_PORT, MQTT_USER, MQTT_PASS, MQTT_CLIENT_ID, MQTT_PROTO, MQTT_TOPICS, TLS_CFG
+import instrument
+from database import Storage
 from processing import process_mqtt_message
 
 
-def start_mqtt():
-    """Configura e avvia il client MQTT."""
+def start_mqtt(storage: Optional[Storage] = None):
+    """Configura e avvia il client MQTT.
+
+    I messaggi ricevuti sono salvati in ``storage`` (o nello storage predefinito).
+    """
+    from config import MQTT_HOST, MQTT_PORT, MQTT_USER, MQTT_PASS, MQTT_CLIENT_ID, MQTT_PROTO, MQTT_TOPICS, TLS_CFG
+
     proto = MQTTv311 if MQTT_PROTO == "v311" else MQTTv5
     client = MQTTClient(
         callback_api_version=CallbackAPIVersion.VERSION2,
@@ -45,7 +53,9 @@ def start_mqtt():
         print(f"[MQTT] Disconnected rc={reason_code}. Retry automatico attivo.")
 
     def on_message(client, userdata, msg):
-        process_mqtt_message(msg.topic, msg.payload)
+        instrument.MQTT_MESSAGES.inc()
+        instrument.MQTT_BYTES.inc(amount=len(msg.payload))
+        process_mqtt_message(msg.topic, msg.payload, storage)
 
     client.on_connect = on_connect
     client.on_disconnect = on_disconnect
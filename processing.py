@@ -1,30 +1,45 @@
-import json
+import base64
+import binascii
 import re
 import time
 from typing import Any, Dict, List, Optional, Tuple
 
-from config import PROTOBUF_DECODE, TRACEROUTE_TTL
-from database import DB, DB_LOCK, upsert_node, store_metric
+import estimator
+import events
+import fastjson
+import config
+import instrument
+from database import Storage, get_storage
+
+# moduli protobuf importati al primo utilizzo (vedi _load_protobuf)
+MessageToDict = telemetry_pb2 = mesh_pb2 = portnums_pb2 = None
+
+
+def _load_protobuf() -> None:
+    """Importa i moduli Meshtastic/protobuf solo quando servono davvero."""
+    global MessageToDict, telemetry_pb2, mesh_pb2, portnums_pb2
+    if mesh_pb2 is None:
+        from google.protobuf.json_format import MessageToDict
+        from meshtastic import telemetry_pb2, mesh_pb2, portnums_pb2
+
+
+def _protobuf_enabled() -> bool:
+    # letta qui e non all'import: ``import processing`` non carica config.yml
+    return config.PROTOBUF_DECODE and config.HAVE_MESHTASTIC
 
-if PROTOBUF_DECODE:
-    from google.protobuf.json_format import MessageToDict
-    from meshtastic import telemetry_pb2, mesh_pb2, portnums_pb2
-    HAVE_MESHTASTIC = True
-else:
-    HAVE_MESHTASTIC = False
 
 # ---------- parsing helpers ----------
 
 def _json_loads(b: bytes) -> Optional[Dict[str, Any]]:
     try:
-        return json.loads(b.decode("utf-8"))
+        return fastjson.loads(b)
     except Exception:
         try:
             text = b.decode("utf-8", errors="ignore")
             start = text.find("{")
             end = text.rfind("}")
             if start != -1 and end != -1 and start < end:
-                return json.loads(text[start : end + 1])
+                return fastjson.loads(text[start : end + 1])
         except Exception:
             return None
     return None
@@ -363,8 +378,9 @@ def pb_to_dict(msg) -> Dict[str, Any]:
 def try_decode_protobuf(payload: bytes, *, portnum: Optional[int] = None, _nested: bool = False) -> Optional[Dict[str, Any]]:
     """Best‑effort decoding of Meshtastic protobuf payloads."""
 
-    if not HAVE_MESHTASTIC:
+    if not _protobuf_enabled():
         return None
+    _load_protobuf()
 
     # Full MeshPacket (contains portnum + decoded payload)
     if not _nested:
@@ -429,7 +445,7 @@ def _decode_message(payload: bytes) -> Optional[Dict[str, Any]]:
     """Try to decode a MQTT payload into a dictionary."""
 
     data = _json_loads(payload)
-    if not isinstance(data, dict) and PROTOBUF_DECODE and HAVE_MESHTASTIC:
+    if not isinstance(data, dict) and _protobuf_enabled():
         data = try_decode_protobuf(payload)
     return data if isinstance(data, dict) else None
 
@@ -445,7 +461,9 @@ def _extract_portnum(data: Dict[str, Any]) -> Optional[str]:
     return None
 
 
-def _process_node(data: Dict[str, Any], topic: str, now_s: int, portnum: Optional[str]) -> str:
+def _process_node(
+    storage: Storage, data: Dict[str, Any], topic: str, now_s: int, portnum: Optional[str]
+) -> str:
     uid, sname, lname = _extract_user_info(data)
     topic_id = _parse_node_id(data, topic)
     node_id = uid or topic_id
@@ -463,11 +481,11 @@ def _process_node(data: Dict[str, Any], topic: str, now_s: int, portnum: Optiona
     has_info = bool(uid or sname or lname)
     if not node_id:
         node_id = "unknown"
-        upsert_node(node_id, None, "Sconosciuto", now_s)
+        storage.upsert_node(node_id, None, "Sconosciuto", now_s)
     else:
         if lat is not None and lon is not None and pos_ts is None:
             pos_ts = now_s
-        upsert_node(
+        storage.upsert_node(
             node_id,
             sname,
             lname,
@@ -478,10 +496,34 @@ def _process_node(data: Dict[str, Any], topic: str, now_s: int, portnum: Optiona
             alt=alt,
             pos_ts=pos_ts if lat is not None and lon is not None else None,
         )
+    events.publish(
+        "node",
+        node_id=node_id,
+        short_name=sname,
+        long_name=lname,
+        last_seen=now_s,
+        lat=lat,
+        lon=lon,
+        alt=alt,
+    )
     return node_id
 
 
-def _store_metrics(node_id: str, now_s: int, data: Dict[str, Any]) -> None:
+_FAMILIES = {"temperature", "humidity", "pressure", "voltage", "current"}
+
+
+def metric_family(metric: str) -> Optional[str]:
+    """Chart family of a normalized metric (``None`` if it is not plotted)."""
+    if metric in _FAMILIES:
+        return metric
+    if metric in config.POWER_V_KEYS:
+        return "voltage"
+    if metric in config.POWER_I_KEYS:
+        return "current"
+    return None
+
+
+def _store_metrics(storage: Storage, node_id: str, now_s: int, data: Dict[str, Any]) -> None:
     """Flatten metrics from a message and store them in the DB."""
 
     candidates: List[Dict[str, Any]] = []
@@ -506,10 +548,18 @@ def _store_metrics(node_id: str, now_s: int, data: Dict[str, Any]) -> None:
         if not flat:
             continue
         for metric, value in flat.items():
-            store_metric(now_s, node_id, metric, value)
+            storage.store_metric(now_s, node_id, metric, value)
+            events.publish(
+                "telemetry",
+                ts=now_s,
+                node_id=node_id,
+                metric=metric,
+                family=metric_family(metric),
+                value=float(value),
+            )
 
 
-def _store_traceroute(node_id: str, now_s: int, data: Dict[str, Any]) -> None:
+def _store_traceroute(storage: Storage, node_id: str, now_s: int, data: Dict[str, Any]) -> None:
     """Persist traceroute information if present in the message."""
     decoded = data.get("decoded") if isinstance(data.get("decoded"), dict) else None
     payload: Optional[Dict[str, Any]] = None
@@ -550,44 +600,108 @@ def _store_traceroute(node_id: str, now_s: int, data: Dict[str, Any]) -> None:
     if isinstance(payload.get("radio"), dict):
         for k, v in payload["radio"].items():
             radio_info[str(k)] = v
-    radio_json = json.dumps(radio_info) if radio_info else None
-
-    with DB_LOCK:
-        DB.execute(
-            "DELETE FROM traceroutes WHERE (src_id=? AND dest_id=?) OR (src_id=? AND dest_id=?)",
-            (src, dest, dest, src),
-        )
-        if TRACEROUTE_TTL > 0:
-            cutoff = now_s - TRACEROUTE_TTL
-            DB.execute("DELETE FROM traceroutes WHERE ts < ?", (cutoff,))
-        DB.execute(
+    radio_json = fastjson.dumps(radio_info) if radio_info else None
+    # SNR per hop di RouteDiscovery (quarti di dB): solo per la topologia, non
+    # in ``radio``, che distingue i traceroute ricevuti via radio da quelli MQTT
+    hop_radio = dict(radio_info)
+    for k in ("snr_towards", "snrTowards"):
+        if isinstance(payload.get(k), list):
+            hop_radio.setdefault("snr_towards", payload[k])
+
+    stale_where = "(src_id=? AND dest_id=?) OR (src_id=? AND dest_id=?)"
+    stale_params: List[Any] = [src, dest, dest, src]
+    if config.TRACEROUTE_TTL > 0:
+        stale_where += " OR ts < ?"
+        stale_params.append(now_s - config.TRACEROUTE_TTL)
+
+    with storage.lock:
+        db = storage.conn
+        stale = db.execute(
+            f"SELECT src_id, dest_id, route FROM traceroutes WHERE {stale_where}", stale_params
+        ).fetchall()
+        db.execute(f"DELETE FROM traceroutes WHERE {stale_where}", stale_params)
+        db.execute(
             "INSERT INTO traceroutes(ts, src_id, dest_id, route, hop_count, radio) VALUES(?,?,?,?,?,?)",
-            (now_s, src, dest, json.dumps(route_hex), hop_count, radio_json),
+            (now_s, src, dest, fastjson.dumps(route_hex), hop_count, radio_json),
         )
-        DB.commit()
+        # indice di adiacenza e stime solo per i nodi dei percorsi coinvolti
+        affected = estimator.add_route(db, estimator.route_path(src, route_hex, dest))
+        for s_src, s_dest, s_route in stale:
+            path = estimator.route_path(s_src, estimator.parse_route(s_route), s_dest)
+            affected |= estimator.add_route(db, path, -1)
+        estimator.refresh(db, affected)
+        storage.topology.observe(db, estimator.route_path(src, route_hex, dest), now_s, hop_radio)
+        db.commit()
+        storage.touch("traceroutes", "estimates", "topology")
+    events.publish(
+        "traceroute",
+        ts=now_s,
+        src_id=src,
+        dest_id=dest,
+        route=route_hex,
+        hop_count=hop_count,
+        radio=radio_info or None,
+        via="radio" if radio_info else "mqtt",
+        node_ids=[i for i in dict.fromkeys([src, *route_hex, dest]) if i],
+    )
         
         
+def _extract_text(data: Dict[str, Any], portnum: Optional[str]) -> Optional[str]:
+    """Return the body of a text message, if any."""
+
+    for container in (
+        data.get("decoded", {}).get("payload") if isinstance(data.get("decoded"), dict) else None,
+        data.get("payload"),
+        data,
+    ):
+        if isinstance(container, dict) and isinstance(container.get("text"), str):
+            return container["text"]
+    # MeshPacket protobuf: il payload testuale resta in base64
+    if portnum == "TEXT_MESSAGE_APP" and isinstance(data.get("decoded"), dict):
+        raw = data["decoded"].get("payload")
+        if isinstance(raw, str):
+            try:
+                return base64.b64decode(raw, validate=True).decode("utf-8")
+            except (binascii.Error, UnicodeDecodeError):
+                return raw
+    return None
+
+
 def _store_message(
-    node_id: str, now_s: int, data: Dict[str, Any], portnum: Optional[str]
+    storage: Storage, node_id: str, now_s: int, data: Dict[str, Any], portnum: Optional[str]
 ) -> None:
     """Persist any incoming message for later inspection."""
-    with DB_LOCK:
-        DB.execute(
-            "INSERT INTO messages(ts, node_id, portnum, raw_json) VALUES(?,?,?,?)",
-            (now_s, node_id, portnum, json.dumps(data)),
+    with storage.lock:
+        storage.conn.execute(
+            "INSERT INTO messages(ts, node_id, portnum, raw_json, text) VALUES(?,?,?,?,?)",
+            (now_s, node_id, portnum, fastjson.dumps(data), _extract_text(data, portnum)),
         )
-        DB.commit()
+        storage.conn.commit()
+        storage.touch("messages")
+
+def process_mqtt_message(topic: str, payload: bytes, storage: Optional[Storage] = None) -> None:
+    """Elabora un messaggio MQTT in formato JSON o Protobuf.
 
-def process_mqtt_message(topic: str, payload: bytes) -> None:
-    """Elabora un messaggio MQTT in formato JSON o Protobuf."""
+    ``storage`` è il DB su cui scrivere; se omesso si usa quello predefinito.
+    """
 
+    storage = storage or get_storage()
     now_s = int(time.time())
-    data = _decode_message(payload)
+    with instrument.DECODE_SECONDS.time():
+        data = _decode_message(payload)
     if not data:
+        instrument.MESSAGES_FAILED.inc("unknown", "decode")
         return
 
     portnum = _extract_portnum(data)
-    node_id = _process_node(data, topic, now_s, portnum)
-    _store_metrics(node_id, now_s, data)
-    _store_traceroute(node_id, now_s, data)
-    _store_message(node_id, now_s, data, portnum)
+    port_label = instrument.label(portnum)
+    instrument.MESSAGES_DECODED.inc(port_label)
+    try:
+        with instrument.PROCESS_SECONDS.time(port_label):
+            node_id = _process_node(storage, data, topic, now_s, portnum)
+            _store_metrics(storage, node_id, now_s, data)
+            _store_traceroute(storage, node_id, now_s, data)
+            _store_message(storage, node_id, now_s, data, portnum)
+    except Exception:
+        instrument.MESSAGES_FAILED.inc(port_label, "store")
+        raise
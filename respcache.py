@@ -0,0 +1,141 @@
+"""Cache in memoria delle risposte degli endpoint più richiesti.
+
+Le voci contengono il corpo già serializzato (byte) e sono indicizzate dai
+parametri normalizzati della richiesta. Ogni voce ricorda le versioni dei
+dati da cui dipende (tabelle ed eventualmente nodi, vedi
+:meth:`database.Storage.touch`): quando l'ingest scrive su quei dati la voce
+smette di valere, mentre le scritture su altri nodi o tabelle la lasciano
+intatta. Lo spazio è limitato in byte con rimozione LRU.
+
+Richieste identiche contemporanee sono accorpate (*single-flight*): la prima
+esegue la query, le altre attendono il suo risultato.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+if TYPE_CHECKING:  # pragma: no cover - solo per i type hint
+    from database import Storage
+
+# attesa massima di un risultato calcolato da un'altra richiesta
+FLIGHT_TIMEOUT = 30.0
+
+
+class Entry(NamedTuple):
+    body: bytes
+    media_type: str
+    tables: Tuple[str, ...]
+    node_ids: Optional[Tuple[str, ...]]
+    version: int
+
+
+class Computed(NamedTuple):
+    """Risultato di una query: corpo, tipo e nodi da cui dipende (``None`` = tutti)."""
+
+    body: bytes
+    media_type: str
+    status_code: int = 200
+    node_ids: Optional[List[str]] = None
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[Computed] = None
+
+
+class ResponseCache:
+    """LRU limitata in byte, invalidata dalle versioni dello storage."""
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries: "OrderedDict[Hashable, Entry]" = OrderedDict()
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def _valid(self, storage: "Storage", entry: Entry) -> bool:
+        return storage.data_version(entry.tables, entry.node_ids)[0] == entry.version
+
+    def _store(self, key: Hashable, entry: Entry) -> None:
+        # chiamato con ``_lock`` acquisito
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old.body)
+        if len(entry.body) > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self.size += len(entry.body)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.body)
+
+    def get_or_compute(
+        self,
+        storage: "Storage",
+        key: Hashable,
+        tables: Tuple[str, ...],
+        compute: Callable[[], Computed],
+    ) -> Computed:
+        """Restituisce la risposta per ``key``, calcolandola solo se serve.
+
+        ``compute`` viene eseguita al più una volta per chiave anche con più
+        richieste in parallelo; solo le risposte 200 vengono conservate.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._valid(storage, entry):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return Computed(entry.body, entry.media_type, 200, entry.node_ids)
+                self._entries.pop(key)
+                self.size -= len(entry.body)
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            self.misses += 1
+
+        if not leader:
+            if flight.done.wait(FLIGHT_TIMEOUT) and flight.result is not None:
+                with self._lock:
+                    self.coalesced += 1
+                return flight.result
+            return compute()
+
+        try:
+            # versioni lette prima della query: una scrittura concorrente rende
+            # la voce già scaduta invece di farla sembrare aggiornata
+            versions = storage.versions.copy()
+            result = compute()
+            if result.status_code == 200:
+                node_ids = tuple(result.node_ids) if result.node_ids is not None else None
+                version = storage.data_version(tables, node_ids, versions)[0]
+                with self._lock:
+                    self._store(key, Entry(result.body, result.media_type, tables, node_ids, version))
+            flight.result = result
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
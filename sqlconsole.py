@@ -0,0 +1,183 @@
+"""Console SQL di amministrazione con limiti di tempo e di righe.
+
+Le letture (``SELECT``, ``WITH``, ``VALUES``, ``EXPLAIN`` e ``PRAGMA`` senza
+assegnazione) girano su una connessione in sola lettura separata (vedi
+:func:`export.readonly_connection`): una query lenta non tiene il lock
+dell'ingest. Ogni passo di SQLite controlla, tramite
+``set_progress_handler``, il tempo massimo concesso alla query: oltre quel
+limite SQLite la interrompe. Le righe sono lette a blocchi e inviate man mano
+come documento JSON ``{"columns": [...], "rows": [...], ...}``, fermandosi
+a ``max_rows``.
+
+Le altre istruzioni vanno sulla connessione condivisa con lo stesso limite
+di tempo; se interrotte vengono annullate.
+"""
+
+import re
+import sqlite3
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import fastjson
+
+DEFAULTS: Dict[str, Any] = {
+    # righe massime restituite da una lettura
+    "max_rows": 10000,
+    # secondi concessi a una query prima dell'interruzione
+    "timeout_s": 10.0,
+}
+FETCH_ROWS = 500
+# istruzioni SQLite tra un controllo del tempo e il successivo
+PROGRESS_STEPS = 10000
+
+_COMMENTS = re.compile(r"^\s*(?:--[^\n]*\n|/\*.*?\*/|\s)*", re.S)
+_READ_KEYWORDS = ("select", "with", "values", "explain")
+
+
+class Interrupted(sqlite3.OperationalError):
+    """La query ha superato il tempo concesso."""
+
+
+def parse_options(cfg: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    opts = dict(DEFAULTS)
+    opts.update(cfg or {})
+    opts["max_rows"] = int(opts["max_rows"])
+    opts["timeout_s"] = float(opts["timeout_s"])
+    if opts["max_rows"] < 1 or opts["timeout_s"] <= 0:
+        raise ValueError("admin_sql.max_rows e admin_sql.timeout_s devono essere positivi")
+    return opts
+
+
+def is_read(query: str) -> bool:
+    """Vero per le istruzioni che non modificano il DB (in base alla parola iniziale)."""
+    body = _COMMENTS.sub("", query, count=1)
+    word = body.split(None, 1)[0].lower() if body.strip() else ""
+    if word == "pragma":
+        # ``PRAGMA x = y`` modifica, ``PRAGMA x`` e ``PRAGMA x(tabella)`` leggono
+        return "=" not in body
+    return word in _READ_KEYWORDS
+
+
+def mentions(query: str, *names: str) -> bool:
+    """Vero se ``query`` nomina uno degli identificatori (parola intera, senza maiuscole)."""
+    pattern = r"\b(?:" + "|".join(re.escape(n) for n in names) + r")\b"
+    return re.search(pattern, query, re.I) is not None
+
+
+@contextmanager
+def time_budget(conn: sqlite3.Connection, deadline: float) -> Iterator[None]:
+    """Interrompe le istruzioni di ``conn`` eseguite oltre ``deadline`` (``time.monotonic``)."""
+    conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, PROGRESS_STEPS)
+    try:
+        yield
+    except sqlite3.OperationalError as e:
+        if time.monotonic() > deadline and "interrupt" in str(e).lower():
+            raise Interrupted(str(e)) from None
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+def _cell(value: Any) -> Any:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<blob {len(value)} bytes>"
+    return value
+
+
+def explain(conn: sqlite3.Connection, query: str, params: Sequence[Any], deadline: float) -> Dict[str, Any]:
+    """``EXPLAIN QUERY PLAN`` come lista di nodi e come albero indentato."""
+    with time_budget(conn, deadline):
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+    depth: Dict[int, int] = {0: -1}
+    plan: List[Dict[str, Any]] = []
+    lines: List[str] = []
+    for node_id, parent, _unused, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        plan.append({"id": node_id, "parent": parent, "detail": detail})
+        lines.append("  " * depth[node_id] + detail)
+    return {"plan": plan, "text": "\n".join(lines)}
+
+
+class ReadQuery:
+    """Lettura in corso: colonne note subito, righe prodotte a blocchi."""
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        query: str,
+        params: Sequence[Any],
+        max_rows: int,
+        timeout_s: float,
+        lock: Any = None,
+    ) -> None:
+        self.conn = conn
+        self.max_rows = max_rows
+        self.timeout_s = timeout_s
+        # con ``lock`` la connessione è quella condivisa (DB in memoria): la sola
+        # lettura è imposta con ``query_only`` durante ogni passo
+        self.shared = lock is not None
+        self.lock = lock or nullcontext()
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout_s
+        # errori di sintassi, tabelle inesistenti e timeout sul primo passo
+        # emergono qui, prima di iniziare la risposta
+        with self._step():
+            self.cur = self.conn.execute(query, params)
+            self.columns = [c[0] for c in self.cur.description or ()]
+            self._pending: List[Tuple] = self.cur.fetchmany(FETCH_ROWS)
+
+    @contextmanager
+    def _step(self) -> Iterator[None]:
+        with self.lock, time_budget(self.conn, self.deadline):
+            if not self.shared:
+                yield
+                return
+            self.conn.execute("PRAGMA query_only = 1")
+            try:
+                yield
+            finally:
+                self.conn.execute("PRAGMA query_only = 0")
+
+    def _batches(self) -> Iterator[List[Tuple]]:
+        batch = self._pending
+        while batch:
+            yield batch
+            with self._step():
+                batch = self.cur.fetchmany(FETCH_ROWS)
+
+    def chunks(self) -> Iterator[bytes]:
+        """Documento JSON a pezzi; un errore a metà finisce nel campo ``error``."""
+        yield b'{"columns":' + fastjson.dumps_bytes(self.columns) + b',"rows":['
+        count = 0
+        truncated = False
+        error: Optional[str] = None
+        try:
+            for batch in self._batches():
+                room = self.max_rows - count
+                if len(batch) > room:
+                    batch = batch[:room]
+                    truncated = True
+                parts = [fastjson.dumps_bytes(dict(zip(self.columns, map(_cell, row)))) for row in batch]
+                yield (b"," if count else b"") + b",".join(parts)
+                count += len(batch)
+                if count >= self.max_rows:
+                    if not truncated:
+                        with self._step():
+                            truncated = self.cur.fetchone() is not None
+                    break
+        except Interrupted:
+            error = f"query interrupted: time budget of {self.timeout_s:g} s exceeded"
+        except sqlite3.Error as e:
+            error = str(e)
+        finally:
+            with self.lock:
+                self.cur.close()
+        trailer: Dict[str, Any] = {
+            "row_count": count,
+            "truncated": truncated,
+            "elapsed_ms": round((time.monotonic() - self.started) * 1000, 1),
+        }
+        if error:
+            trailer["error"] = error
+        yield b"]," + fastjson.dumps_bytes(trailer)[1:]
@@ -219,39 +219,175 @@ function updateNickInput(){
   $nick.value = n && n.nickname ? n.nickname : '';
 }
 
-async function loadData(){
+// Decodifica la risposta binaria di /api/metrics?format=binary:
+// "MPM1", uint32 lunghezza JSON, JSON {units, cursor, series:[{family,node_id,label,count}]},
+// padding a 8 byte, poi per serie count int64 (ms) + count float64.
+function decodeMetrics(buf){
+  const view = new DataView(buf);
+  const magic = String.fromCharCode(...new Uint8Array(buf, 0, 4));
+  if (magic !== 'MPM1') throw new Error('formato metriche sconosciuto');
+  const hlen = view.getUint32(4, true);
+  const meta = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, 8, hlen)));
+  let off = 8 + hlen;
+  off += (8 - off % 8) % 8;
+  const series = {};
+  for (const s of meta.series){
+    const ts = new BigInt64Array(buf, off, s.count);
+    off += 8 * s.count;
+    const vals = new Float64Array(buf, off, s.count);
+    off += 8 * s.count;
+    const data = new Array(s.count);
+    for (let i = 0; i < s.count; i++) data[i] = { x: Number(ts[i]), y: vals[i] };
+    (series[s.family] ||= []).push({ node_id: s.node_id, label: s.label, data });
+  }
+  return { units: meta.units, cursor: meta.cursor, series };
+}
+
+function datasetLabel(ds){
+  const pts = ds.data;
+  const last = pts.length ? Number(pts[pts.length - 1].y).toFixed(2) : 'n/a';
+  return ds.showNode ? `${last} ${ds.unit} ${ds.node}` : `${last} ${ds.unit}`;
+}
+
+function mkDataset(nodeId, dataPoints, unit, showNode){
+  const node = nodesMap[nodeId]?.short_name || nodeId.slice(-4);
+  const color = colorFor(nodeId);
+  const ds = { nodeId, data: dataPoints, node, unit, showNode, borderColor: color, backgroundColor: color };
+  ds.label = datasetLabel(ds);
+  return ds;
+}
+
+// cursore dell'ultima risposta di /api/metrics e parametri a cui si riferisce
+let _metricsState = null;
+let _units = {};
+
+async function loadData(incremental = false){
   const ids = Array.from($nodes.querySelectorAll('input[type=checkbox]:checked')).map(cb => cb.value);
   const names = ids.join(',');
   const since = $range.value;
+  const key = JSON.stringify([names, since, $showNick.checked]);
+  // in aggiornamento automatico chiede solo i campioni dopo il cursore
+  const inc = incremental && _metricsState && _metricsState.key === key && _metricsState.cursor != null;
   const url = new URL('/api/metrics', location.origin);
   if (names) url.searchParams.set('nodes', names);
   url.searchParams.set('since_s', since);
   url.searchParams.set('use_nick', $showNick.checked ? '1' : '0');
+  // non serve più di un punto per pixel: il server riduce le serie (LTTB)
+  url.searchParams.set('max_points', String(Math.round(Math.min(4000, Math.max(300, window.innerWidth)))));
+  url.searchParams.set('format', 'binary');
+  if (inc) url.searchParams.set('after_ts', String(_metricsState.cursor));
   const res = await fetch(url);
-  const data = await res.json();
+  const data = decodeMetrics(await res.arrayBuffer());
+  const keyChanged = !_metricsState || _metricsState.key !== key;
+  _metricsState = { key, cursor: data.cursor };
   const series = data.series || {};
   const units = data.units || {};
+  _units = units;
+  // nodi selezionati cambiati: il flusso live va riaperto con il nuovo filtro
+  if (keyChanged && _live) startLive();
   const showNode = ids.length > 1;
+  const cutoff = Date.now() - Number(since) * 1000;
   for (const fam of Object.keys(charts)){
     const unit = units[fam] || '';
     const showZero = zeroToggles[fam]?.checked;
-    const ds = (series[fam] || []).map(s => {
-      const dataPoints = showZero ? s.data : s.data.filter(p => Number(p.y) !== 0);
-      const last = dataPoints.length ? Number(dataPoints[dataPoints.length - 1].y).toFixed(2) : 'n/a';
-      const nodeId = s.node_id;
-      const short = nodesMap[nodeId]?.short_name || nodeId.slice(-4);
-      const node = short;
-      const label = showNode ? `${last} ${unit} ${node}` : `${last} ${unit}`;
-      const color = colorFor(nodeId);
-      return { label, data: dataPoints, node, unit, showNode, borderColor: color, backgroundColor: color };
-    });
-    charts[fam].data.datasets = ds;
-    charts[fam].update();
-    if (ds.length > 0 && !_hasViewSettings) toggles[fam].checked = true;
+    if (!inc){
+      const ds = (series[fam] || []).map(s => {
+        const dataPoints = showZero ? s.data : s.data.filter(p => Number(p.y) !== 0);
+        return mkDataset(s.node_id, dataPoints, unit, showNode);
+      });
+      charts[fam].data.datasets = ds;
+      charts[fam].update();
+    } else {
+      const datasets = charts[fam].data.datasets;
+      for (const s of series[fam] || []){
+        let ds = datasets.find(d => d.nodeId === s.node_id);
+        if (!ds){
+          ds = mkDataset(s.node_id, [], unit, showNode);
+          datasets.push(ds);
+        }
+        // il secondo in corso può arrivare due volte: si accoda solo ciò che è più recente
+        const lastX = ds.data.length ? ds.data[ds.data.length - 1].x : -Infinity;
+        for (const p of s.data){
+          if (p.x > lastX && (showZero || Number(p.y) !== 0)) ds.data.push(p);
+        }
+      }
+      // scarta la coda più vecchia della finestra selezionata
+      for (const ds of datasets){
+        let i = 0;
+        while (i < ds.data.length && ds.data[i].x < cutoff) i++;
+        if (i) ds.data.splice(0, i);
+        ds.label = datasetLabel(ds);
+      }
+      charts[fam].update('none');
+    }
+    if (charts[fam].data.datasets.length > 0 && !_hasViewSettings) toggles[fam].checked = true;
     cards[fam].style.display = toggles[fam].checked ? '' : 'none';
   }
 }
 
+// ---------- aggiornamento live (Server-Sent Events) ----------
+let _live = null;
+const _dirty = new Set();
+let _flushTimer = null;
+
+function trimDataset(ds){
+  const cutoff = Date.now() - Number($range.value) * 1000;
+  let i = 0;
+  while (i < ds.data.length && ds.data[i].x < cutoff) i++;
+  if (i) ds.data.splice(0, i);
+  ds.label = datasetLabel(ds);
+}
+
+// ridisegna al massimo una volta al secondo i grafici che hanno ricevuto campioni
+function flushCharts(){
+  _flushTimer = null;
+  for (const fam of _dirty){
+    charts[fam].data.datasets.forEach(trimDataset);
+    charts[fam].update('none');
+    if (!_hasViewSettings) toggles[fam].checked = true;
+    cards[fam].style.display = toggles[fam].checked ? '' : 'none';
+  }
+  _dirty.clear();
+}
+
+function onTelemetry(ev){
+  const fam = ev.family;
+  if (!fam || !charts[fam]) return;
+  if (!zeroToggles[fam]?.checked && Number(ev.value) === 0) return;
+  const ids = Array.from($nodes.querySelectorAll('input[type=checkbox]:checked')).map(cb => cb.value);
+  const datasets = charts[fam].data.datasets;
+  let ds = datasets.find(d => d.nodeId === ev.node_id);
+  if (!ds){
+    ds = mkDataset(ev.node_id, [], _units[fam] || '', ids.length > 1);
+    datasets.push(ds);
+  }
+  const x = ev.ts * 1000;
+  const lastX = ds.data.length ? ds.data[ds.data.length - 1].x : -Infinity;
+  if (x > lastX) ds.data.push({ x, y: ev.value });
+  _dirty.add(fam);
+  if (!_flushTimer) _flushTimer = setTimeout(flushCharts, 1000);
+}
+
+function stopLive(){
+  if (_live){ _live.close(); _live = null; }
+}
+
+function startLive(){
+  stopLive();
+  const ids = Array.from($nodes.querySelectorAll('input[type=checkbox]:checked')).map(cb => cb.value);
+  const url = new URL('/api/events', location.origin);
+  url.searchParams.set('types', 'telemetry');
+  if (ids.length) url.searchParams.set('nodes', ids.join(','));
+  const es = new EventSource(url);
+  let lost = false;
+  es.addEventListener('telemetry', e => onTelemetry(JSON.parse(e.data)));
+  // buffer pieno lato server: riapre il flusso e recupera i campioni persi
+  es.addEventListener('overflow', () => { lost = true; });
+  es.onerror = () => { lost = true; };
+  es.onopen = () => { if (lost){ lost = false; loadData(true); } };
+  _live = es;
+}
+
 $refresh.onclick = () => { loadNodes(); loadData(); };
 $saveNick.onclick = async () => {
   const first = $nodes.querySelector('input[type=checkbox]:checked');
@@ -270,10 +406,12 @@ $showNick.onchange = () => { saveViewSettings(); loadNodes(); loadData(); };
 $autoref.onchange = () => {
   saveViewSettings();
   clearInterval(window._timer);
+  stopLive();
   if ($autoref.checked){
-    const tick = () => { loadNodes(); loadData(); };
-    tick();
-    window._timer = setInterval(tick, 15000);
+    // i campioni arrivano in push; l'elenco nodi si aggiorna di rado
+    loadData(true);
+    startLive();
+    window._timer = setInterval(loadNodes, 60000);
   }
 };
 window.addEventListener('beforeunload', saveViewSettings);
@@ -9,6 +9,10 @@ let routesVisible = true;
 let showNames = false;
 let centerNodeId = localStorage.getItem('centerNodeId');
 let nodeRouteFilter = null;
+// sotto questo zoom la mappa mostra celle con il numero di nodi (vedi /api/map/clusters)
+const CLUSTER_MAX_ZOOM = 12;
+let clusterLayer = null;
+let mode = null;
 
 const hopColors = ['#00ff00','#7fff00','#bfff00','#ffff00','#ffbf00','#ff8000','#ff4000','#ff0000'];
 const MAX_HOPS = hopColors.length - 1;
@@ -49,53 +53,97 @@ function haversine(lat1, lon1, lat2, lon2){
 }
 
 
+function viewportBBox(){
+  // riquadro visibile allargato del 20% per non far comparire i marker a scatti
+  const b = map.getBounds().pad(0.2);
+  const west = Math.max(b.getWest(), -180), east = Math.min(b.getEast(), 180);
+  const south = Math.max(b.getSouth(), -90), north = Math.min(b.getNorth(), 90);
+  return `${west},${south},${east},${north}`;
+}
+
+// crea o sposta il marker di un nodo; true se la mappa è stata centrata su di esso
+function placeNode(n, center){
+  if (n.lat == null || n.lon == null) return false;
+  let centered = false;
+  const pos = [n.lat, n.lon];
+  const prev = nodePositions.get(n.node_id);
+  if (prev){
+    if (prev[0] !== pos[0] || prev[1] !== pos[1]){
+      removeNodeRoutes(n.node_id);
+      const mk = nodeMarkers.get(n.node_id);
+      if (mk) mk.marker.setLatLng(pos);
+    }
+  }else{
+    const name = n.nickname || n.long_name || n.short_name || n.node_id;
+    const label = showNames && n.short_name ? n.short_name : '';
+    const m = L.marker(pos,{icon:nodeIcon(n.node_id, label), opacity: n.estimated ? 0.6 : 1}).addTo(map);
+    const last = n.last_seen ? new Date(n.last_seen*1000).toLocaleString() : '';
+    const alt = n.alt != null ? `<br/>Alt: ${n.alt} m` : '';
+    const est = n.estimated ? '<br/><i>Posizione stimata dai traceroute</i>' : '';
+
+    const checked = nodeRouteFilter === n.node_id ? 'checked' : '';
+    m.bindPopup(`<b>${name}</b><br/>ID: ${n.node_id}<br/>Ultimo: ${last}${alt}${est}<br/><label><input type="checkbox" onclick="viewNodeRoutes('${n.node_id}', this.checked)" ${checked}/> Visualizza tracce nodo</label>`);
+    nodeMarkers.set(n.node_id,{marker:m,short:n.short_name||''});
+    if (center && !centerNodeId){ map.setView(pos,13); centered = true; }
+  }
+  nodePositions.set(n.node_id,pos);
+  return centered;
+}
+
 async function loadNodes(){
   let fetched = [];
   try{
-    const res = await fetch('/api/nodes?include_inactive=false');
+    const res = await fetch(`/api/nodes?include_inactive=false&bbox=${viewportBBox()}`);
     fetched = await res.json();
   }catch{
     return;
   }
-  let first = nodes.length === 0;
-  if (first && centerNodeId){
-    const cn = fetched.find(n => n.node_id === centerNodeId && n.lat != null && n.lon != null);
-    if (cn){
-      map.setView([cn.lat, cn.lon],13);
-      first = false;
-    }
+  if (mode !== 'nodes') return;  // nel frattempo si è tornati alle celle
+  for (const n of fetched) placeNode(n, false);
+  const byId = new Map(nodes.map(n => [n.node_id, n]));
+  for (const n of fetched) byId.set(n.node_id, n);
+  nodes = Array.from(byId.values());
+}
+
+function clearNodes(){
+  nodeMarkers.forEach(v => map.removeLayer(v.marker));
+  nodeMarkers.clear();
+  nodePositions.clear();
+  nodes = [];
+}
+
+async function loadClusters(){
+  const zoom = map.getZoom();
+  let data;
+  try{
+    const res = await fetch(`/api/map/clusters?bbox=${viewportBBox()}&zoom=${zoom}`);
+    data = await res.json();
+  }catch{
+    return;
   }
-  for (const n of fetched){
-    if (n.lat != null && n.lon != null){
-      const pos = [n.lat, n.lon];
-      const prev = nodePositions.get(n.node_id);
-      if (prev){
-        if (prev[0] !== pos[0] || prev[1] !== pos[1]){
-          removeNodeRoutes(n.node_id);
-          const mk = nodeMarkers.get(n.node_id);
-          if (mk) mk.marker.setLatLng(pos);
-        }
-      }else{
-        const name = n.nickname || n.long_name || n.short_name || n.node_id;
-        const label = showNames && n.short_name ? n.short_name : '';
-        const m = L.marker(pos,{icon:nodeIcon(n.node_id, label)}).addTo(map);
-        const last = n.last_seen ? new Date(n.last_seen*1000).toLocaleString() : '';
-        const alt = n.alt != null ? `<br/>Alt: ${n.alt} m` : '';
-
-        const checked = nodeRouteFilter === n.node_id ? 'checked' : '';
-        m.bindPopup(`<b>${name}</b><br/>ID: ${n.node_id}<br/>Ultimo: ${last}${alt}<br/><label><input type="checkbox" onclick="viewNodeRoutes('${n.node_id}', this.checked)" ${checked}/> Visualizza tracce nodo</label>`);
-        nodeMarkers.set(n.node_id,{marker:m,short:n.short_name||''});
-        if (first && !centerNodeId){ map.setView(pos,13); first=false; }
-      }
-      nodePositions.set(n.node_id,pos);
+  // risposta superata da un altro spostamento
+  if (mode !== 'clusters' || map.getZoom() !== zoom) return;
+  clusterLayer.clearLayers();
+  if (routesVisible){
+    for (const l of data.links){
+      L.polyline([l.from, l.to], {color:'#3388ff', weight:Math.min(1 + Math.log2(l.links), 8), opacity:0.6})
+        .bindTooltip(`${l.links} collegament${l.links === 1 ? 'o' : 'i'}, ${l.count} traceroute`)
+        .addTo(clusterLayer);
     }
   }
-  nodes = fetched;
-  if (centerNodeId){
-    const cn = nodes.find(n => n.node_id === centerNodeId && n.lat != null && n.lon != null);
-    if (cn) map.setView([cn.lat, cn.lon],13);
+  for (const c of data.clusters){
+    let mk;
+    if (c.count === 1){
+      mk = L.circleMarker([c.lat, c.lon], {radius:5, color:colorFor(c.node_id), fillOpacity:0.8});
+      mk.bindTooltip(c.name);
+      mk.on('click', () => map.setView([c.lat, c.lon], CLUSTER_MAX_ZOOM));
+    }else{
+      mk = L.circleMarker([c.lat, c.lon], {radius:8 + 3*Math.log2(c.count), color:'#ff7800', weight:1, fillOpacity:0.5});
+      mk.bindTooltip(`${c.count}`, {permanent:true, direction:'center'});
+      mk.on('click', () => map.fitBounds([[c.bbox[1], c.bbox[0]], [c.bbox[3], c.bbox[2]]]));
+    }
+    mk.addTo(clusterLayer);
   }
-
 }
 
 function clearRoutes(){
@@ -108,77 +156,60 @@ function clearRoutes(){
   focusLine = null;
 }
 
-async function loadTraceroutes(){
-  clearRoutes();
-
-  let routes = [];
+async function loadTopology(){
+  let topo;
   try{
-    // Fetch a large batch so recent traceroutes appear on the map
-    const res = await fetch('/api/traceroutes?limit=1000');
-    routes = await res.json();
+    const res = await fetch('/api/topology');
+    topo = await res.json();
   }catch{
-    routes = [];
+    return;
   }
-  if (nodeRouteFilter){
-    routes = routes.filter(r => {
-      const ids = [r.src_id, ...(r.route || []), r.dest_id].filter(Boolean);
-      return ids.includes(nodeRouteFilter);
+  if (mode !== 'nodes') return;
+  clearRoutes();
+  const f = {};
+  topo.edge_fields.forEach((name, i) => { f[name] = i; });
+
+  // un arco orientato per verso: sulla mappa una sola linea per coppia di nodi
+  const pairs = new Map();
+  const view = map.getBounds().pad(0.2);
+  for (const e of topo.edges){
+    const a = topo.nodes[e[f.source]], b = topo.nodes[e[f.target]];
+    if (nodeRouteFilter && a.id !== nodeRouteFilter && b.id !== nodeRouteFilter) continue;
+    if (a.lat == null || a.lon == null || b.lat == null || b.lon == null) continue;
+    if (!view.contains([a.lat, a.lon]) && !view.contains([b.lat, b.lon])) continue;
+    const key = a.id < b.id ? `${a.id}|${b.id}` : `${b.id}|${a.id}`;
+    if (!pairs.has(key)) pairs.set(key, {a, b, directions: []});
+    pairs.get(key).directions.push({
+      from: a, to: b,
+      count: e[f.count], ts: e[f.last_seen], hop: e[f.hop], snr: e[f.snr], rssi: e[f.rssi],
     });
   }
 
-  for (const r of routes){
-    // Include src and dest IDs even if the stored route only contains hops
-    const ids = [r.src_id, ...(r.route || []), r.dest_id].filter(Boolean);
-    const path = [];
-    const names = [];
-    for (const id of ids){
-      const n = nodes.find(nd => nd.node_id === id);
-      if (n && n.lat != null && n.lon != null){
-        path.push([n.lat, n.lon]);
-      }
-      names.push(n ? (n.nickname || n.long_name || n.short_name || id) : id);
-    }
-    if (path.length >= 2){
-      const hop = Math.min(r.hop_count, MAX_HOPS);
-      const color = hopColor(hop);
-      const line = L.polyline(path, {color, weight:2});
-      line.bindTooltip(`${r.hop_count} hop${r.hop_count===1?'':'s'}`);
-
-      const srcNode = nodes.find(nd => nd.node_id === r.src_id) || {};
-      const destNode = nodes.find(nd => nd.node_id === r.dest_id) || {};
-      const srcName = srcNode.nickname || srcNode.long_name || srcNode.short_name || r.src_id;
-      const destName = destNode.nickname || destNode.long_name || destNode.short_name || r.dest_id;
-      let distance = null;
-      if (srcNode.lat != null && srcNode.lon != null && destNode.lat != null && destNode.lon != null){
-        distance = haversine(srcNode.lat, srcNode.lon, destNode.lat, destNode.lon);
-      }
-      const segments = [];
-      for (let i=0;i<ids.length-1;i++){
-        const a = nodes.find(nd => nd.node_id === ids[i]) || {};
-        const b = nodes.find(nd => nd.node_id === ids[i+1]) || {};
-        let dist = null;
-        if (a.lat!=null && a.lon!=null && b.lat!=null && b.lon!=null){
-          dist = haversine(a.lat,a.lon,b.lat,b.lon);
-        }
-        segments.push({from:names[i], to:names[i+1], distance:dist});
-      }
-      line.info = {srcName, destName, ts:r.ts, distance, radio:r.radio, via:r.via, names, segments};
-      line.on('click', e => {highlightRoute(line); if (focusLine === line) showRouteInfo(line, e.latlng);});
-
-      line.nodeIds = ids;
-      line.defaultColor = color;
-      const markers = path.map((pt, idx) => {
-        const c = colorFor(ids[idx]);
-        const mk = L.circleMarker(pt, {radius:4, color:c});
-        mk.defaultColor = c;
-        return mk;
-      });
-      routeLines.push(line);
-      routeMarkers.set(line, markers);
-      if (routesVisible){
-        line.addTo(map);
-        markers.forEach(m => m.addTo(map));
-      }
+  for (const {a, b, directions} of pairs.values()){
+    const latest = directions.reduce((x, y) => (y.ts > x.ts ? y : x));
+    const color = hopColor(latest.hop + 1);
+    const line = L.polyline([[a.lat, a.lon], [b.lat, b.lon]], {color, weight:2});
+    const count = directions.reduce((n, d) => n + d.count, 0);
+    line.bindTooltip(`${a.name} ↔ ${b.name}: ${count} traceroute`);
+    line.info = {
+      srcName: a.name, destName: b.name, ts: latest.ts,
+      distance: haversine(a.lat, a.lon, b.lat, b.lon), directions,
+    };
+    line.on('click', e => {highlightRoute(line); if (focusLine === line) showRouteInfo(line, e.latlng);});
+
+    line.nodeIds = [a.id, b.id];
+    line.defaultColor = color;
+    const markers = [a, b].map(n => {
+      const c = colorFor(n.id);
+      const mk = L.circleMarker([n.lat, n.lon], {radius:4, color:c});
+      mk.defaultColor = c;
+      return mk;
+    });
+    routeLines.push(line);
+    routeMarkers.set(line, markers);
+    if (routesVisible){
+      line.addTo(map);
+      markers.forEach(m => m.addTo(map));
     }
   }
 }
@@ -210,19 +241,14 @@ function highlightRoute(line){
 
 function showRouteInfo(line, latlng){
   const info = line.info || {};
-  const time = info.ts ? new Date(info.ts*1000).toLocaleString() : '';
   const dist = info.distance != null ? info.distance.toFixed(2) + ' km' : 'N/D';
-  const type = info.via === 'radio' ? 'Radio' : 'MQTT';
-  let signal = '';
-  if (info.via === 'radio'){
-    signal = info.radio ? Object.entries(info.radio).map(([k,v]) => `${k}: ${v}`).join('<br/>') : 'N/D';
-  }
-  const pathStr = info.names ? info.names.join(' → ') : '';
-  let segHtml = '';
-  if (info.segments){
-    segHtml = info.segments.map(s => `${s.from} → ${s.to}: ${s.distance != null ? s.distance.toFixed(2)+' km' : 'N/D'}`).join('<br/>');
-  }
-  const html = `<b>${info.srcName||''}</b> → <b>${info.destName||''}</b><br/>${time}<br/>Collegamento: ${type}${signal?'<br/>'+signal:''}<br/>Distanza: ${dist}${pathStr?'<br/>'+pathStr:''}${segHtml?'<br/>'+segHtml:''}`;
+  const dirs = (info.directions || []).map(d => {
+    const time = d.ts ? new Date(d.ts*1000).toLocaleString() : '';
+    const signal = [d.snr != null ? `SNR ${d.snr} dB` : '', d.rssi != null ? `RSSI ${d.rssi} dBm` : '']
+      .filter(Boolean).join(', ');
+    return `${d.from.name} → ${d.to.name}: ${d.count}× (hop ${d.hop + 1}), ultimo ${time}${signal ? '<br/>' + signal : ''}`;
+  }).join('<br/>');
+  const html = `<b>${info.srcName||''}</b> ↔ <b>${info.destName||''}</b><br/>Distanza: ${dist}${dirs?'<br/>'+dirs:''}`;
   L.popup().setLatLng(latlng).setContent(html).openOn(map);
 }
 
@@ -238,6 +264,7 @@ function setRoutesVisibility(vis){
     }
   });
   if (!vis) focusLine = null;
+  if (mode === 'clusters') loadClusters();
 }
 
 function setNamesVisibility(vis){
@@ -255,7 +282,7 @@ function viewNodeRoutes(nodeId, checked){
     document.getElementById('showRoutes').checked = true;
     setRoutesVisibility(true);
   }
-  loadTraceroutes();
+  loadTopology();
 
 }
 
@@ -299,15 +326,86 @@ function init(){
     setNamesVisibility(e.target.checked);
   });
   addHopLegend();
+  clusterLayer = L.layerGroup().addTo(map);
+  map.on('moveend', () => refresh());
 }
 
+// vista iniziale: il nodo scelto in /setup oppure l'insieme di tutti i nodi
+async function initialView(){
+  try{
+    if (centerNodeId){
+      const res = await fetch('/api/nodes?include_inactive=false');
+      const cn = (await res.json()).find(n => n.node_id === centerNodeId && n.lat != null && n.lon != null);
+      if (cn){ map.setView([cn.lat, cn.lon], 13); return; }
+    }
+    const res = await fetch('/api/map/clusters?bbox=-180,-85,180,85&zoom=0');
+    const clusters = (await res.json()).clusters;
+    if (clusters.length){
+      map.fitBounds(L.latLngBounds(clusters.map(c => [c.lat, c.lon])).pad(0.2), {maxZoom:13});
+      return;
+    }
+  }catch{}
+  refresh();
+}
+
+// celle a zoom bassi, singoli nodi e collegamenti da vicino
 async function refresh(){
-  await loadNodes();
-  await loadTraceroutes();
+  if (map.getZoom() < CLUSTER_MAX_ZOOM){
+    if (mode !== 'clusters'){
+      mode = 'clusters';
+      clearNodes();
+      clearRoutes();
+    }
+    await loadClusters();
+  }else{
+    if (mode !== 'nodes'){
+      mode = 'nodes';
+      clusterLayer.clearLayers();
+    }
+    await loadNodes();
+    await loadTopology();
+  }
+}
+
+// ---------- aggiornamenti live (Server-Sent Events) ----------
+let _routesTimer = null;
+let _clustersTimer = null;
+
+function onNodeEvent(ev){
+  if (mode !== 'nodes'){ scheduleClusters(); return; }
+  const known = nodes.find(n => n.node_id === ev.node_id);
+  const n = known || { node_id: ev.node_id };
+  // l'evento porta solo i campi presenti nel pacchetto ricevuto
+  for (const k of ['short_name', 'long_name', 'last_seen', 'lat', 'lon', 'alt']){
+    if (ev[k] != null) n[k] = ev[k];
+  }
+  if (!known) nodes.push(n);
+  placeNode(n, false);
+}
+
+function onTracerouteEvent(){
+  if (mode !== 'nodes'){ scheduleClusters(); return; }
+  // più traceroute ravvicinati si traducono in un solo ridisegno
+  if (!_routesTimer) _routesTimer = setTimeout(() => { _routesTimer = null; loadTopology(); }, 2000);
+}
+
+function scheduleClusters(){
+  if (!_clustersTimer) _clustersTimer = setTimeout(() => { _clustersTimer = null; if (mode === 'clusters') loadClusters(); }, 5000);
+}
+
+function startLive(){
+  const es = new EventSource('/api/events?types=node,traceroute');
+  let lost = false;
+  es.addEventListener('node', e => onNodeEvent(JSON.parse(e.data)));
+  es.addEventListener('traceroute', () => onTracerouteEvent());
+  // dopo una disconnessione (o buffer pieno lato server) ricarica tutto
+  es.addEventListener('overflow', () => { lost = true; });
+  es.onerror = () => { lost = true; };
+  es.onopen = () => { if (lost){ lost = false; mode = null; refresh(); } };
 }
 
 window.addEventListener('DOMContentLoaded', () => {
   init();
-  refresh();
-  setInterval(refresh, 10000);
+  initialView();
+  startLive();
 });
\ No newline at end of file
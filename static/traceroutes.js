@@ -25,7 +25,7 @@ async function loadTraceroutes(){
   const url = new URL('/api/traceroutes', window.location.origin);
   url.searchParams.set('limit', '1000');
   if (MAX_AGE > 0) url.searchParams.set('max_age', MAX_AGE);
-  const res = await fetch(url, {cache:'no-store'});
+  const res = await fetch(url, {cache:'no-cache'});
   const routes = await res.json();
   const groups = new Map();
   for (const r of routes){
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import sys
 import json
@@ -19,11 +20,11 @@ def test_admin_can_view_and_edit_nodes():
     with api.DB_LOCK:
         api.DB.execute('INSERT INTO nodes(node_id, short_name) VALUES(?, ?)', ('n1', 'old'))
         api.DB.commit()
-    res = api.api_nodes()
+    res = asyncio.run(api.api_nodes())
     data = json.loads(res.body)
     assert data[0]['node_id'] == 'n1'
     assert data[0]['short_name'] == 'old'
-    api.api_admin_update_node('n1', {'short_name': 'new'})
+    asyncio.run(api.api_admin_update_node('n1', {'short_name': 'new'}))
     with api.DB_LOCK:
         cur = api.DB.execute('SELECT short_name FROM nodes WHERE node_id=?', ('n1',))
         assert cur.fetchone()[0] == 'new'
@@ -34,7 +35,7 @@ def test_admin_can_delete_nodes():
     with api.DB_LOCK:
         api.DB.execute('INSERT INTO nodes(node_id, short_name) VALUES(?, ?)', ('n1', 'old'))
         api.DB.commit()
-    api.api_admin_delete_node('n1')
+    asyncio.run(api.api_admin_delete_node('n1'))
     with api.DB_LOCK:
         cur = api.DB.execute('SELECT COUNT(*) FROM nodes WHERE node_id=?', ('n1',))
         assert cur.fetchone()[0] == 0
@@ -62,7 +63,7 @@ def test_admin_can_prune_empty_nodes():
         return ''
 
     assert first_match('/api/admin/nodes/empty') == '/api/admin/nodes/empty'
-    res = api.api_admin_delete_empty_nodes()
+    res = asyncio.run(api.api_admin_delete_empty_nodes())
     data = json.loads(res.body)
     assert data['deleted'] == 5
     with api.DB_LOCK:
@@ -87,7 +88,7 @@ def test_api_nodes_excludes_inactive():
         api.DB.execute('INSERT INTO nodes(node_id, short_name) VALUES(?, ?)', ('n1', 'ghost'))
         api.DB.execute('INSERT INTO nodes(node_id, short_name, last_seen) VALUES(?, ?, ?)', ('n2', 'seen', 123))
         api.DB.commit()
-    res = api.api_nodes(include_inactive=False)
+    res = asyncio.run(api.api_nodes(include_inactive=False))
     data = json.loads(res.body)
     ids = [d['node_id'] for d in data]
     assert ids == ['n2']
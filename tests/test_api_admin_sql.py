@@ -1,3 +1,4 @@
+import asyncio
 import os
 import sys
 import json
@@ -6,6 +7,8 @@ os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.y
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import api  # noqa: E402
+import config  # noqa: E402
+import database  # noqa: E402
 
 
 def reset_nodes():
@@ -14,13 +17,89 @@ def reset_nodes():
         api.DB.commit()
 
 
+def run_sql(payload):
+    """Esegue la query e restituisce ``(status, documento JSON)`` anche in streaming."""
+
+    async def go():
+        res = await api.api_admin_sql(payload)
+        if hasattr(res, 'body_iterator'):
+            return res.status_code, b''.join([c async for c in res.body_iterator])
+        return res.status_code, res.body
+
+    status, body = asyncio.run(go())
+    return status, json.loads(body)
+
+
 def test_admin_sql_can_modify_db():
     reset_nodes()
-    api.api_admin_sql({
+    status, data = run_sql({
         'query': 'INSERT INTO nodes(node_id, short_name) VALUES(?, ?)',
         'params': ['n1', 'short']
     })
-    res = api.api_admin_sql({'query': 'SELECT node_id, short_name FROM nodes'})
-    data = json.loads(res.body)
+    assert status == 200 and data['changes'] == 1
+    status, data = run_sql({'query': 'SELECT node_id, short_name FROM nodes'})
     assert data['rows'][0]['node_id'] == 'n1'
     assert data['rows'][0]['short_name'] == 'short'
+    assert data['columns'] == ['node_id', 'short_name']
+
+
+def test_reads_are_capped_read_only_and_time_limited(tmp_path, monkeypatch):
+    storage = database.Storage(str(tmp_path / 'sql.db'))
+    monkeypatch.setattr(api.app.state, 'storage', storage, raising=False)
+    monkeypatch.setattr(api.sqlconsole, 'FETCH_ROWS', 7)
+    for i in range(30):
+        storage.upsert_node(f'n{i:02d}', f'S{i}', None, 1000 + i)
+
+    status, data = run_sql({'query': '-- tutti\nSELECT node_id FROM nodes ORDER BY node_id', 'max_rows': 20})
+    assert status == 200
+    assert [r['node_id'] for r in data['rows']] == [f'n{i:02d}' for i in range(20)]
+    assert data['row_count'] == 20 and data['truncated'] is True and 'error' not in data
+    # il payload non può superare il limite di config
+    monkeypatch.setitem(config.ADMIN_SQL, 'max_rows', 5)
+    assert run_sql({'query': 'SELECT node_id FROM nodes', 'max_rows': 1000})[1]['row_count'] == 5
+
+    # una "lettura" che scrive è rifiutata dalla connessione in sola lettura
+    status, data = run_sql({'query': 'WITH x AS (SELECT 1) DELETE FROM nodes'})
+    assert status == 400 and 'readonly' in data['error'].replace('-', '')
+    assert storage.conn.execute('SELECT COUNT(*) FROM nodes').fetchone()[0] == 30
+
+    slow = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT MAX(x) FROM c'
+    status, data = run_sql({'query': slow, 'timeout_s': 0.2})
+    assert status == 400 and 'time budget' in data['error']
+    # il lock dell'ingest resta libero e la connessione condivisa non ha handler residui
+    assert storage.lock.acquire(timeout=0)
+    storage.lock.release()
+
+    status, data = run_sql({'query': 'SELECT * FROM nodes WHERE node_id = ?', 'params': ['n01'], 'explain': True})
+    assert status == 200
+    assert 'nodes' in data['text'] and data['plan'][0]['detail'].startswith('SEARCH')
+    storage.close()
+
+
+def test_shared_memory_db_is_read_only_during_reads():
+    reset_nodes()
+    status, data = run_sql({'query': 'WITH x AS (SELECT 1) INSERT INTO nodes(node_id) SELECT 1 FROM x'})
+    assert status == 400
+    assert run_sql({'query': 'SELECT COUNT(*) AS n FROM nodes'})[1]['rows'] == [{'n': 0}]
+    # dopo la lettura le scritture tornano possibili
+    assert run_sql({'query': "INSERT INTO nodes(node_id) VALUES('n9')"})[0] == 200
+
+
+def test_writes_rebuild_estimates_and_graph_only_when_needed(monkeypatch):
+    reset_nodes()
+    calls = []
+    storage = api._storage()
+    monkeypatch.setattr(api.estimator, 'rebuild', lambda db: calls.append('estimates'))
+    monkeypatch.setattr(storage.topology, 'load', lambda db: calls.append('graph'))
+
+    run_sql({'query': "INSERT INTO nodes(node_id) VALUES('n1')"})
+    assert calls == ['estimates']
+    calls.clear()
+    run_sql({'query': "UPDATE nodes SET nickname = 'casa' WHERE node_id = 'n1'"})
+    assert calls == []
+    run_sql({'query': "UPDATE nodes SET lat = 45.0, lon = 9.0 WHERE node_id = 'n1'"})
+    assert calls == ['estimates']
+    calls.clear()
+    run_sql({'query': 'DELETE FROM topology_edges'})
+    assert calls == ['graph']
+    reset_nodes()
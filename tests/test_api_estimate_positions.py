@@ -1,6 +1,8 @@
+import asyncio
 import os
 import sys
 import json
+import time
 import pytest
 
 # Configure test environment
@@ -8,34 +10,43 @@ os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.y
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import api  # noqa: E402
+import processing  # noqa: E402
 
 
 def reset_db():
     with api.DB_LOCK:
         api.DB.execute('DELETE FROM nodes')
         api.DB.execute('DELETE FROM traceroutes')
+        api.DB.execute('DELETE FROM node_links')
         api.DB.commit()
 
 
+def traceroute(src, dest, route, ts=None):
+    processing._store_traceroute(
+        api._storage(), src, ts or int(time.time()), {'from': src, 'to': dest, 'route': route}
+    )
+
+
 def test_estimate_position_single_neighbour():
     reset_db()
     with api.DB_LOCK:
         api.DB.execute('INSERT INTO nodes(node_id, lat, lon) VALUES(?,?,?)', ('n1', 10.0, 20.0))
         api.DB.execute('INSERT INTO nodes(node_id) VALUES(?)', ('n2',))
-        api.DB.execute(
-            'INSERT INTO traceroutes(ts, src_id, dest_id, route, hop_count) VALUES(?,?,?,?,?)',
-            (0, 'n1', 'n2', json.dumps([]), 1),
-        )
         api.DB.commit()
-    res = api.api_nodes()
+    traceroute('n1', 'n2', ['n1', 'n2'])
+    res = asyncio.run(api.api_nodes())
     data = json.loads(res.body)
     n2 = next(n for n in data if n['node_id'] == 'n2')
     assert n2['lat'] == pytest.approx(10.001)
     assert n2['lon'] == pytest.approx(20.001)
+    assert n2['estimated'] is True
+    assert next(n for n in data if n['node_id'] == 'n1')['estimated'] is False
+    # la stima non sovrascrive le coordinate reali
     with api.DB_LOCK:
-        row = api.DB.execute('SELECT lat, lon FROM nodes WHERE node_id=?', ('n2',)).fetchone()
-    assert row[0] == pytest.approx(10.001)
-    assert row[1] == pytest.approx(20.001)
+        row = api.DB.execute('SELECT lat, lon, est_lat, est_lon FROM nodes WHERE node_id=?', ('n2',)).fetchone()
+    assert row[0] is None and row[1] is None
+    assert row[2] == pytest.approx(10.001)
+    assert row[3] == pytest.approx(20.001)
 
 
 def test_estimate_position_multiple_neighbours():
@@ -44,17 +55,63 @@ def test_estimate_position_multiple_neighbours():
         api.DB.execute('INSERT INTO nodes(node_id, lat, lon) VALUES(?,?,?)', ('n1', 10.0, 20.0))
         api.DB.execute('INSERT INTO nodes(node_id, lat, lon) VALUES(?,?,?)', ('n3', 20.0, 30.0))
         api.DB.execute('INSERT INTO nodes(node_id) VALUES(?)', ('n4',))
-        api.DB.execute(
-            'INSERT INTO traceroutes(ts, src_id, dest_id, route, hop_count) VALUES(?,?,?,?,?)',
-            (0, 'n1', 'n3', json.dumps(['n4']), 2),
-        )
         api.DB.commit()
-    res = api.api_nodes()
+    traceroute('n1', 'n3', ['n1', 'n4', 'n3'])
+    res = asyncio.run(api.api_nodes())
     data = json.loads(res.body)
     n4 = next(n for n in data if n['node_id'] == 'n4')
     assert n4['lat'] == pytest.approx(15.0)
     assert n4['lon'] == pytest.approx(25.0)
     with api.DB_LOCK:
-        row = api.DB.execute('SELECT lat, lon FROM nodes WHERE node_id=?', ('n4',)).fetchone()
-    assert row[0] == pytest.approx(15.0)
-    assert row[1] == pytest.approx(25.0)
+        row = api.DB.execute('SELECT lat, lon, est_lat, est_lon FROM nodes WHERE node_id=?', ('n4',)).fetchone()
+    assert row[0] is None
+    assert row[2] == pytest.approx(15.0)
+    assert row[3] == pytest.approx(25.0)
+
+
+def test_nodes_endpoint_does_not_write():
+    reset_db()
+    with api.DB_LOCK:
+        api.DB.execute('INSERT INTO nodes(node_id, lat, lon) VALUES(?,?,?)', ('n1', 10.0, 20.0))
+        api.DB.execute('INSERT INTO nodes(node_id) VALUES(?)', ('n2',))
+        api.DB.commit()
+    traceroute('n1', 'n2', ['n1', 'n2'])
+    before = api.DB.total_changes
+    asyncio.run(api.api_nodes())
+    asyncio.run(api.api_nodes(bbox='19,9,21,11'))
+    assert api.DB.total_changes == before
+
+
+def test_estimate_follows_ingest():
+    reset_db()
+    storage = api._storage()
+    now = int(time.time())
+    with api.DB_LOCK:
+        api.DB.execute('INSERT INTO nodes(node_id, lat, lon) VALUES(?,?,?)', ('n1', 10.0, 20.0))
+        api.DB.execute('INSERT INTO nodes(node_id) VALUES(?)', ('n5',))
+        api.DB.commit()
+    # n6 compare nei traceroute prima di essere un nodo noto
+    traceroute('n1', 'n6', ['n1', 'n5', 'n6'], ts=now - 10)
+    storage.upsert_node('n6', None, None, now)
+    with api.DB_LOCK:
+        row = api.DB.execute('SELECT est_lat FROM nodes WHERE node_id=?', ('n6',)).fetchone()
+    assert row[0] is None  # nessun vicino con posizione: n5 è solo stimato
+
+    # n6 riceve una posizione reale: n5 passa al baricentro dei due vicini
+    storage.upsert_node('n6', None, None, now, lat=12.0, lon=22.0, pos_ts=now)
+    n5 = next(n for n in json.loads(asyncio.run(api.api_nodes()).body) if n['node_id'] == 'n5')
+    assert n5['lat'] == pytest.approx(11.0)
+    assert n5['lon'] == pytest.approx(21.0)
+
+    # un percorso più recente tra la stessa coppia sostituisce il precedente
+    traceroute('n1', 'n6', ['n1', 'n6'], ts=now)
+    with api.DB_LOCK:
+        row = api.DB.execute('SELECT est_lat FROM nodes WHERE node_id=?', ('n5',)).fetchone()
+        links = api.DB.execute("SELECT COUNT(*) FROM node_links WHERE a='n5'").fetchone()[0]
+    assert row[0] is None
+    assert links == 0
+
+    # nodo con bbox: la stima entra nell'R*Tree
+    traceroute('n1', 'n5', ['n1', 'n5'], ts=now)
+    ids = [n['node_id'] for n in json.loads(asyncio.run(api.api_nodes(bbox='19,9,21,11')).body)]
+    assert 'n5' in ids
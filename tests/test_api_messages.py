@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+import json
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import database  # noqa: E402
+import processing  # noqa: E402
+
+
+def call(**kw):
+    params = dict(nodes=None, portnum=None, since=None, until=None, q=None, cursor=None, limit=100, raw=0)
+    params.update(kw)
+    res = asyncio.run(api.api_messages(**params))
+    return res.status_code, json.loads(res.body)
+
+
+def seed():
+    storage = api._storage()
+    with storage.lock:
+        storage.conn.execute('DELETE FROM messages')
+        storage.conn.execute('DELETE FROM nodes')
+        storage.conn.commit()
+    texts = ['ciao a tutti', 'meteo: pioggia', None, 'ripetitore in cima', 'pioggia forte', None]
+    for i, text in enumerate(texts):
+        node = 'n1' if i % 2 == 0 else 'n2'
+        if text is None:
+            data = {'from': node, 'decoded': {'portnum': 'TELEMETRY_APP', 'payload': {'temperature': i}}}
+            portnum = 'TELEMETRY_APP'
+        else:
+            data = {'from': node, 'decoded': {'portnum': 'TEXT_MESSAGE_APP', 'payload': {'text': text}}}
+            portnum = 'TEXT_MESSAGE_APP'
+        processing._store_message(storage, node, 100 + i // 2, data, portnum)
+
+
+def test_filters_and_keyset_pagination():
+    seed()
+    status, page = call(limit=4)
+    assert status == 200
+    assert [m['ts'] for m in page['messages']] == [102, 102, 101, 101]
+    assert page['next_cursor']
+    status, page2 = call(limit=4, cursor=page['next_cursor'])
+    assert [m['ts'] for m in page2['messages']] == [100, 100]
+    assert page2['next_cursor'] is None
+    seen = {m['id'] for m in page['messages']} | {m['id'] for m in page2['messages']}
+    assert len(seen) == 6
+
+    _, data = call(nodes='n1', portnum='TEXT_MESSAGE_APP')
+    assert [m['text'] for m in data['messages']] == ['pioggia forte', 'ciao a tutti']
+    _, data = call(since=101, until=102, raw=1)
+    assert {m['ts'] for m in data['messages']} == {101}
+    assert all('data' in m for m in data['messages'])
+
+    assert call(cursor='bad')[0] == 400
+
+
+def test_full_text_search():
+    seed()
+    _, data = call(q='pioggia')
+    assert [m['text'] for m in data['messages']] == ['pioggia forte', 'meteo: pioggia']
+    _, data = call(q='ripet*')
+    assert [m['text'] for m in data['messages']] == ['ripetitore in cima']
+    _, data = call(q='"pioggia" forte', nodes='n1')
+    assert [m['text'] for m in data['messages']] == ['pioggia forte']
+
+
+def test_pagination_uses_index():
+    storage = database.Storage(':memory:')
+    plan = storage.conn.execute(
+        'EXPLAIN QUERY PLAN SELECT id FROM messages m WHERE m.node_id = ? AND (m.ts, m.id) < (?, ?) '
+        'ORDER BY m.ts DESC, m.id DESC LIMIT 10',
+        ('n1', 100, 5),
+    ).fetchall()
+    detail = ' '.join(r[-1] for r in plan)
+    assert 'idx_messages_node_ts' in detail
+    assert 'TEMP B-TREE' not in detail
+
+
+def test_text_backfill_for_existing_rows(tmp_path):
+    path = str(tmp_path / 'm.db')
+    storage = database.Storage(path)
+    with storage.lock:
+        storage.conn.execute(
+            'INSERT INTO messages(ts, node_id, portnum, raw_json) VALUES(?,?,?,?)',
+            (1, 'n1', 'TEXT_MESSAGE_APP', json.dumps({'payload': {'text': 'vecchio messaggio'}})),
+        )
+        storage.conn.execute('UPDATE messages SET text = NULL')
+        storage.conn.execute('PRAGMA user_version = 4')
+        storage.conn.execute("DELETE FROM schema_backfills")
+        storage.conn.commit()
+    storage.close()
+    storage = database.Storage(path)
+    assert [p[0] for p in storage.pending_backfills()] == ['messages_text']
+    storage.run_backfills()
+    hits = storage.conn.execute(
+        "SELECT m.text FROM messages m JOIN messages_fts f ON f.rowid = m.id WHERE messages_fts MATCH 'vecchio'"
+    ).fetchall()
+    assert hits == [('vecchio messaggio',)]
+    storage.close()
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import sys
 import json
@@ -28,7 +29,7 @@ def test_api_traceroutes_deduplication():
             ],
         )
         api.DB.commit()
-    res = api.api_traceroutes(limit=10, max_age=0)
+    res = asyncio.run(api.api_traceroutes(limit=10, max_age=0))
     data = json.loads(res.body)
     assert len(data) == 2
     entry = next(r for r in data if r['dest_id'] == 'b')
@@ -52,7 +53,7 @@ def test_api_traceroutes_limit_after_dedup():
         )
         api.DB.commit()
 
-    res = api.api_traceroutes(limit=2, max_age=0)
+    res = asyncio.run(api.api_traceroutes(limit=2, max_age=0))
 
     data = json.loads(res.body)
     assert len(data) == 2
@@ -72,7 +73,7 @@ def test_api_traceroutes_via_radio():
             (1, 'a', 'b', json.dumps(['x', 'y']), 2, json.dumps({'snr': 1})),
         )
         api.DB.commit()
-    res = api.api_traceroutes(limit=10, max_age=0)
+    res = asyncio.run(api.api_traceroutes(limit=10, max_age=0))
     data = json.loads(res.body)
     assert len(data) == 1
     entry = data[0]
@@ -93,7 +94,7 @@ def test_api_traceroutes_max_age():
             ],
         )
         api.DB.commit()
-    res = api.api_traceroutes(limit=10, max_age=50)
+    res = asyncio.run(api.api_traceroutes(limit=10, max_age=50))
     data = json.loads(res.body)
     assert {r['dest_id'] for r in data} == {'c'}
     assert all(r['via'] == 'mqtt' for r in data)
@@ -109,7 +110,7 @@ def test_api_traceroutes_delete():
             (1, 'a', 'b', json.dumps(['x']), 2),
         )
         api.DB.commit()
-    api.api_delete_traceroutes()
+    asyncio.run(api.api_delete_traceroutes())
     with api.DB_LOCK:
         cnt = api.DB.execute('SELECT COUNT(*) FROM traceroutes').fetchone()[0]
     assert cnt == 0
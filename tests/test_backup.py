@@ -0,0 +1,60 @@
+import asyncio
+import os
+import sys
+import gzip
+import json
+import sqlite3
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import backup  # noqa: E402
+import config  # noqa: E402
+import database  # noqa: E402
+
+
+def test_backup_copies_db_in_steps(tmp_path):
+    storage = database.Storage(str(tmp_path / 'src.db'))
+    storage.conn.executemany(
+        'INSERT INTO telemetry(ts, node_id, metric, value) VALUES(?,?,?,?)',
+        [(i, 'n1', 'temperature', float(i)) for i in range(2000)],
+    )
+    storage.conn.commit()
+    res = backup.backup(storage, str(tmp_path / 'bk'), pages=4, sleep=0)
+    assert res['steps'] > 1
+    assert res['pages'] > 4
+    copy = sqlite3.connect(res['path'])
+    assert copy.execute('SELECT COUNT(*) FROM telemetry').fetchone()[0] == 2000
+    copy.close()
+    storage.close()
+
+
+def test_backup_compress_and_rotate(tmp_path):
+    dest = tmp_path / 'bk'
+    dest.mkdir()
+    for stamp in ('20200101-000000', '20200102-000000', '20200103-000000'):
+        (dest / f'telemetry-{stamp}.db').write_bytes(b'old')
+    (dest / 'other.txt').write_text('keep me')
+    storage = database.Storage(':memory:')
+    res = backup.backup(storage, str(dest), compress=True, keep=2)
+    assert res['path'].endswith('.db.gz')
+    with gzip.open(res['path']) as f:
+        assert f.read(16) == b'SQLite format 3\x00'
+    assert sorted(res['rotated']) == ['telemetry-20200101-000000.db', 'telemetry-20200102-000000.db']
+    assert sorted(os.listdir(dest)) == [
+        'other.txt',
+        'telemetry-20200103-000000.db',
+        os.path.basename(res['path']),
+    ]
+
+
+def test_admin_backup_endpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'BACKUP_DIR', str(tmp_path))
+    res = asyncio.run(api.api_admin_backup({'keep': 0}))
+    data = json.loads(res.body)
+    assert data['file'].startswith('telemetry-')
+    assert data['pages'] > 0
+    assert 'seconds' in data
+    listing = json.loads(asyncio.run(api.api_admin_backups()).body)
+    assert [b['file'] for b in listing] == [data['file']]
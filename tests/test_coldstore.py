@@ -0,0 +1,186 @@
+import asyncio
+import os
+import sys
+import json
+import time
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import coldstore  # noqa: E402
+import database  # noqa: E402
+import tsblock  # noqa: E402
+
+DAY = coldstore.DAY
+
+
+def reset_db():
+    with api.DB_LOCK:
+        api.DB.execute('DELETE FROM telemetry')
+        api.DB.execute('DELETE FROM nodes')
+        api.DB.execute('DELETE FROM cold_segments')
+        api.DB.commit()
+
+
+def test_segment_roundtrip_and_slice(tmp_path):
+    path = str(tmp_path / 'a.seg')
+    coldstore.write_segment(path, [10, 20, 30, 40], [1.0, 2.0, 3.0, 4.0])
+    with coldstore.Segment(path) as seg:
+        assert len(seg) == 4
+        ts, vals = seg.slice(20, 40)
+        assert list(ts) == [20, 30]
+        assert list(vals) == [2.0, 3.0]
+        ts.release()
+        vals.release()
+
+
+def test_seal_moves_old_days_and_metrics_merges_tiers(tmp_path, monkeypatch):
+    reset_db()
+    storage = api._storage()
+    monkeypatch.setattr(storage, 'cold_path', str(tmp_path))
+    now = int(time.time())
+    today = now - now % DAY
+    old = [(today - 2 * DAY + 60 * i, 'n1', 'temperature', 10.0 + i) for i in range(5)]
+    old += [(today - DAY + 60, 'n1', 'temperature', 20.0)]
+    hot = [(now - 10, 'n1', 'temperature', 30.0)]
+    with api.DB_LOCK:
+        api.DB.execute('INSERT INTO nodes(node_id, long_name) VALUES(?, ?)', ('n1', 'Nodo Uno'))
+        api.DB.executemany('INSERT INTO telemetry(ts, node_id, metric, value) VALUES(?,?,?,?)', old + hot)
+        api.DB.commit()
+
+    assert coldstore.seal(storage, today) == 6
+    with api.DB_LOCK:
+        left = api.DB.execute('SELECT ts FROM telemetry').fetchall()
+        segs = api.DB.execute('SELECT start_ts, count FROM cold_segments ORDER BY start_ts').fetchall()
+    assert left == [(now - 10,)]
+    assert segs == [(today - 2 * DAY, 5), (today - DAY, 1)]
+
+    res = asyncio.run(api.api_metrics(nodes=None, since_s=3 * DAY, use_nick=0))
+    series = json.loads(res.body)['series']['temperature']
+    assert len(series) == 1
+    assert series[0]['label'].startswith('Nodo Uno')
+    assert [p['y'] for p in series[0]['data']] == [10.0, 11.0, 12.0, 13.0, 14.0, 20.0, 30.0]
+
+    # la finestra esclude i segmenti troppo vecchi
+    res = asyncio.run(api.api_metrics(nodes='n1', since_s=DAY, use_nick=0))
+    data = json.loads(res.body)['series']['temperature'][0]['data']
+    assert [p['y'] for p in data] == [30.0]
+    reset_db()
+
+
+def test_seal_waits_for_pending_backfills(tmp_path):
+    storage = database.Storage(':memory:')
+    storage.cold_path = str(tmp_path)
+    storage.conn.execute("INSERT INTO telemetry(ts, node_id, metric, value) VALUES(60, 'n1', 'temperature', 1.0)")
+    storage.conn.execute(
+        "INSERT INTO schema_backfills(name, table_name, last_id, max_id) VALUES('prova', 'telemetry', 0, 1)"
+    )
+    storage.conn.commit()
+    assert coldstore.seal(storage, 2 * DAY) == 0
+    assert storage.conn.execute('SELECT COUNT(*) FROM telemetry').fetchone()[0] == 1
+
+    storage.conn.execute("UPDATE schema_backfills SET last_id = max_id")
+    assert coldstore.seal(storage, 2 * DAY) == 1
+    assert os.listdir(str(tmp_path))
+    storage.close()
+
+
+def test_seal_keeps_rows_written_during_segment_write(tmp_path, monkeypatch):
+    storage = database.Storage(':memory:')
+    storage.cold_path = str(tmp_path)
+    storage.conn.execute("INSERT INTO telemetry(ts, node_id, metric, value) VALUES(60, 'n1', 'temperature', 1.0)")
+    storage.conn.commit()
+    write_tmp = coldstore._write_tmp
+    calls = []
+
+    def racing_write(path, ts, values):
+        calls.append(list(ts))
+        if len(calls) == 1:
+            # ingest concorrente nello stesso giorno mentre il segmento è su disco
+            storage.conn.execute(
+                "INSERT INTO telemetry(ts, node_id, metric, value) VALUES(120, 'n1', 'temperature', 2.0)"
+            )
+            storage.conn.commit()
+        return write_tmp(path, ts, values)
+
+    monkeypatch.setattr(coldstore, '_write_tmp', racing_write)
+    assert coldstore.seal(storage, 2 * DAY) == 1
+    assert storage.conn.execute('SELECT ts FROM telemetry').fetchall() == [(120,)]
+
+    # la sigillatura successiva unisce la riga rimasta al segmento
+    assert coldstore.seal(storage, 2 * DAY) == 1
+    assert storage.conn.execute('SELECT COUNT(*) FROM telemetry').fetchone()[0] == 0
+    path = storage.conn.execute('SELECT path FROM cold_segments').fetchone()[0]
+    with coldstore.Segment(path) as seg:
+        assert list(seg.ts) == [60, 120]
+    storage.close()
+
+
+def test_seal_retries_day_when_blocks_change(tmp_path, monkeypatch):
+    storage = database.Storage(':memory:')
+    storage.cold_path = str(tmp_path)
+    storage.conn.execute(
+        "INSERT INTO telemetry_blocks(node_id, metric, hour_ts, first_ts, last_ts, count, data) "
+        "VALUES('n1', 'temperature', 0, 60, 60, 1, ?)",
+        (tsblock.encode([60], [1.0]),),
+    )
+    storage.conn.commit()
+    write_tmp = coldstore._write_tmp
+    calls = []
+
+    def racing_write(path, ts, values):
+        calls.append(list(ts))
+        if len(calls) == 1:
+            # una compattazione riscrive il blocco dell'ora con una riga in più
+            storage.conn.execute(
+                "UPDATE telemetry_blocks SET last_ts = 120, count = 2, data = ?",
+                (tsblock.encode([60, 120], [1.0, 2.0]),),
+            )
+            storage.conn.commit()
+        return write_tmp(path, ts, values)
+
+    monkeypatch.setattr(coldstore, '_write_tmp', racing_write)
+    assert coldstore.seal(storage, 2 * DAY) == 2
+    assert calls == [[60], [60, 120]]
+    assert storage.conn.execute('SELECT COUNT(*) FROM telemetry_blocks').fetchone()[0] == 0
+    path = storage.conn.execute('SELECT path FROM cold_segments').fetchone()[0]
+    with coldstore.Segment(path) as seg:
+        assert list(seg.ts) == [60, 120]
+    storage.close()
+
+
+
+class _DeletingConnection:
+    """Cancella ``delete`` subito prima della prima lettura di un giorno da sigillare."""
+
+    def __init__(self, conn, delete):
+        self.conn = conn
+        self.delete = delete
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def execute(self, sql, *args):
+        if self.delete and 'SELECT ts, value, node_name, id FROM telemetry' in sql:
+            self.conn.execute(self.delete)
+            self.delete = None
+        return self.conn.execute(sql, *args)
+
+
+def test_seal_skips_days_emptied_meanwhile(tmp_path, monkeypatch):
+    storage = database.Storage(':memory:')
+    storage.cold_path = str(tmp_path)
+    storage.conn.executemany(
+        "INSERT INTO telemetry(ts, node_id, metric, value) VALUES(?, 'n1', 'temperature', 1.0)",
+        [(60,), (DAY + 60,)],
+    )
+    storage.conn.commit()
+    # il primo giorno sparisce dopo l'elenco delle coppie (es. nodo cancellato)
+    real = storage.conn
+    monkeypatch.setattr(storage, 'conn', _DeletingConnection(real, f'DELETE FROM telemetry WHERE ts < {DAY}'))
+    assert coldstore.seal(storage, 3 * DAY) == 1
+    assert real.execute('SELECT start_ts, count FROM cold_segments').fetchall() == [(DAY, 1)]
+    assert os.listdir(str(tmp_path / 'n1' / 'temperature')) == [f'{DAY}.seg']
+    monkeypatch.undo()
+    storage.close()
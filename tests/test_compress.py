@@ -0,0 +1,108 @@
+import asyncio
+import gzip
+import os
+import sys
+import zlib
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import compress  # noqa: E402
+import config  # noqa: E402
+import webassets  # noqa: E402
+
+
+class FakeRequest:
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+
+
+def make_app(chunks, content_type=b'application/json'):
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', content_type),
+                                (b'content-length', str(sum(map(len, chunks))).encode())]})
+        for i, chunk in enumerate(chunks):
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': i < len(chunks) - 1})
+    return app
+
+
+def call(app, accept='gzip', **opts):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {'type': 'http.request'}
+
+    headers = [(b'accept-encoding', accept.encode())] if accept else []
+    mw = compress.CompressionMiddleware(app, **opts)
+    asyncio.run(mw({'type': 'http', 'method': 'GET', 'headers': headers}, receive, send))
+    start = dict(sent[0]['headers'])
+    return start, [m.get('body', b'') for m in sent[1:]]
+
+
+def test_negotiation():
+    assert compress.choose('gzip, deflate, br', ('br', 'gzip')) == 'br'
+    assert compress.choose('gzip;q=1, br;q=0.5', ('br', 'gzip')) == 'gzip'
+    assert compress.choose('br;q=0, *', ('br', 'gzip')) == 'gzip'
+    assert compress.choose('identity', ('br', 'gzip')) is None
+
+
+def test_large_json_is_gzipped_small_is_not():
+    body = b'[' + b','.join(b'{"x":%d,"y":21.5}' % i for i in range(500)) + b']'
+    headers, parts = call(make_app([body]))
+    assert headers[b'content-encoding'] == b'gzip'
+    assert headers[b'vary'] == b'Accept-Encoding'
+    assert int(headers[b'content-length']) == len(parts[0]) < len(body) // 4
+    assert gzip.decompress(parts[0]) == body
+
+    headers, parts = call(make_app([b'{"ok":true}']))
+    assert b'content-encoding' not in headers
+    assert parts == [b'{"ok":true}']
+
+    headers, parts = call(make_app([body]), accept='')
+    assert b'content-encoding' not in headers and headers[b'vary'] == b'Accept-Encoding'
+
+
+def test_streaming_chunks_are_flushed_and_sse_untouched():
+    chunks = [b'ts,value\n'] + [b'%d,1.0\n' % i for i in range(200)]
+    headers, parts = call(make_app(chunks, b'text/csv'), min_size=1)
+    assert headers[b'content-encoding'] == b'gzip' and b'content-length' not in headers
+    # ogni blocco è decodificabile appena arriva
+    d = zlib.decompressobj(31)
+    assert d.decompress(parts[0]) == chunks[0]
+    assert d.decompress(b''.join(parts[1:])) == b''.join(chunks[1:])
+
+    headers, parts = call(make_app([b'data: x\n\n' * 500], b'text/event-stream'))
+    assert b'content-encoding' not in headers
+
+
+def test_hashed_assets_and_pages(tmp_path, monkeypatch):
+    (tmp_path / 'app.js').write_text('console.log("ciao");\n' * 200)
+    (tmp_path / 'index.html').write_text('<script src="/static/app.js"></script><img src="/static/x.png">')
+    manifest = webassets.build(str(tmp_path))
+    hashed = manifest['app.js']['file']
+    assert hashed.startswith('app.') and hashed.endswith('.js')
+
+    store = webassets.AssetStore(str(tmp_path))
+    monkeypatch.setattr(api, '_assets', store)
+    res = asyncio.run(api.ui(FakeRequest()))
+    assert res.headers['cache-control'] == f'public, max-age={config.HTML_MAX_AGE}'
+    assert f'/assets/{hashed}'.encode() in res.body and b'/static/x.png' in res.body
+    again = asyncio.run(api.ui(FakeRequest({'if-none-match': res.headers['etag']})))
+    assert again.status_code == 304
+
+    res = asyncio.run(api.asset(hashed, FakeRequest({'accept-encoding': 'gzip'})))
+    assert res.headers['content-encoding'] == 'gzip'
+    assert 'immutable' in res.headers['cache-control']
+    with open(res.path, 'rb') as f:
+        assert gzip.decompress(f.read()) == (tmp_path / 'app.js').read_bytes()
+    assert asyncio.run(api.asset('app.js', FakeRequest())).status_code == 404
+
+    # sorgente modificato dopo la build: si torna a /static
+    (tmp_path / 'app.js').write_text('changed')
+    store.load()
+    assert store.rewrite('/static/app.js') == '/static/app.js'
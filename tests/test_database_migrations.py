@@ -0,0 +1,109 @@
+import os
+import sys
+import sqlite3
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database  # noqa: E402
+
+
+def make_legacy_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        'CREATE TABLE telemetry (id INTEGER PRIMARY KEY AUTOINCREMENT, ts_ms INTEGER, node TEXT, '
+        'metric TEXT NOT NULL, value REAL NOT NULL)'
+    )
+    conn.execute('CREATE TABLE nodes (node_id TEXT PRIMARY KEY, short_name TEXT, last_seen INTEGER)')
+    conn.executemany(
+        'INSERT INTO telemetry(ts_ms, node, metric, value) VALUES(?,?,?,?)',
+        [(i * 1000, 'n1', 'relative_humidity' if i % 2 else 'temperature', i) for i in range(25)],
+    )
+    conn.execute('INSERT INTO nodes(node_id, short_name) VALUES(?, ?)', ('n1', 'one'))
+    conn.commit()
+    return conn
+
+
+def test_fresh_db_is_at_latest_version():
+    storage = database.Storage(':memory:')
+    version = storage.conn.execute('PRAGMA user_version').fetchone()[0]
+    assert version == database.SCHEMA_VERSION
+    assert storage.pending_backfills() == []
+
+
+def test_legacy_db_migrates_once_and_backfills_in_chunks(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    make_legacy_db(path).close()
+    storage = database.Storage(path)
+    conn = storage.conn
+
+    # lo schema è aggiornato subito, i dati storici no
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == database.SCHEMA_VERSION
+    assert conn.execute('SELECT last_seen, info_packets FROM nodes').fetchone() == (0, 0)
+    assert conn.execute('SELECT COUNT(*) FROM telemetry WHERE ts IS NULL').fetchone()[0] == 25
+    assert {p[0] for p in storage.pending_backfills()} == {
+        'telemetry_ts_from_ts_ms',
+        'telemetry_node_id_from_node',
+        'telemetry_metric_names',
+        'telemetry_latest_metric',
+        'telemetry_metric_rollup',
+    }
+
+    # una seconda migrazione non fa nulla
+    storage.migrate()
+    assert len(storage.pending_backfills()) == 5
+
+    assert storage.run_backfills(chunk=10) == 15
+    assert storage.pending_backfills() == []
+    rows = conn.execute('SELECT ts, node_id, metric FROM telemetry ORDER BY id').fetchall()
+    assert rows[0] == (0, 'n1', 'temperature')
+    assert rows[1] == (1, 'n1', 'humidity')
+    assert conn.execute('SELECT COUNT(*) FROM telemetry WHERE ts IS NULL').fetchone()[0] == 0
+    # aggregati calcolati dopo le correzioni di ts e nomi delle metriche
+    assert conn.execute('SELECT * FROM latest_metric ORDER BY metric').fetchall() == [
+        ('n1', 'humidity', 23, 23.0),
+        ('n1', 'temperature', 24, 24.0),
+    ]
+    assert conn.execute(
+        "SELECT count, sum, min, max FROM metric_rollup WHERE metric = 'temperature'"
+    ).fetchall() == [(13, 156.0, 0.0, 24.0)]
+
+
+def test_backfill_resumes_from_saved_progress(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    make_legacy_db(path).close()
+    database.Storage(path).close()
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE schema_backfills SET last_id = 20 WHERE name = 'telemetry_ts_from_ts_ms'")
+    conn.commit()
+    conn.close()
+
+    storage = database.Storage(path)
+    storage.run_backfills(chunk=100)
+    conn = storage.conn
+    nulls = conn.execute('SELECT id FROM telemetry WHERE ts IS NULL ORDER BY id').fetchall()
+    assert [r[0] for r in nulls] == list(range(1, 21))
+
+
+def test_migration_6_moves_old_estimates_out_of_lat(tmp_path):
+    path = str(tmp_path / 'v5.db')
+    database.Storage(path).close()
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO nodes(node_id, lat, lon, pos_ts) VALUES('a', 10.0, 20.0, 100)")
+    conn.execute("INSERT INTO positions(node_id, ts, lat, lon) VALUES('a', 100, 10.0, 20.0)")
+    # stima scritta dalle versioni precedenti direttamente in lat/lon
+    conn.execute("INSERT INTO nodes(node_id, lat, lon, pos_ts) VALUES('b', 10.001, 20.001, 0)")
+    conn.execute(
+        "INSERT INTO traceroutes(ts, src_id, dest_id, route, hop_count) VALUES(1, 'a', 'b', '[\"a\", \"b\"]', 1)"
+    )
+    conn.execute('PRAGMA user_version = 5')
+    conn.commit()
+    conn.close()
+
+    storage = database.Storage(path)
+    row = storage.conn.execute("SELECT lat, pos_ts, est_lat, est_lon FROM nodes WHERE node_id='b'").fetchone()
+    assert row[0] is None and row[1] is None
+    assert abs(row[2] - 10.001) < 1e-9 and abs(row[3] - 20.001) < 1e-9
+    links = storage.conn.execute('SELECT a, b, routes FROM node_links ORDER BY a').fetchall()
+    assert links == [('a', 'b', 1), ('b', 'a', 1)]
+    storage.close()
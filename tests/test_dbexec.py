@@ -0,0 +1,131 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import dbexec  # noqa: E402
+
+
+def test_heavy_queries_do_not_block_light_ones():
+    ex = dbexec.DBExecutor({'light': (2, 1.0), 'heavy': (1, 0.2)})
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return 'slow'
+
+    async def run():
+        heavy = asyncio.ensure_future(ex.run('heavy', slow))
+        await asyncio.sleep(0.05)
+        # il secondo heavy resta in coda oltre il timeout
+        try:
+            await ex.run('heavy', slow)
+        except dbexec.Overloaded as e:
+            rejected = e
+        else:
+            rejected = None
+        # le light hanno i loro thread anche con heavy saturo
+        started = time.monotonic()
+        light = await ex.run('light', lambda: 'light')
+        elapsed = time.monotonic() - started
+        stats = ex.stats()
+        release.set()
+        return await heavy, rejected, light, elapsed, stats
+
+    heavy, rejected, light, elapsed, stats = asyncio.run(run())
+    ex.shutdown()
+    assert heavy == 'slow' and light == 'light'
+    assert isinstance(rejected, dbexec.Overloaded)
+    assert elapsed < 0.5
+    assert stats['heavy']['rejected'] == 1
+    assert stats['heavy']['running'] == 1
+
+
+def test_parse_limits():
+    limits = dbexec.parse_limits({'heavy': {'workers': 4}, 'export': {'queue_timeout': 60}})
+    assert limits['heavy'] == (4, dbexec.DEFAULT_LIMITS['heavy'][1])
+    assert limits['light'] == dbexec.DEFAULT_LIMITS['light']
+    assert limits['export'] == (1, 60.0)
+
+
+def test_routes_are_async_and_overload_returns_503(monkeypatch):
+    assert asyncio.iscoroutinefunction(api.api_metrics)
+    assert asyncio.iscoroutinefunction(api.api_nodes)
+    ex = dbexec.DBExecutor({'light': (1, 0.05), 'heavy': (1, 0.05), 'admin': (1, 0.05)})
+    monkeypatch.setattr(api, '_db', ex)
+    release = threading.Event()
+
+    async def run():
+        blocker = asyncio.ensure_future(ex.run('light', release.wait, 5))
+        await asyncio.sleep(0.02)
+        res = await api.api_nodes()
+        release.set()
+        await blocker
+        return res
+
+    res = asyncio.run(run())
+    ex.shutdown()
+    assert res.status_code == 503
+    assert res.headers['retry-after'] == '1'
+
+
+class FakeRequest:
+    def __init__(self, **headers):
+        self.headers = {k.replace('_', '-').lower(): v for k, v in headers.items()}
+
+
+def test_conditional_get_skips_the_executor_queue(monkeypatch):
+    etag = asyncio.run(api.api_nodes(include_inactive=True, bbox=None)).headers['etag']
+    ex = dbexec.DBExecutor({'light': (1, 0.05), 'heavy': (1, 0.05), 'admin': (1, 0.05)})
+    monkeypatch.setattr(api, '_db', ex)
+    release = threading.Event()
+
+    async def run():
+        blocker = asyncio.ensure_future(ex.run('light', release.wait, 5))
+        await asyncio.sleep(0.02)
+        res = await api.api_nodes(include_inactive=True, bbox=None, request=FakeRequest(if_none_match=etag))
+        other = await api.api_nodes(include_inactive=False, bbox=None, request=FakeRequest(if_none_match=etag))
+        release.set()
+        await blocker
+        return res, other
+
+    res, other = asyncio.run(run())
+    ex.shutdown()
+    assert res.status_code == 304 and res.headers['etag'] == etag
+    assert other.status_code == 503
+    assert ex.stats()['light']['rejected'] == 1
+
+
+def test_stream_gives_up_when_executor_stays_saturated(monkeypatch):
+    ex = dbexec.DBExecutor({'heavy': (1, 0.02)})
+    monkeypatch.setattr(api, '_db', ex)
+    monkeypatch.setattr(api, '_STREAM_RETRIES', 1)
+    release = threading.Event()
+    closed = []
+
+    def chunks():
+        yield b'x'
+
+    async def run():
+        blocker = asyncio.ensure_future(ex.run('heavy', release.wait, 5))
+        await asyncio.sleep(0.02)
+        try:
+            async for _ in api._stream_db('heavy', chunks(), lambda: closed.append(True)):
+                pass
+        except dbexec.Overloaded as e:
+            err = e
+        else:
+            err = None
+        release.set()
+        await blocker
+        return err
+
+    assert isinstance(asyncio.run(run()), dbexec.Overloaded)
+    ex.shutdown()
+    assert closed == [True]
+    assert ex.stats()['heavy']['rejected'] == 2
@@ -0,0 +1,63 @@
+import asyncio
+import os
+import sys
+import json
+import math
+import time
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import downsample  # noqa: E402
+
+
+def wave(n=1000):
+    ts = list(range(0, n * 10, 10))
+    values = [math.sin(i / 40) for i in range(n)]
+    values[500] = 25.0  # picco isolato
+    values[700] = -25.0  # buco isolato
+    return ts, values
+
+
+def test_lttb_keeps_endpoints_and_peaks():
+    ts, values = wave()
+    out_ts, out_vals = downsample.lttb(ts, values, 100)
+    assert len(out_ts) == 100
+    assert out_ts[0] == ts[0] and out_ts[-1] == ts[-1]
+    assert out_ts == sorted(out_ts)
+    assert 25.0 in out_vals and -25.0 in out_vals
+
+
+def test_minmax_keeps_extremes_per_bucket():
+    ts, values = wave()
+    out_ts, out_vals = downsample.minmax(ts, values, 100)
+    assert len(out_ts) <= 100
+    assert out_ts == sorted(out_ts)
+    assert max(out_vals) == 25.0 and min(out_vals) == -25.0
+
+
+def test_short_series_is_unchanged():
+    ts, values = [1, 2, 3], [1.0, 2.0, 3.0]
+    assert downsample.lttb(ts, values, 10) == (ts, values)
+    assert downsample.minmax(ts, values, 10) == (ts, values)
+
+
+def test_metrics_max_points():
+    with api.DB_LOCK:
+        api.DB.execute('DELETE FROM telemetry')
+        api.DB.execute('DELETE FROM telemetry_blocks')
+        now = int(time.time())
+        api.DB.executemany(
+            'INSERT INTO telemetry(ts, node_id, node_name, metric, value) VALUES(?,?,?,?,?)',
+            [(now - 5000 + i, 'd1', 'D', 'temperature', float(i % 37)) for i in range(5000)],
+        )
+        api.DB.commit()
+    res = asyncio.run(api.api_metrics(nodes='d1', since_s=6000, use_nick=0, max_points=200, downsample='minmax'))
+    data = json.loads(res.body)['series']['temperature'][0]['data']
+    assert 100 <= len(data) <= 200
+    assert max(p['y'] for p in data) == 36.0
+    res = asyncio.run(api.api_metrics(nodes='d1', since_s=6000, use_nick=0, max_points=300))
+    assert len(json.loads(res.body)['series']['temperature'][0]['data']) == 300
+    assert asyncio.run(api.api_metrics(nodes='d1', since_s=6000, use_nick=0, max_points=1)).status_code == 400
+    assert asyncio.run(api.api_metrics(nodes='d1', since_s=6000, use_nick=0, downsample='avg')).status_code == 400
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import sys
+import time
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import processing  # noqa: E402
+
+
+class FakeRequest:
+    def __init__(self, **headers):
+        self.headers = {k.replace('_', '-').lower(): v for k, v in headers.items()}
+
+
+def test_nodes_not_modified_until_ingest():
+    storage = api._storage()
+    first = asyncio.run(api.api_nodes(include_inactive=True))
+    etag = first.headers['etag']
+    assert etag.startswith('W/"')
+    assert first.headers['cache-control'] == 'no-cache'
+    assert 'last-modified' in first.headers
+
+    res = asyncio.run(api.api_nodes(include_inactive=True, request=FakeRequest(if_none_match=etag)))
+    assert res.status_code == 304
+    assert res.headers['etag'] == etag
+    # anche la forma forte dello stesso tag vale
+    res = asyncio.run(api.api_nodes(include_inactive=True, request=FakeRequest(if_none_match=etag[2:])))
+    assert res.status_code == 304
+    # parametri diversi, tag diverso
+    other = asyncio.run(api.api_nodes(include_inactive=False, request=FakeRequest(if_none_match=etag)))
+    assert other.status_code == 200
+
+    storage.upsert_node('etag1', 'E1', 'Etag node', int(time.time()))
+    res = asyncio.run(api.api_nodes(include_inactive=True, request=FakeRequest(if_none_match=etag)))
+    assert res.status_code == 200
+    assert res.headers['etag'] != etag
+
+
+def test_if_modified_since():
+    first = asyncio.run(api.api_nodes(include_inactive=True))
+    lm = first.headers['last-modified']
+    res = asyncio.run(api.api_nodes(include_inactive=True, request=FakeRequest(if_modified_since=lm)))
+    assert res.status_code == 304
+    res = asyncio.run(api.api_nodes(
+        include_inactive=True, request=FakeRequest(if_modified_since='Thu, 01 Jan 1970 00:00:00 GMT')
+    ))
+    assert res.status_code == 200
+
+
+def test_metrics_and_traceroutes_follow_their_tables():
+    storage = api._storage()
+    res = asyncio.run(api.api_metrics(nodes='etag1', since_s=3600, use_nick=0))
+    metrics_tag = res.headers['etag']
+    res = asyncio.run(api.api_traceroutes(limit=10, max_age=0))
+    tr_tag = res.headers['etag']
+
+    # un traceroute non invalida le metriche
+    processing._store_traceroute(storage, 'etag1', int(time.time()), {
+        'type': 'traceroute', 'from': 'etag1', 'to': 'etag2', 'route': ['etag1', 'etag3', 'etag2'],
+    })
+    res = asyncio.run(
+        api.api_metrics(nodes='etag1', since_s=3600, use_nick=0, request=FakeRequest(if_none_match=metrics_tag))
+    )
+    assert res.status_code == 304
+    res = asyncio.run(api.api_traceroutes(limit=10, max_age=0, request=FakeRequest(if_none_match=tr_tag)))
+    assert res.status_code == 200
+
+    storage.store_metric(int(time.time()), 'etag1', 'temperature', 21.5)
+    res = asyncio.run(
+        api.api_metrics(nodes='etag1', since_s=3600, use_nick=0, request=FakeRequest(if_none_match=metrics_tag))
+    )
+    assert res.status_code == 200
+    assert res.headers['etag'] != metrics_tag
+
+    tr_tag = asyncio.run(api.api_traceroutes(limit=10, max_age=0)).headers['etag']
+    asyncio.run(api.api_delete_traceroutes())
+    res = asyncio.run(api.api_traceroutes(limit=10, max_age=0, request=FakeRequest(if_none_match=tr_tag)))
+    assert res.status_code == 200
+
+
+def test_validators_computed_once_per_request(monkeypatch):
+    calls = []
+    validators = api._validators
+
+    def counting(*args):
+        calls.append(args)
+        return validators(*args)
+
+    monkeypatch.setattr(api, '_validators', counting)
+    res = asyncio.run(api.api_nodes(include_inactive=True, request=FakeRequest()))
+    assert res.status_code == 200
+    assert len(calls) == 1
+    res = asyncio.run(api.api_nodes(include_inactive=True, request=FakeRequest(if_none_match=res.headers['etag'])))
+    assert res.status_code == 304
+    assert len(calls) == 2
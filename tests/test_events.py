@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import asyncio
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import events  # noqa: E402
+import processing  # noqa: E402
+
+
+class FakeRequest:
+    async def is_disconnected(self):
+        return False
+
+
+def parse(chunk):
+    out = []
+    for block in chunk.strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.split('\n') if not line.startswith(':'))
+        if 'event' in lines:
+            out.append((lines['event'], json.loads(lines['data'])))
+    return out
+
+
+def test_filters_and_overflow():
+    async def run():
+        bus = events.EventBus()
+        loop = asyncio.get_running_loop()
+        temp = bus.subscribe(loop, types=['telemetry'], nodes=['a'], metrics=['temperature'])
+        small = bus.subscribe(loop, maxsize=2)
+        bus.publish('telemetry', node_id='a', metric='temperature', value=1.0)
+        bus.publish('telemetry', node_id='b', metric='temperature', value=2.0)
+        bus.publish('telemetry', node_id='a', metric='humidity', value=3.0)
+        bus.publish('traceroute', node_ids=['a', 'b'], src_id='a', dest_id='b')
+        got = await temp.get(0.1)
+        assert [e['value'] for e in got] == [1.0]
+        # il client lento ha superato il buffer: scartato e rimosso dal bus
+        assert small.dropped
+        assert bus.stats()['subscribers'] == 1
+        assert bus.stats()['dropped'] == 1
+        # nessun evento: ritorna vuoto allo scadere del timeout
+        assert await temp.get(0.01) == []
+
+    asyncio.run(run())
+
+
+def test_sse_stream_receives_ingested_events():
+    async def run():
+        res = await api.api_events(FakeRequest(), types='telemetry,traceroute', nodes='ev1', metrics=None)
+        it = res.body_iterator
+        assert (await it.__anext__()).startswith('retry:')
+        nxt = asyncio.ensure_future(it.__anext__())
+        await asyncio.sleep(0)
+        payload = {
+            'from': 'ev1',
+            'environment_metrics': {'temperature': 21.5},
+            'user': {'id': 'ev1'},
+        }
+        # l'ingest gira nel thread MQTT: pubblica da un altro thread
+        await asyncio.to_thread(processing.process_mqtt_message, 'msh/test', json.dumps(payload).encode())
+        chunk = await asyncio.wait_for(nxt, 2)
+        evs = parse(chunk)
+        assert evs[0][0] == 'telemetry'
+        assert evs[0][1]['node_id'] == 'ev1'
+        assert evs[0][1]['family'] == 'temperature'
+        assert evs[0][1]['value'] == 21.5
+        assert all(e[0] != 'node' for e in evs)
+        await it.aclose()
+        assert events.bus.stats()['subscribers'] == 0
+
+    asyncio.run(run())
+
+
+def test_invalid_types_rejected():
+    res = asyncio.run(api.api_events(FakeRequest(), types='bogus'))
+    assert res.status_code == 400
@@ -0,0 +1,110 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import sys
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import database  # noqa: E402
+import export  # noqa: E402
+import processing  # noqa: E402
+import tsblock  # noqa: E402
+
+HOUR = tsblock.HOUR
+T0 = 1_700_000_000 - 1_700_000_000 % HOUR
+
+
+def body(res):
+    async def collect():
+        return [chunk async for chunk in res.body_iterator]
+
+    return asyncio.run(collect())
+
+
+def seed(storage):
+    storage.upsert_node('n1', 'N1', 'Uno', T0)
+    for i in range(30):
+        storage.store_metric(T0 + i * 300, 'n1', 'temperature', 20.0 + i)
+        storage.store_metric(T0 + i * 300, 'n2', 'voltage', 4.0)
+    # le prime due ore finiscono in blocchi compressi
+    tsblock.compact(storage, T0 + 2 * HOUR)
+    for i in range(3):
+        data = {'from': 'n1', 'decoded': {'portnum': 'TEXT_MESSAGE_APP', 'payload': {'text': f'msg, "{i}"'}}}
+        processing._store_message(storage, 'n1', T0 + i, data, 'TEXT_MESSAGE_APP')
+
+
+def test_telemetry_export_streams_all_tiers(tmp_path, monkeypatch):
+    storage = database.Storage(str(tmp_path / 'export.db'))
+    monkeypatch.setattr(api.app.state, 'storage', storage, raising=False)
+    monkeypatch.setattr(export, 'CHUNK_ROWS', 7)
+    seed(storage)
+    assert storage.conn.execute('SELECT COUNT(*) FROM telemetry_blocks').fetchone()[0] > 0
+
+    res = asyncio.run(api.api_export_telemetry(since=None, until=None, nodes='Uno', metrics=None, format='csv'))
+    assert res.media_type.startswith('text/csv')
+    assert 'attachment; filename="telemetry-' in res.headers['content-disposition']
+    rows = list(csv.reader(io.StringIO(b''.join(body(res)).decode())))
+    assert rows[0] == list(export.TELEMETRY_COLUMNS)
+    assert [int(r[0]) for r in rows[1:]] == [T0 + i * 300 for i in range(30)]
+    assert {r[3] for r in rows[1:]} == {'temperature'}
+
+    res = asyncio.run(api.api_export_telemetry(
+        since=T0 + HOUR, until=T0 + 2 * HOUR + 600, nodes=None, metrics='voltage', format='ndjson'))
+    chunks = body(res)
+    lines = [json.loads(line) for line in b''.join(chunks).splitlines()]
+    assert len(lines) == 14 and len(chunks) == 2
+    assert lines[0] == {'ts': T0 + HOUR, 'node_id': 'n2', 'node_name': None, 'metric': 'voltage', 'value': 4.0}
+
+    # la connessione di export è in sola lettura
+    conn = export.readonly_connection(storage)
+    try:
+        conn.execute('DELETE FROM telemetry')
+    except Exception as e:
+        assert 'readonly' in str(e) or 'read-only' in str(e) or 'query_only' in str(e)
+    else:
+        raise AssertionError('scrittura consentita')
+    finally:
+        conn.close()
+    storage.close()
+
+
+def test_messages_export_and_errors(monkeypatch):
+    storage = database.Storage(':memory:')
+    monkeypatch.setattr(api.app.state, 'storage', storage, raising=False)
+    seed(storage)
+
+    res = asyncio.run(api.api_export_messages(since=None, until=None, nodes=None, portnum=None, raw=0, format='csv'))
+    rows = list(csv.reader(io.StringIO(b''.join(body(res)).decode())))
+    assert rows[0] == list(export.MESSAGE_COLUMNS)
+    assert [r[4] for r in rows[1:]] == ['msg, "0"', 'msg, "1"', 'msg, "2"']
+
+    res = asyncio.run(api.api_export_messages(since=T0 + 1, until=None, nodes='n1', portnum='TEXT_MESSAGE_APP',
+                                              raw=1, format='ndjson'))
+    lines = [json.loads(line) for line in b''.join(body(res)).splitlines()]
+    assert [m['ts'] for m in lines] == [T0 + 1, T0 + 2]
+    assert lines[0]['raw_json']['decoded']['payload']['text'] == 'msg, "1"'
+
+    res = asyncio.run(api.api_export_messages(since=None, until=None, nodes=None, portnum=None, raw=0, format='xml'))
+    assert res.status_code == 400
+    res = asyncio.run(api.api_export_telemetry(since=None, until=None, nodes='nessuno', metrics=None, format='csv'))
+    assert b''.join(body(res)) == b'ts,node_id,node_name,metric,value\n'
+
+
+def test_telemetry_export_holds_compaction(tmp_path):
+    storage = database.Storage(str(tmp_path / 'export.db'))
+    seed(storage)
+    conn = export.readonly_connection(storage)
+    rows = export.telemetry_rows(storage, conn, size=5)
+    first = next(rows)
+    assert first[0] == T0
+    # durante l'export le righe non passano nei blocchi (né nell'archivio)
+    assert tsblock.compact(storage, T0 + 3 * HOUR) == 0
+    assert len(list(rows)) == 59
+    assert storage.tier_holds == 0 and not conn.in_transaction
+    assert tsblock.compact(storage, T0 + 3 * HOUR) > 0
+    conn.close()
+    storage.close()
@@ -0,0 +1,51 @@
+import asyncio
+import json
+import math
+import os
+import sys
+
+import pytest
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import fastjson  # noqa: E402
+import processing  # noqa: E402
+
+SAMPLE = {'b': [1, 2.5, None, True], 'a': {'testo': 'àè€', 'n': -3}, 'big': 2 ** 70}
+
+
+@pytest.fixture(params=['json', 'orjson'])
+def backend(request, monkeypatch):
+    if request.param == 'json':
+        monkeypatch.setattr(fastjson, 'orjson', None)
+    elif fastjson.orjson is None:
+        pytest.skip('orjson non installato')
+    return request.param
+
+
+def test_backends_agree_with_stdlib(backend):
+    expected = json.dumps(SAMPLE, ensure_ascii=False, separators=(',', ':'))
+    assert fastjson.dumps(SAMPLE) == expected
+    assert fastjson.dumps_bytes(SAMPLE) == expected.encode('utf-8')
+    assert fastjson.loads(expected.encode('utf-8')) == SAMPLE
+    assert fastjson.loads(expected) == SAMPLE
+
+
+def test_nan_and_lenient_input(backend):
+    # NaN nel payload in ingresso è accettato come dalla stdlib
+    assert math.isnan(fastjson.loads(b'{"v": NaN}')['v'])
+    with pytest.raises(ValueError):
+        fastjson.loads(b'{"v": ')
+    # in uscita entrambi i backend scrivono null, JSON valido per json_valid()
+    data = {'v': float('nan'), 'w': [float('inf'), -float('inf'), 1.5]}
+    assert fastjson.dumps_bytes(data) == b'{"v":null,"w":[null,null,1.5]}'
+    assert fastjson.dumps(data) == '{"v":null,"w":[null,null,1.5]}'
+
+
+def test_ingest_and_api_use_fast_path(backend):
+    assert processing._json_loads(b'garbage {"a": 1} trailing') == {'a': 1}
+    res = asyncio.run(api.api_admin_backups())
+    assert isinstance(res, api.JSONResponse)
+    assert res.body == fastjson.dumps_bytes(json.loads(res.body))
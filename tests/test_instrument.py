@@ -0,0 +1,125 @@
+import asyncio
+import os
+import sys
+import threading
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import database  # noqa: E402
+import instrument  # noqa: E402
+import processing  # noqa: E402
+
+
+def setup_storage(monkeypatch):
+    storage = database.Storage(':memory:')
+    monkeypatch.setattr(api.app.state, 'storage', storage, raising=False)
+    return storage
+
+
+def scrape():
+    res = asyncio.run(api.prometheus_metrics())
+    assert res.media_type.startswith('text/plain; version=0.0.4')
+    return res.body.decode()
+
+
+def test_histogram_and_counter_text_format():
+    hist = instrument.Histogram('test_latency_seconds', 'prova', ('op',), buckets=(0.1, 1.0))
+    hist.observe(0.05, 'read')
+    hist.observe(0.5, 'read')
+    hist.observe(3.0, 'read')
+    counter = instrument.Counter('test_things', 'prova', ('kind',))
+    counter.inc('a"b')
+    counter.inc('a"b', amount=2)
+    text = instrument.render()
+    assert '# TYPE test_latency_seconds histogram' in text
+    assert 'test_latency_seconds_bucket{op="read",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{op="read",le="1.0"} 2' in text
+    assert 'test_latency_seconds_bucket{op="read",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_sum{op="read"} 3.55' in text
+    assert 'test_latency_seconds_count{op="read"} 3' in text
+    assert 'test_things_total{kind="a\\"b"} 3' in text
+    # valori esterni arbitrari non creano serie nuove
+    assert instrument.label('TEXT_MESSAGE_APP') == 'TEXT_MESSAGE_APP'
+    assert instrument.label('x' * 100) == 'other' and instrument.label(None) == 'unknown'
+
+
+def test_timed_lock_records_waits():
+    hist = instrument.Histogram('test_lock_wait_seconds', 'prova', buckets=instrument.FAST_BUCKETS)
+    lock = instrument.TimedLock(hist)
+    with lock:
+        assert lock.locked()
+        assert lock.acquire(blocking=False) is False
+        waiter = threading.Thread(target=lambda: lock.acquire() and lock.release())
+        waiter.start()
+        threading.Event().wait(0.05)
+    waiter.join()
+    assert hist.count() == 2
+    assert hist._series[()][1] >= 0.04
+
+
+def test_ingest_and_db_metrics_on_scrape(monkeypatch):
+    storage = setup_storage(monkeypatch)
+    decoded = instrument.MESSAGES_DECODED.value('TEXT_MESSAGE_APP')
+    failed = instrument.MESSAGES_FAILED.value('unknown', 'decode')
+    commits = instrument.DB_COMMIT_SECONDS.count()
+    waits = instrument.DB_LOCK_WAIT_SECONDS.count()
+    processing.process_mqtt_message(
+        'msh/2/json/x', b'{"from": 1, "type": "text", "decoded": {"portnum": "TEXT_MESSAGE_APP"}}', storage
+    )
+    processing.process_mqtt_message('msh/2/json/x', b'\xff\x00', storage)
+    assert instrument.MESSAGES_DECODED.value('TEXT_MESSAGE_APP') == decoded + 1
+    assert instrument.MESSAGES_FAILED.value('unknown', 'decode') == failed + 1
+    assert instrument.PROCESS_SECONDS.count('TEXT_MESSAGE_APP') >= 1
+    assert instrument.DB_COMMIT_SECONDS.count() > commits
+    assert instrument.DB_LOCK_WAIT_SECONDS.count() > waits
+
+    text = scrape()
+    assert 'meshplotter_messages_decoded_total{portnum="TEXT_MESSAGE_APP"}' in text
+    assert 'meshplotter_db_commit_seconds_bucket{le="+Inf"}' in text
+    assert 'meshplotter_sqlite_pages ' in text and 'meshplotter_sqlite_wal_bytes 0' in text
+    assert 'meshplotter_db_executor_waiting{class="heavy"} 0' in text
+    assert 'meshplotter_events_subscribers 0' in text
+
+
+def test_http_middleware_uses_route_template():
+    class Route:
+        path = '/api/nodes/{node_id}/track'
+
+    async def app(scope, receive, send):
+        scope['route'] = Route()
+        await send({'type': 'http.response.start', 'status': 404, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def send(message):
+        pass
+
+    before = instrument.HTTP_REQUEST_SECONDS.count('GET', Route.path, '404')
+    mw = instrument.HTTPMetricsMiddleware(app)
+    asyncio.run(mw({'type': 'http', 'path': '/api/nodes/abc/track', 'method': 'GET'}, None, send))
+    assert instrument.HTTP_REQUEST_SECONDS.count('GET', Route.path, '404') == before + 1
+
+
+def test_render_while_new_series_appear():
+    counter = instrument.Counter('test_racing', 'prova', ('n',))
+    hist = instrument.Histogram('test_racing_seconds', 'prova', ('n',))
+    stop = threading.Event()
+
+    def writer():
+        for i in range(5000):
+            if stop.is_set():
+                break
+            counter.inc(str(i))
+            hist.observe(0.01, str(i))
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for _ in range(50):
+            instrument.render()
+    finally:
+        stop.set()
+        thread.join()
+        instrument._REGISTRY.remove(counter)
+        instrument._REGISTRY.remove(hist)
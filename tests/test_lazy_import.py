@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+CONFIG = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+
+
+def run_python(code):
+    env = dict(os.environ, TP_CONFIG=CONFIG)
+    return subprocess.run(
+        [sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+
+
+def test_import_does_not_open_db_or_load_meshtastic():
+    res = run_python(
+        'import sys, api, database\n'
+        'assert database._default is None\n'
+        'assert "meshtastic" not in sys.modules\n'
+        'print("ok")\n'
+    )
+    assert res.stdout.strip().endswith('ok')
+
+
+def test_import_config_is_free():
+    res = run_python(
+        'import sys, config\n'
+        'assert not config._LOADED\n'
+        'assert "yaml" not in sys.modules\n'
+        'print(config.DB_PATH)\n'
+    )
+    assert res.stdout.strip().endswith(':memory:')
+
+
+def test_import_modules_does_not_load_config():
+    res = run_python(
+        'import sys, config, processing, mqtt_client, api\n'
+        'assert not config._LOADED\n'
+        'assert "yaml" not in sys.modules\n'
+        'print("ok")\n'
+    )
+    assert res.stdout.strip().endswith('ok')
+
+
+def test_explicit_storage_is_used_by_processing():
+    sys.path.insert(0, ROOT)
+    os.environ['TP_CONFIG'] = CONFIG
+    import database
+    import processing
+
+    storage = database.Storage(':memory:')
+    processing.process_mqtt_message(
+        'msh/test', b'{"environment_metrics": {"temperature": 20.5}, "user": {"id": "abcd"}}', storage
+    )
+    rows = storage.conn.execute('SELECT node_id, metric, value FROM telemetry').fetchall()
+    assert rows == [('abcd', 'temperature', 20.5)]
@@ -0,0 +1,67 @@
+import asyncio
+import os
+import sys
+import json
+
+import pytest
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import database  # noqa: E402
+import maintenance  # noqa: E402
+
+
+def test_resolve_profile_merges_custom_profiles():
+    assert maintenance.resolve_profile(None) == {}
+    custom = {'tiny': {'cache_size': -1024}}
+    assert maintenance.resolve_profile('tiny', custom) == {'cache_size': -1024}
+    with pytest.raises(ValueError):
+        maintenance.resolve_profile('missing')
+    with pytest.raises(ValueError):
+        maintenance.resolve_profile('bad', {'bad': {'journal_mode': 'off'}})
+
+
+def test_new_db_gets_profile_pragmas(tmp_path):
+    tuning = maintenance.resolve_profile('large')
+    storage = database.Storage(str(tmp_path / 't.db'), tuning=tuning)
+    conn = storage.conn
+    assert conn.execute('PRAGMA page_size').fetchone()[0] == 8192
+    assert conn.execute('PRAGMA cache_size').fetchone()[0] == -262144
+    assert conn.execute('PRAGMA temp_store').fetchone()[0] == 2
+    assert conn.execute('PRAGMA wal_autocheckpoint').fetchone()[0] == 0
+    assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    storage.close()
+
+
+def test_run_once_checkpoints_and_vacuums(tmp_path):
+    storage = database.Storage(str(tmp_path / 't.db'), tuning={'wal_autocheckpoint': 0})
+    storage.conn.executemany(
+        'INSERT INTO messages(ts, node_id, portnum, raw_json) VALUES(?,?,?,?)',
+        [(i, 'n1', 'TEXT_MESSAGE_APP', 'x' * 500) for i in range(2000)],
+    )
+    storage.conn.commit()
+    storage.conn.execute('DELETE FROM messages')
+    storage.conn.commit()
+    assert maintenance.wal_size(storage) > 0
+
+    free = storage.conn.execute('PRAGMA freelist_count').fetchone()[0]
+    pages = storage.conn.execute('PRAGMA page_count').fetchone()[0]
+    assert free > 100
+
+    maint = maintenance.Maintenance(storage, wal_truncate_bytes=1, optimize_every=0, vacuum_pages=100)
+    report = maint.run_once()
+    assert report['checkpoint']['mode'] == 'TRUNCATE'
+    assert report['optimize'] is True
+    assert report['vacuumed_pages'] == 100
+    assert storage.conn.execute('PRAGMA freelist_count').fetchone()[0] == free - 100
+    assert storage.conn.execute('PRAGMA page_count').fetchone()[0] == pages - 100
+    assert report['wal_bytes_after'] == 0
+    storage.close()
+
+
+def test_admin_storage_endpoint():
+    data = json.loads(asyncio.run(api.api_admin_storage()).body)
+    assert data['page_count'] > 0
+    assert 'wal_bytes' in data
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import database  # noqa: E402
+import mapcluster  # noqa: E402
+import processing  # noqa: E402
+
+
+def setup_storage(monkeypatch):
+    storage = database.Storage(':memory:')
+    monkeypatch.setattr(api.app.state, 'storage', storage, raising=False)
+    return storage
+
+
+def clusters(bbox, zoom, **kwargs):
+    res = asyncio.run(api.api_map_clusters(bbox=bbox, zoom=zoom, **{'include_inactive': True, **kwargs}))
+    return res.status_code, json.loads(res.body)
+
+
+def add_node(storage, node_id, lat, lon, name=None):
+    storage.conn.execute(
+        'INSERT INTO nodes(node_id, long_name, lat, lon, last_seen) VALUES(?,?,?,?,1)', (node_id, name, lat, lon)
+    )
+
+
+def test_cell_grid_matches_tiles():
+    # allo zoom 0 la griglia ha 4x4 celle da 64 px
+    assert mapcluster.cell_of(0.0, 0.0, 0) == (2, 2)
+    assert mapcluster.cell_of(89.0, -180.0, 0) == (0, 0)
+    assert mapcluster.cell_of(-89.0, 179.9, 0) == (3, 3)
+    w, s, e, n = mapcluster.cell_bounds((2, 2), 0)
+    assert (w, n, e) == (0.0, 0.0, 90.0)
+    assert s == pytest.approx(-66.51, abs=0.01)
+    # il riquadro allargato contiene le celle dei suoi vertici
+    w, s, e, n = mapcluster.snap_bbox((10.0, 44.0, 11.0, 45.0), 8)
+    assert w <= 10.0 and s <= 44.0 and e >= 11.0 and n >= 45.0
+    assert mapcluster.snap_bbox((10.01, 44.01, 10.99, 44.99), 8) == (w, s, e, n)
+
+
+def test_clusters_and_link_bundles(monkeypatch):
+    storage = setup_storage(monkeypatch)
+    # due gruppi vicini a Bologna e Milano, più un nodo isolato a Roma
+    add_node(storage, 'b1', 44.49, 11.34)
+    add_node(storage, 'b2', 44.50, 11.35)
+    storage.conn.execute("INSERT INTO nodes(node_id, last_seen) VALUES('b3', 1)")
+    add_node(storage, 'm1', 45.46, 9.19)
+    add_node(storage, 'r1', 41.90, 12.49, 'Roma')
+    now = int(api.time.time())
+    processing._store_traceroute(storage, 'b1', now, {'from': 'b1', 'to': 'm1', 'route': ['b1', 'b2', 'm1']})
+    processing._store_traceroute(storage, 'm1', now, {'from': 'm1', 'to': 'b1', 'route': ['m1', 'b1']})
+    processing._store_traceroute(storage, 'b3', now, {'from': 'b3', 'to': 'b1', 'route': ['b3', 'b1']})
+    # b3 non ha posizione reale: stimata vicino a b1
+    status, out = clusters('6,40,14,47', 6)
+    assert status == 200 and out['zoom'] == 6 and out['cell_px'] == 64
+    by_count = sorted(out['clusters'], key=lambda c: c['count'])
+    assert [c['count'] for c in by_count] == [1, 1, 3]
+    bologna = by_count[-1]
+    assert bologna['estimated'] == 1 and 'node_id' not in bologna
+    assert bologna['lat'] == pytest.approx((44.49 + 44.50 + 44.491) / 3, abs=1e-3)
+    assert {c.get('name') for c in by_count[:2]} == {'Roma', 'm1'}
+    # m1-b1 e b2-m1 in un solo fascio, i collegamenti interni a Bologna esclusi
+    assert len(out['links']) == 1
+    link = out['links'][0]
+    assert link['links'] == 2 and link['count'] == 2 and link['last_seen'] == now
+    assert bologna['id'] in (link['source'], link['target'])
+
+    # da vicino Bologna si divide; un fascio verso Milano resta anche se fuori dal riquadro
+    _, out = clusters('11.0,44.3,11.6,44.7', 14)
+    assert sum(c['count'] for c in out['clusters']) == 3
+    assert any(l['to'] == [pytest.approx(45.46), pytest.approx(9.19)] or
+               l['from'] == [pytest.approx(45.46), pytest.approx(9.19)] for l in out['links'])
+
+    assert clusters('6,47,14,40', 6)[0] == 400
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import sys
+import json
+import struct
+import time
+from array import array
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+
+
+def seed():
+    now = int(time.time())
+    with api.DB_LOCK:
+        api.DB.execute('DELETE FROM telemetry')
+        api.DB.execute('DELETE FROM telemetry_blocks')
+        api.DB.executemany(
+            'INSERT INTO telemetry(ts, node_id, node_name, metric, value) VALUES(?,?,?,?,?)',
+            [(now - 100 + i, 'f1', 'F', 'temperature', 20.0 + i / 4) for i in range(10)]
+            + [(now - 100 + i, 'f1', 'F', 'voltage', 3.7) for i in range(3)],
+        )
+        api.DB.commit()
+    return now
+
+
+def metrics(**kw):
+    return asyncio.run(api.api_metrics(nodes='f1', since_s=3600, use_nick=0, **kw))
+
+
+def decode_binary(buf):
+    assert buf[:4] == api.METRICS_BINARY_MAGIC
+    (hlen,) = struct.unpack_from('<I', buf, 4)
+    meta = json.loads(buf[8:8 + hlen])
+    off = 8 + hlen + (-(8 + hlen) % 8)
+    out = []
+    for s in meta['series']:
+        n = s['count']
+        ts = array('q', buf[off:off + 8 * n])
+        off += 8 * n
+        vals = array('d', buf[off:off + 8 * n])
+        off += 8 * n
+        out.append((s['family'], s['node_id'], list(ts), list(vals)))
+    assert off == len(buf)
+    return meta['units'], out
+
+
+def test_formats_carry_the_same_samples():
+    seed()
+    points = json.loads(metrics().body)['series']
+    columnar = json.loads(metrics(format='columnar').body)['series']
+    res = metrics(format='binary')
+    assert res.media_type == api.METRICS_BINARY_TYPE
+    units, binary = decode_binary(res.body)
+    assert units == api.config.UNITS
+
+    for fam in ('temperature', 'voltage'):
+        p = points[fam][0]
+        c = columnar[fam][0]
+        assert 'data' not in c
+        assert c['ts'] == [d['x'] for d in p['data']]
+        assert c['values'] == [d['y'] for d in p['data']]
+        b = next(s for s in binary if s[0] == fam)
+        assert b[1] == 'f1'
+        assert b[2] == c['ts'] and b[3] == c['values']
+
+
+def test_binary_with_downsampling_and_bad_format():
+    seed()
+    _, binary = decode_binary(metrics(format='binary', max_points=4).body)
+    temp = next(s for s in binary if s[0] == 'temperature')
+    assert len(temp[2]) == 4
+    assert metrics(format='xml').status_code == 400
+
+
+def test_after_ts_returns_only_new_samples(monkeypatch):
+    now = seed()
+    monkeypatch.setattr(api.time, 'time', lambda: now)
+    first = json.loads(metrics().body)
+    assert first['cursor'] == now - 1
+    assert len(first['series']['temperature'][0]['data']) == 10
+
+    with api.DB_LOCK:
+        api.DB.executemany(
+            'INSERT INTO telemetry(ts, node_id, node_name, metric, value) VALUES(?,?,?,?,?)',
+            [(now + 1, 'f1', 'F', 'temperature', 30.0), (now + 5, 'f1', 'F', 'temperature', 31.0)],
+        )
+        api.DB.commit()
+    monkeypatch.setattr(api.time, 'time', lambda: now + 5)
+    inc = json.loads(metrics(after_ts=first['cursor']).body)
+    # il secondo in corso (now + 5) resta per la richiesta successiva
+    assert [p['y'] for p in inc['series']['temperature'][0]['data']] == [30.0]
+    assert inc['series']['voltage'] == []
+    assert inc['cursor'] == now + 4
+
+    monkeypatch.setattr(api.time, 'time', lambda: now + 6)
+    res = metrics(after_ts=inc['cursor'], format='binary')
+    units, binary = decode_binary(res.body)
+    assert [s[3] for s in binary] == [[31.0]]
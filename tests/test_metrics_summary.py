@@ -0,0 +1,52 @@
+import asyncio
+import json
+import os
+import sys
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import database  # noqa: E402
+
+
+def setup_storage(monkeypatch):
+    storage = database.Storage(':memory:')
+    monkeypatch.setattr(api.app.state, 'storage', storage, raising=False)
+    return storage
+
+
+def summary(**kwargs):
+    res = asyncio.run(api.api_metrics_summary(**{'nodes': None, 'metrics': None, 'since_s': 24 * 3600,
+                                                  'use_nick': 0, **kwargs}))
+    return json.loads(res.body)
+
+
+def test_summary_from_aggregates(monkeypatch):
+    storage = setup_storage(monkeypatch)
+    now = int(api.time.time())
+    storage.upsert_node('a', 'A', 'Alpha', now)
+    for i, v in enumerate([20.0, 25.0, 22.0]):
+        storage.store_metric(now - 7200 + i * 3000, 'a', 'temperature', v)
+    storage.store_metric(now - 10, 'a', 'voltage', 4.1)
+    # fuori finestra: resta nei rollup ma non nel riepilogo
+    storage.store_metric(now - 10 * 86400, 'b', 'temperature', 99.0)
+    # arrivato in ritardo: non sostituisce l'ultimo valore
+    storage.store_metric(now - 7000, 'a', 'temperature', 30.0)
+
+    # il riepilogo non legge telemetry
+    storage.conn.execute('DELETE FROM telemetry')
+    out = summary()
+    assert out['bucket_s'] == 3600 and out['since'] % 3600 == 0
+    rows = {(r['node_id'], r['metric']): r for r in out['summary']}
+    assert set(rows) == {('a', 'temperature'), ('a', 'voltage')}
+    t = rows[('a', 'temperature')]
+    assert t['latest'] == 22.0 and t['latest_ts'] == now - 7200 + 6000
+    assert (t['min'], t['max'], t['count']) == (20.0, 30.0, 4)
+    assert t['avg'] == (20 + 25 + 22 + 30) / 4
+    assert t['label'] == 'Alpha' and t['family'] == 'temperature' and t['unit'] == '°C'
+
+    assert [r['metric'] for r in summary(metrics='voltage')['summary']] == ['voltage']
+    assert summary(nodes='Alpha', since_s=3600)['summary'][0]['node_id'] == 'a'
+    assert summary(nodes='nessuno')['summary'] == []
+    assert len(summary(since_s=30 * 86400)['summary']) == 3
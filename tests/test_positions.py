@@ -0,0 +1,99 @@
+import asyncio
+import os
+import sys
+import json
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import database  # noqa: E402
+
+
+def reset_db():
+    with api.DB_LOCK:
+        api.DB.execute('DELETE FROM nodes')
+        api.DB.execute('DELETE FROM positions')
+        api.DB.execute('DELETE FROM traceroutes')
+        api.DB.commit()
+
+
+def test_position_history_is_deduplicated():
+    storage = database.Storage(':memory:')
+    storage.upsert_node('n1', 's', 'one', 100, lat=45.0, lon=9.0, pos_ts=100)
+    # stesso punto poco dopo: scartato
+    storage.upsert_node('n1', 's', 'one', 200, lat=45.00001, lon=9.0, pos_ts=200)
+    # spostamento di ~1 km: salvato
+    storage.upsert_node('n1', 's', 'one', 300, lat=45.01, lon=9.0, pos_ts=300)
+    # fermo ma oltre l'intervallo minimo: salvato
+    storage.upsert_node('n1', 's', 'one', 5000, lat=45.01, lon=9.0, pos_ts=5000)
+    # duplicato esatto arrivato in ritardo: scartato
+    storage.upsert_node('n1', 's', 'one', 5100, lat=45.01, lon=9.0, pos_ts=300)
+    rows = storage.conn.execute('SELECT ts FROM positions ORDER BY ts').fetchall()
+    assert [r[0] for r in rows] == [100, 300, 5000]
+
+
+def test_rtree_follows_node_updates():
+    reset_db()
+    storage = api._storage()
+    storage.upsert_node('a', 'a', 'A', 10, lat=45.0, lon=9.0, pos_ts=10)
+    storage.upsert_node('b', 'b', 'B', 10, lat=41.9, lon=12.5, pos_ts=10)
+    with storage.lock:
+        storage.conn.execute('INSERT INTO nodes(node_id) VALUES(?)', ('c',))
+        storage.conn.commit()
+
+    data = json.loads(asyncio.run(api.api_nodes(bbox='8,44,10,46')).body)
+    assert [n['node_id'] for n in data] == ['a']
+
+    # il nodo si sposta: l'indice segue la posizione nuova
+    storage.upsert_node('a', 'a', 'A', 20, lat=41.8, lon=12.4, pos_ts=20)
+    data = json.loads(asyncio.run(api.api_nodes(bbox='8,44,10,46')).body)
+    assert data == []
+    data = json.loads(asyncio.run(api.api_nodes(bbox='12,41,13,42')).body)
+    assert sorted(n['node_id'] for n in data) == ['a', 'b']
+
+    asyncio.run(api.api_admin_delete_node('b'))
+    data = json.loads(asyncio.run(api.api_nodes(bbox='12,41,13,42')).body)
+    assert [n['node_id'] for n in data] == ['a']
+
+    res = asyncio.run(api.api_nodes(bbox='1,2,3'))
+    assert res.status_code == 400
+
+
+def test_track_endpoint():
+    reset_db()
+    storage = api._storage()
+    for i, lat in enumerate((45.0, 45.01, 45.02)):
+        storage.upsert_node('t', 't', 'T', 100 + i, lat=lat, lon=9.0, pos_ts=100 + i)
+    data = json.loads(asyncio.run(api.api_node_track('t', since=101)).body)
+    assert data['node_id'] == 't'
+    assert [(p['ts'], p['lat']) for p in data['points']] == [(101, 45.01), (102, 45.02)]
+    data = json.loads(asyncio.run(api.api_node_track('t', since=0, until=102, limit=1)).body)
+    assert [p['ts'] for p in data['points']] == [100]
+
+
+def test_migration_seeds_history_and_index(tmp_path):
+    path = str(tmp_path / 'v3.db')
+    storage = database.Storage(path)
+    with storage.lock:
+        storage.conn.execute('DROP TABLE positions')
+        storage.conn.execute('DROP TABLE node_rtree')
+        storage.conn.execute('DROP TABLE node_rtree_ids')
+        for trig in ('nodes_rtree_insert', 'nodes_rtree_update', 'nodes_rtree_delete'):
+            storage.conn.execute(f'DROP TRIGGER {trig}')
+        storage.conn.execute(
+            'INSERT INTO nodes(node_id, lat, lon, pos_ts) VALUES(?,?,?,?)', ('old', 45.0, 9.0, 50)
+        )
+        storage.conn.execute('PRAGMA user_version = 3')
+        storage.conn.commit()
+    storage.close()
+
+    storage = database.Storage(path)
+    conn = storage.conn
+    assert conn.execute('SELECT node_id, ts FROM positions').fetchall() == [('old', 50)]
+    hits = conn.execute(
+        'SELECT g.node_id FROM node_rtree r JOIN node_rtree_ids g ON g.id = r.id '
+        'WHERE r.min_lat >= 44 AND r.max_lat <= 46 AND r.min_lon >= 8 AND r.max_lon <= 10'
+    ).fetchall()
+    assert hits == [('old',)]
+    storage.close()
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import sys
+import json
+import threading
+import time
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import database  # noqa: E402
+import respcache  # noqa: E402
+
+
+def counter(body=b'x', node_ids=None):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return respcache.Computed(body, 'application/json', 200, node_ids)
+
+    return compute, calls
+
+
+def test_hit_until_dependency_changes():
+    storage = database.Storage(':memory:')
+    cache = respcache.ResponseCache()
+    compute, calls = counter(node_ids=['a'])
+    for _ in range(3):
+        cache.get_or_compute(storage, 'k', ('telemetry',), compute)
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 2
+
+    # scritture su altri nodi o tabelle non invalidano
+    storage.touch('telemetry', node_id='b')
+    storage.touch('traceroutes')
+    cache.get_or_compute(storage, 'k', ('telemetry',), compute)
+    assert len(calls) == 1
+
+    storage.touch('telemetry', node_id='a')
+    cache.get_or_compute(storage, 'k', ('telemetry',), compute)
+    assert len(calls) == 2
+    # una modifica senza nodo vale per tutti
+    storage.touch('telemetry')
+    cache.get_or_compute(storage, 'k', ('telemetry',), compute)
+    assert len(calls) == 3
+    storage.close()
+
+
+def test_lru_eviction_by_bytes_and_errors_not_stored():
+    storage = database.Storage(':memory:')
+    cache = respcache.ResponseCache(max_bytes=10)
+    for key in ('a', 'b', 'c'):
+        cache.get_or_compute(storage, key, ('nodes',), counter(b'1234')[0])
+    assert cache.stats()['entries'] == 2
+    assert cache.stats()['bytes'] == 8
+    compute, calls = counter(b'1234')
+    cache.get_or_compute(storage, 'a', ('nodes',), compute)
+    assert len(calls) == 1  # 'a' era il più vecchio
+
+    def bad():
+        calls.append(1)
+        return respcache.Computed(b'{}', 'application/json', 400)
+
+    cache.get_or_compute(storage, 'bad', ('nodes',), bad)
+    cache.get_or_compute(storage, 'bad', ('nodes',), bad)
+    assert len(calls) == 3
+    storage.close()
+
+
+def test_single_flight():
+    storage = database.Storage(':memory:')
+    cache = respcache.ResponseCache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return respcache.Computed(b'slow', 'text/plain')
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_compute(storage, 'k', ('nodes',), slow)))
+        for _ in range(5)
+    ]
+    threads[0].start()
+    started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1
+    assert [r.body for r in results] == [b'slow'] * 5
+    assert cache.stats()['coalesced'] == 4
+    storage.close()
+
+
+def test_api_uses_cache(monkeypatch):
+    storage = api._storage()
+    monkeypatch.setattr(api, '_response_cache', respcache.ResponseCache())
+    monkeypatch.setattr(api, '_response_cache_ready', True)
+    now = int(time.time())
+    storage.upsert_node('rc1', 'R1', 'Cache one', now)
+    storage.store_metric(now - 5, 'rc1', 'temperature', 20.0)
+    first = asyncio.run(api.api_metrics(nodes='rc1', since_s=3600, use_nick=0))
+    asyncio.run(api.api_metrics(nodes='rc1', since_s=3600, use_nick=0))
+    assert api._response_cache.stats()['hits'] == 1
+
+    storage.store_metric(now - 4, 'rc2', 'temperature', 30.0)
+    asyncio.run(api.api_metrics(nodes='rc1', since_s=3600, use_nick=0))
+    assert api._response_cache.stats()['hits'] == 2
+
+    storage.store_metric(now - 3, 'rc1', 'temperature', 21.0)
+    res = asyncio.run(api.api_metrics(nodes='rc1', since_s=3600, use_nick=0))
+    before = json.loads(first.body)['series']['temperature'][0]['data']
+    after = json.loads(res.body)['series']['temperature'][0]['data']
+    assert len(after) == len(before) + 1
+    assert res.headers['etag']
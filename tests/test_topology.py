@@ -0,0 +1,172 @@
+import asyncio
+import json
+import os
+import sys
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import database  # noqa: E402
+import processing  # noqa: E402
+
+
+def setup_storage(monkeypatch, path=':memory:'):
+    storage = database.Storage(path)
+    monkeypatch.setattr(api.app.state, 'storage', storage, raising=False)
+    return storage
+
+
+def traceroute(storage, src, dest, route, ts, **radio):
+    processing._store_traceroute(storage, src, ts, {'from': src, 'to': dest, 'route': route, **radio})
+
+
+def topology(max_age=0):
+    res = asyncio.run(api.api_topology(max_age=max_age))
+    return json.loads(res.body)
+
+
+def edges_by_name(out):
+    f = {name: i for i, name in enumerate(out['edge_fields'])}
+    ids = [n['id'] for n in out['nodes']]
+    return {(ids[e[f['source']]], ids[e[f['target']]]): {k: e[i] for k, i in f.items()} for e in out['edges']}
+
+
+def test_edges_follow_traceroutes(monkeypatch):
+    storage = setup_storage(monkeypatch)
+    now = int(api.time.time())
+    storage.conn.execute("INSERT INTO nodes(node_id, long_name, lat, lon) VALUES('a', 'Alpha', 1.0, 2.0)")
+    traceroute(storage, 'a', 'c', ['a', 'b', 'c'], now - 100, snr=6.5, rssi=-90)
+    traceroute(storage, 'a', 'c', ['a', 'b', 'c'], now, snr_towards=[24, 10])
+    traceroute(storage, 'c', 'a', ['c', 'b', 'a'], now - 50)
+
+    out = topology()
+    nodes = {n['id']: n for n in out['nodes']}
+    assert nodes['a'] == {'id': 'a', 'name': 'Alpha', 'lat': 1.0, 'lon': 2.0, 'estimated': False}
+    assert nodes['c']['lat'] is None
+    edges = edges_by_name(out)
+    assert set(edges) == {('a', 'b'), ('b', 'c'), ('c', 'b'), ('b', 'a')}
+    ab, bc = edges[('a', 'b')], edges[('b', 'c')]
+    # i traceroute sostituiti restano contati nel grafo
+    assert ab['count'] == 2 and ab['last_seen'] == now and ab['hop'] == 0
+    assert ab['snr'] == 6.0
+    assert (bc['hop'], bc['snr'], bc['rssi']) == (1, 2.5, -90)
+    assert edges[('b', 'a')]['hop'] == 1
+
+    # solo gli archi recenti
+    assert set(edges_by_name(topology(max_age=75))) == {('a', 'b'), ('b', 'c'), ('c', 'b'), ('b', 'a')}
+    assert set(edges_by_name(topology(max_age=25))) == {('a', 'b'), ('b', 'c')}
+
+
+def test_graph_persists_and_delete_clears(monkeypatch, tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    storage = setup_storage(monkeypatch, path)
+    now = int(api.time.time())
+    traceroute(storage, 'a', 'c', ['a', 'b', 'c'], now)
+    storage.close()
+
+    storage = setup_storage(monkeypatch, path)
+    assert set(storage.topology.edges) == {('a', 'b'), ('b', 'c')}
+    assert storage.topology.out['a'] == {'b'} and storage.topology.into['c'] == {'b'}
+
+    before = storage.data_version(('topology',))[0]
+    asyncio.run(api.api_delete_traceroutes())
+    assert storage.data_version(('topology',))[0] > before
+    assert storage.topology.edges == {}
+    assert topology()['edges'] == []
+    assert storage.conn.execute('SELECT COUNT(*) FROM topology_edges').fetchone()[0] == 0
+
+
+def test_migration_builds_edges_from_existing_traceroutes(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    storage = database.Storage(path)
+    storage.conn.execute(
+        "INSERT INTO traceroutes(ts, src_id, dest_id, route, hop_count, radio) "
+        "VALUES(100, 'a', 'c', '[\"a\", \"b\", \"c\"]', 2, '{\"snr\": 3.0}')"
+    )
+    storage.conn.execute('DROP TABLE topology_edges')
+    storage.conn.execute('PRAGMA user_version = 7')
+    storage.conn.commit()
+    storage.close()
+
+    storage = database.Storage(path)
+    edges = storage.topology.edges
+    assert set(edges) == {('a', 'b'), ('b', 'c')}
+    assert edges[('b', 'c')].snr == 3.0 and edges[('a', 'b')].count == 1
+
+
+def path(**kwargs):
+    res = asyncio.run(api.api_topology_path(**{'metric': 'hops', 'directed': 0, 'max_age': 0, **kwargs}))
+    return res.status_code, json.loads(res.body)
+
+
+def test_shortest_and_best_snr_path(monkeypatch):
+    storage = setup_storage(monkeypatch)
+    now = int(api.time.time())
+    storage.conn.execute("INSERT INTO nodes(node_id, long_name) VALUES('e', 'Echo')")
+    # a-b-e diretto ma con SNR basso, a-c-d-e più lungo e pulito
+    traceroute(storage, 'a', 'e', ['a', 'b', 'e'], now, snr_towards=[-40, 20])
+    traceroute(storage, 'a', 'd', ['a', 'c', 'd'], now, snr_towards=[32, 28])
+    traceroute(storage, 'd', 'e', ['d', 'e'], now, snr=7.0)
+
+    status, out = path(src='a', dst='Echo')
+    assert status == 200
+    assert [n['id'] for n in out['nodes']] == ['a', 'b', 'e'] and out['hops'] == 2
+    assert out['min_snr'] == -10.0
+
+    status, out = path(src='a', dst='e', metric='snr')
+    assert [n['id'] for n in out['nodes']] == ['a', 'c', 'd', 'e']
+    assert out['min_snr'] == 7.0
+    assert out['edges'][0] == {'source': 'a', 'target': 'c', 'count': 1, 'last_seen': now, 'snr': 8.0, 'rssi': None}
+
+    # all'indietro solo ignorando il verso dei collegamenti
+    assert [n['id'] for n in path(src='e', dst='a')[1]['nodes']] == ['e', 'b', 'a']
+    assert path(src='e', dst='a', directed=1) == (404, {'error': 'no path', 'from': 'e', 'to': 'a'})
+    assert path(src='a', dst='zz')[0] == 404
+    assert path(src='a', dst='e', metric='fast')[0] == 400
+
+
+def test_critical_nodes_and_bridges(monkeypatch):
+    storage = setup_storage(monkeypatch)
+    now = int(api.time.time())
+    # triangolo a-b-c appeso a d tramite c, e poi e dietro d
+    traceroute(storage, 'a', 'c', ['a', 'b', 'c'], now)
+    traceroute(storage, 'c', 'a', ['c', 'a'], now)
+    traceroute(storage, 'c', 'e', ['c', 'd', 'e'], now)
+
+    res = asyncio.run(api.api_topology_critical(max_age=0))
+    out = json.loads(res.body)
+    assert out['nodes'] == 5
+    assert [n['id'] for n in out['articulation_points']] == ['c', 'd']
+    assert out['bridges'] == [['c', 'd'], ['d', 'e']]
+
+    graph = storage.topology
+    assert graph.critical() is graph.critical()
+    # un nuovo passaggio su archi noti non invalida la cache, un arco nuovo sì
+    cached = graph.critical()
+    traceroute(storage, 'c', 'e', ['c', 'd', 'e'], now + 1)
+    assert graph.critical() is cached
+    traceroute(storage, 'a', 'e', ['a', 'e'], now + 2)
+    assert graph.critical() is not cached
+    assert graph.critical()['articulation_points'] == []
+    assert graph.critical()['bridges'] == []
+
+
+def test_mqtt_traceroute_snr_towards_stays_out_of_radio(monkeypatch):
+    storage = setup_storage(monkeypatch)
+    payload = {
+        'from': '!0000000a',
+        'to': '!0000000c',
+        'decoded': {
+            'portnum': 'TRACEROUTE_APP',
+            'payload': {'route': ['!0000000a', '!0000000b', '!0000000c'], 'snrTowards': [24, 10]},
+        },
+    }
+    processing.process_mqtt_message('msh/2/json/x', json.dumps(payload).encode(), storage)
+
+    res = asyncio.run(api.api_traceroutes(limit=10, max_age=0))
+    data = json.loads(res.body)
+    assert len(data) == 1 and data[0]['via'] == 'mqtt'
+    edges = storage.topology.edges
+    assert edges[('0000000a', '0000000b')].snr == 6.0
+    assert edges[('0000000b', '0000000c')].snr == 2.5
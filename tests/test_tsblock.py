@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+import json
+import math
+import random
+import struct
+import time
+
+os.environ['TP_CONFIG'] = os.path.join(os.path.dirname(__file__), 'test.config.yml')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api  # noqa: E402
+import database  # noqa: E402
+import tsblock  # noqa: E402
+
+HOUR = tsblock.HOUR
+
+
+def reset_db():
+    with api.DB_LOCK:
+        api.DB.execute('DELETE FROM telemetry')
+        api.DB.execute('DELETE FROM telemetry_blocks')
+        api.DB.execute('DELETE FROM nodes')
+        api.DB.commit()
+
+
+def struct_bits(v):
+    return struct.pack('<d', v)
+
+
+def test_encode_decode_roundtrip():
+    rnd = random.Random(1)
+    ts = [1_700_000_000]
+    for _ in range(999):
+        ts.append(ts[-1] + rnd.choice([10, 10, 10, 11, 9, 300, 5000, -3]))
+    values = [21.5 + math.sin(i / 50) + rnd.choice([0, 0, 0.25]) for i in range(1000)]
+    values[10] = -0.0
+    values[11] = float('inf')
+    blob = tsblock.encode(ts, values)
+    out_ts, out_vals = tsblock.decode(blob)
+    assert out_ts == ts
+    assert [struct_bits(v) for v in out_vals] == [struct_bits(v) for v in values]
+
+
+def test_regular_series_compresses_well():
+    ts = list(range(0, 3600, 10))
+    values = [20.0 + (i // 30) * 0.1 for i in range(len(ts))]
+    blob = tsblock.encode(ts, values)
+    assert tsblock.decode(blob) == (ts, values)
+    # 16 byte per campione non compressi
+    assert len(blob) < len(ts) * 16 / 8
+
+
+def test_empty_and_single_sample():
+    assert tsblock.decode(tsblock.encode([], [])) == ([], [])
+    assert tsblock.decode(tsblock.encode([5], [1.5])) == ([5], [1.5])
+
+
+def test_compact_moves_closed_hours_and_metrics_reads_blocks():
+    reset_db()
+    now = int(time.time())
+    hour = now - now % HOUR
+    rows = [(hour - 2 * HOUR + 10 * i, 'n1', 'humidity', 50.0 + i) for i in range(6)]
+    rows += [(now, 'n1', 'humidity', 99.0)]
+    with api.DB_LOCK:
+        api.DB.executemany('INSERT INTO telemetry(ts, node_id, metric, value) VALUES(?,?,?,?)', rows)
+        api.DB.commit()
+
+    storage = api._storage()
+    assert tsblock.compact(storage, now) == 6
+    with api.DB_LOCK:
+        left = api.DB.execute('SELECT COUNT(*) FROM telemetry').fetchone()[0]
+        blocks = api.DB.execute('SELECT hour_ts, count FROM telemetry_blocks').fetchall()
+    assert left == 1
+    assert blocks == [(hour - 2 * HOUR, 6)]
+
+    res = asyncio.run(api.api_metrics(nodes='n1', since_s=3 * HOUR, use_nick=0))
+    data = json.loads(res.body)['series']['humidity'][0]['data']
+    assert [p['y'] for p in data] == [50.0, 51.0, 52.0, 53.0, 54.0, 55.0, 99.0]
+
+    # una finestra che taglia il blocco restituisce solo i campioni interni
+    since_s = now - (hour - 2 * HOUR + 25)
+    res = asyncio.run(api.api_metrics(nodes='n1', since_s=since_s, use_nick=0))
+    data = json.loads(res.body)['series']['humidity'][0]['data']
+    assert [p['y'] for p in data] == [53.0, 54.0, 55.0, 99.0]
+    reset_db()
+
+
+def test_compact_waits_for_pending_backfills():
+    storage = database.Storage(':memory:')
+    storage.conn.execute("INSERT INTO telemetry(ts, node_id, metric, value) VALUES(10, 'n1', 'humidity', 50.0)")
+    storage.conn.execute(
+        "INSERT INTO schema_backfills(name, table_name, last_id, max_id) VALUES('prova', 'telemetry', 0, 1)"
+    )
+    storage.conn.commit()
+    assert tsblock.compact(storage, 2 * HOUR) == 0
+    assert storage.conn.execute('SELECT COUNT(*) FROM telemetry_blocks').fetchone()[0] == 0
+
+    storage.conn.execute("UPDATE schema_backfills SET last_id = max_id")
+    assert tsblock.compact(storage, 2 * HOUR) == 1
+    storage.close()
@@ -0,0 +1,327 @@
+"""Grafo della rete mesh ricavato dai traceroute.
+
+Ogni traceroute percorre una catena di collegamenti radio: per ogni coppia
+di hop consecutivi il grafo tiene un arco orientato (nel verso del
+pacchetto) con prima e ultima osservazione, numero di osservazioni,
+posizione dell'hop nel percorso e, se noti, SNR e RSSI.
+
+Il grafo vive in memoria ed è aggiornato da ``processing._store_traceroute``
+insieme alla tabella ``topology_edges``, che lo rende persistente: all'avvio
+viene ricaricato da lì. A differenza di ``node_links`` (vedi ``estimator``)
+non dimentica gli archi quando i traceroute scadono: l'età si filtra con
+``last_seen``. Le funzioni che scrivono vanno chiamate con il lock dello
+storage acquisito; il commit resta al chiamante.
+
+Percorsi (:meth:`Graph.path`) e punti critici (:meth:`Graph.critical`)
+lavorano sulle liste di adiacenza ``out``/``into``, aggiornate arco per arco;
+i punti critici sono ricalcolati solo quando cambia la struttura del grafo
+(``structure``), non a ogni nuova osservazione di un arco già noto.
+"""
+
+import heapq
+import sqlite3
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import fastjson
+from estimator import parse_route, route_path
+
+EDGE_FIELDS = ("first_seen", "last_seen", "count", "hop", "snr", "rssi")
+# criteri di :meth:`Graph.path`
+PATH_METRICS = ("hops", "snr")
+
+
+class Edge:
+    __slots__ = EDGE_FIELDS
+
+    def __init__(
+        self,
+        first_seen: int,
+        last_seen: int,
+        count: int = 0,
+        hop: int = 0,
+        snr: Optional[float] = None,
+        rssi: Optional[float] = None,
+    ) -> None:
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.count = count
+        self.hop = hop
+        self.snr = snr
+        self.rssi = rssi
+
+    def as_tuple(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, f) for f in EDGE_FIELDS)
+
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def edge_radio(path: Sequence[str], radio: Optional[Dict[str, Any]]) -> List[Tuple[Optional[float], Optional[float]]]:
+    """``(snr, rssi)`` per ogni arco del percorso.
+
+    ``snr_towards``/``snrTowards`` (Meshtastic, in quarti di dB) dà l'SNR di
+    ogni hop; altrimenti ``snr``/``rssi`` del pacchetto valgono per l'ultimo
+    arco, quello ricevuto dal nodo che lo ha pubblicato.
+    """
+    edges = max(len(path) - 1, 0)
+    out: List[Tuple[Optional[float], Optional[float]]] = [(None, None)] * edges
+    if not radio or not edges:
+        return out
+    towards = radio.get("snr_towards", radio.get("snrTowards"))
+    if isinstance(towards, list) and len(towards) == edges:
+        out = [(_number(v) / 4 if _number(v) is not None else None, None) for v in towards]
+    snr, rssi = _number(radio.get("snr")), _number(radio.get("rssi"))
+    if snr is not None or rssi is not None:
+        last_snr, _ = out[-1]
+        out[-1] = (last_snr if last_snr is not None else snr, rssi)
+    return out
+
+
+class Graph:
+    """Nodi e archi orientati, con gli attributi di :class:`Edge`."""
+
+    def __init__(self) -> None:
+        self.edges: Dict[Tuple[str, str], Edge] = {}
+        # vicini in uscita e in entrata, per percorsi e punti critici
+        self.out: Dict[str, Set[str]] = {}
+        self.into: Dict[str, Set[str]] = {}
+        # cambia solo quando un arco viene aggiunto o rimosso
+        self.structure = 0
+        self._critical: Optional[Tuple[int, Dict[str, Any]]] = None
+
+    def _link(self, a: str, b: str, edge: Edge) -> None:
+        self.edges[(a, b)] = edge
+        self.out.setdefault(a, set()).add(b)
+        self.into.setdefault(b, set()).add(a)
+        self.structure += 1
+
+    def load(self, db: sqlite3.Connection) -> "Graph":
+        """Ricarica il grafo da ``topology_edges``."""
+        self.edges.clear()
+        self.out.clear()
+        self.into.clear()
+        cur = db.execute(f"SELECT src, dst, {', '.join(EDGE_FIELDS)} FROM topology_edges")
+        for src, dst, *attrs in cur:
+            self._link(src, dst, Edge(*attrs))
+        self.structure += 1
+        return self
+
+    def observe(
+        self, db: sqlite3.Connection, path: Sequence[str], ts: int, radio: Optional[Dict[str, Any]] = None
+    ) -> Set[str]:
+        """Registra gli archi di un percorso; restituisce i nodi toccati."""
+        # la sorgente compare spesso anche come primo elemento della route
+        path = [n for i, n in enumerate(path) if i == 0 or n != path[i - 1]]
+        rows = []
+        for hop, ((a, b), (snr, rssi)) in enumerate(zip(zip(path, path[1:]), edge_radio(path, radio))):
+            edge = self.edges.get((a, b))
+            if edge is None:
+                edge = Edge(ts, ts)
+                self._link(a, b, edge)
+            edge.first_seen = min(edge.first_seen, ts)
+            if ts >= edge.last_seen:
+                edge.last_seen = ts
+                edge.hop = hop
+                # un valore mancante non cancella l'ultima misura
+                edge.snr = snr if snr is not None else edge.snr
+                edge.rssi = rssi if rssi is not None else edge.rssi
+            edge.count += 1
+            rows.append((a, b, *edge.as_tuple()))
+        if rows:
+            db.executemany(
+                f"""
+                INSERT INTO topology_edges(src, dst, {', '.join(EDGE_FIELDS)}) VALUES(?,?,?,?,?,?,?,?)
+                ON CONFLICT(src, dst) DO UPDATE SET
+                  {', '.join(f'{f} = excluded.{f}' for f in EDGE_FIELDS)}
+                """,
+                rows,
+            )
+        return {n for row in rows for n in row[:2]}
+
+    def clear(self, db: sqlite3.Connection) -> None:
+        db.execute("DELETE FROM topology_edges")
+        self.load(db)
+
+    def rebuild(self, db: sqlite3.Connection) -> None:
+        """Ricostruisce grafo e tabella dai traceroute memorizzati."""
+        db.execute("DELETE FROM topology_edges")
+        self.load(db)
+        for ts, src, dest, route_json, radio_json in db.execute(
+            "SELECT ts, src_id, dest_id, route, radio FROM traceroutes ORDER BY ts"
+        ).fetchall():
+            path = route_path(src, parse_route(route_json), dest)
+            try:
+                radio = fastjson.loads(radio_json) if radio_json else None
+            except ValueError:
+                radio = None
+            self.observe(db, path, ts or 0, radio if isinstance(radio, dict) else None)
+
+    def snapshot(self, since_ts: Optional[int] = None) -> List[Tuple[str, str, Tuple[Any, ...]]]:
+        """Copia degli archi (``src``, ``dst``, attributi) visti da ``since_ts`` in poi."""
+        return [
+            (a, b, e.as_tuple())
+            for (a, b), e in self.edges.items()
+            if since_ts is None or e.last_seen >= since_ts
+        ]
+
+    def nodes(self) -> Iterable[str]:
+        return set(self.out) | set(self.into)
+
+    def _neighbours(self, node: str, since: Optional[int], directed: bool) -> Iterator[Tuple[str, Edge]]:
+        """Vicini raggiungibili da ``node`` con l'arco da percorrere.
+
+        Senza ``directed`` un collegamento visto in un solo verso vale anche
+        nell'altro; se è noto in entrambi si usa quello nel verso del percorso.
+        """
+        seen = set()
+        for b in self.out.get(node, ()):
+            edge = self.edges[(node, b)]
+            if since is None or edge.last_seen >= since:
+                seen.add(b)
+                yield b, edge
+        if directed:
+            return
+        for a in self.into.get(node, ()):
+            if a in seen:
+                continue
+            edge = self.edges[(a, node)]
+            if since is None or edge.last_seen >= since:
+                yield a, edge
+
+    def path(
+        self,
+        src: str,
+        dst: str,
+        metric: str = "hops",
+        since: Optional[int] = None,
+        directed: bool = False,
+    ) -> Optional[List[Tuple[str, str, Edge]]]:
+        """Percorso da ``src`` a ``dst`` come lista di ``(a, b, arco)``; ``None`` se non esiste.
+
+        ``metric="hops"`` minimizza il numero di hop. ``metric="snr"``
+        massimizza l'SNR peggiore lungo il percorso e, a parità, minimizza gli
+        hop; un arco senza SNR noto conta come il peggiore possibile.
+        """
+        if src == dst:
+            return [] if src in self.out or src in self.into else None
+        floor: Optional[float] = None
+        if metric == "snr":
+            floor = self._widest(src, dst, since, directed)
+            if floor is None:
+                return None
+        # BFS, limitata agli archi non peggiori del collo di bottiglia trovato
+        prev: Dict[str, Tuple[str, Edge]] = {}
+        queue = deque([src])
+        visited = {src}
+        while queue:
+            node = queue.popleft()
+            if node == dst:
+                break
+            for nb, edge in self._neighbours(node, since, directed):
+                if nb in visited or (floor is not None and _snr(edge) < floor):
+                    continue
+                visited.add(nb)
+                prev[nb] = (node, edge)
+                queue.append(nb)
+        if dst not in prev:
+            return None
+        out: List[Tuple[str, str, Edge]] = []
+        node = dst
+        while node != src:
+            a, edge = prev[node]
+            out.append((a, node, edge))
+            node = a
+        out.reverse()
+        return out
+
+    def _widest(self, src: str, dst: str, since: Optional[int], directed: bool) -> Optional[float]:
+        """SNR del collo di bottiglia del percorso migliore (Dijkstra sul massimo del minimo)."""
+        best: Dict[str, float] = {src: float("inf")}
+        heap = [(-best[src], src)]
+        done: Set[str] = set()
+        while heap:
+            neg, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            if node == dst:
+                return -neg
+            done.add(node)
+            for nb, edge in self._neighbours(node, since, directed):
+                width = min(-neg, _snr(edge))
+                if nb in done:
+                    continue
+                if nb not in best or width > best[nb]:
+                    best[nb] = width
+                    heapq.heappush(heap, (-width, nb))
+        return None
+
+    def critical(self, since: Optional[int] = None) -> Dict[str, Any]:
+        """Punti di articolazione e ponti del grafo non orientato.
+
+        Sono i nodi e i collegamenti la cui perdita divide la rete. Senza
+        ``since`` il risultato resta in cache finché la struttura non cambia.
+        """
+        if since is None and self._critical is not None and self._critical[0] == self.structure:
+            return self._critical[1]
+        result = _articulation(self, since)
+        if since is None:
+            self._critical = (self.structure, result)
+        return result
+
+
+def _snr(edge: Edge) -> float:
+    return edge.snr if edge.snr is not None else float("-inf")
+
+
+def _articulation(graph: Graph, since: Optional[int]) -> Dict[str, Any]:
+    """Tarjan iterativo (niente ricorsione: le catene di hop possono essere lunghe)."""
+    adj: Dict[str, Set[str]] = {}
+    for (a, b), edge in graph.edges.items():
+        if since is not None and edge.last_seen < since:
+            continue
+        adj.setdefault(a, set()).add(b)
+        adj.setdefault(b, set()).add(a)
+    order: Dict[str, int] = {}
+    low: Dict[str, int] = {}
+    points: Set[str] = set()
+    bridges: List[Tuple[str, str]] = []
+    for root in sorted(adj):
+        if root in order:
+            continue
+        order[root] = low[root] = len(order)
+        children = 0
+        stack: List[Tuple[str, Optional[str], Iterator[str]]] = [(root, None, iter(sorted(adj[root])))]
+        while stack:
+            node, parent, it = stack[-1]
+            nb = next(it, None)
+            if nb is not None:
+                if nb == parent:
+                    continue
+                if nb in order:
+                    low[node] = min(low[node], order[nb])
+                    continue
+                order[nb] = low[nb] = len(order)
+                if node == root:
+                    children += 1
+                stack.append((nb, node, iter(sorted(adj[nb]))))
+                continue
+            stack.pop()
+            if parent is None:
+                continue
+            low[parent] = min(low[parent], low[node])
+            if low[node] > order[parent]:
+                bridges.append(tuple(sorted((parent, node))))
+            if parent != root and low[node] >= order[parent]:
+                points.add(parent)
+        if children > 1:
+            points.add(root)
+    return {
+        "nodes": len(adj),
+        "articulation_points": sorted(points),
+        "bridges": sorted(bridges),
+    }
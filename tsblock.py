@@ -0,0 +1,321 @@
+"""Blocchi compressi di telemetria (stile Gorilla).
+
+Con ``storage.compression: gorilla`` le ore chiuse di ogni coppia nodo/metrica
+vengono impacchettate in un BLOB della tabella ``telemetry_blocks`` e le righe
+originali rimosse da ``telemetry``:
+
+* timestamp codificati come delta-of-delta a lunghezza variabile;
+* valori float64 codificati come XOR con il valore precedente, salvando solo
+  i bit significativi.
+
+Con campionamenti regolari e valori che cambiano lentamente un campione
+occupa in media pochi bit invece di una riga SQLite.
+"""
+
+import sqlite3
+import struct
+import threading
+import time
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from database import Storage
+
+HOUR = 3600
+VERSION = 1
+_HDR = struct.Struct("<BI")
+_MASK64 = (1 << 64) - 1
+
+# Blocco decodificato: (node_id, node_name, metric, timestamp, valori)
+Block = Tuple[str, Optional[str], str, List[int], List[float]]
+
+
+def _f2i(v: float) -> int:
+    return struct.unpack("<Q", struct.pack("<d", v))[0]
+
+
+def _i2f(i: int) -> float:
+    return struct.unpack("<d", struct.pack("<Q", i))[0]
+
+
+class _BitWriter:
+    def __init__(self) -> None:
+        self.buf = bytearray()
+        self.acc = 0
+        self.n = 0
+
+    def write(self, value: int, bits: int) -> None:
+        self.acc = (self.acc << bits) | (value & ((1 << bits) - 1))
+        self.n += bits
+        while self.n >= 8:
+            self.n -= 8
+            self.buf.append((self.acc >> self.n) & 0xFF)
+        self.acc &= (1 << self.n) - 1
+
+    def getvalue(self) -> bytes:
+        if self.n:
+            return bytes(self.buf) + bytes([(self.acc << (8 - self.n)) & 0xFF])
+        return bytes(self.buf)
+
+
+class _BitReader:
+    def __init__(self, data: bytes, offset: int = 0) -> None:
+        self.data = data
+        self.pos = offset * 8
+
+    def read(self, bits: int) -> int:
+        start = self.pos >> 3
+        skip = self.pos & 7
+        end = (self.pos + bits + 7) >> 3
+        chunk = int.from_bytes(self.data[start:end], "big")
+        self.pos += bits
+        return (chunk >> ((end - start) * 8 - skip - bits)) & ((1 << bits) - 1)
+
+    def bit(self) -> int:
+        b = (self.data[self.pos >> 3] >> (7 - (self.pos & 7))) & 1
+        self.pos += 1
+        return b
+
+
+# (prefisso, bit del prefisso, bit del valore) per i delta-of-delta
+_DOD_CLASSES = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12))
+
+
+def encode(ts: Sequence[int], values: Sequence[float]) -> bytes:
+    """Codifica una serie ordinata per timestamp in un blocco compresso."""
+    w = _BitWriter()
+    count = len(ts)
+    if count:
+        w.write(ts[0] & _MASK64, 64)
+        prev_v = _f2i(values[0])
+        w.write(prev_v, 64)
+    prev_ts = ts[0] if count else 0
+    prev_delta = 0
+    lead = trail = -1
+    for i in range(1, count):
+        delta = ts[i] - prev_ts
+        dod = delta - prev_delta
+        prev_ts, prev_delta = ts[i], delta
+        if dod == 0:
+            w.write(0, 1)
+        else:
+            for prefix, pbits, vbits in _DOD_CLASSES:
+                half = 1 << (vbits - 1)
+                if -half < dod <= half:
+                    w.write(prefix, pbits)
+                    w.write(dod + half - 1, vbits)
+                    break
+            else:
+                w.write(0b1111, 4)
+                w.write(dod & _MASK64, 64)
+
+        cur = _f2i(values[i])
+        xor = cur ^ prev_v
+        prev_v = cur
+        if xor == 0:
+            w.write(0, 1)
+            continue
+        lz = min(64 - xor.bit_length(), 31)
+        tz = (xor & -xor).bit_length() - 1
+        if lead >= 0 and lz >= lead and tz >= trail:
+            w.write(0b10, 2)
+            w.write(xor >> trail, 64 - lead - trail)
+        else:
+            lead, trail = lz, tz
+            sig = 64 - lead - trail
+            w.write(0b11, 2)
+            w.write(lead, 5)
+            w.write(sig - 1, 6)
+            w.write(xor >> trail, sig)
+    return _HDR.pack(VERSION, count) + w.getvalue()
+
+
+def decode(blob: bytes) -> Tuple[List[int], List[float]]:
+    """Decodifica un blocco in liste di timestamp e valori."""
+    version, count = _HDR.unpack_from(blob, 0)
+    if version != VERSION:
+        raise ValueError(f"versione blocco non supportata: {version}")
+    if not count:
+        return [], []
+    r = _BitReader(blob, _HDR.size)
+    t = r.read(64)
+    if t >= 1 << 63:
+        t -= 1 << 64
+    v = r.read(64)
+    ts = [t]
+    raw = [v]
+    delta = 0
+    lead = trail = 0
+    read, bit = r.read, r.bit
+    for _ in range(1, count):
+        if not bit():
+            dod = 0
+        elif not bit():
+            dod = read(7) - 63
+        elif not bit():
+            dod = read(9) - 255
+        elif not bit():
+            dod = read(12) - 2047
+        else:
+            dod = read(64)
+            if dod >= 1 << 63:
+                dod -= 1 << 64
+        delta += dod
+        t += delta
+        ts.append(t)
+
+        if bit():
+            if bit():
+                lead = read(5)
+                trail = 64 - lead - (read(6) + 1)
+            v ^= read(64 - lead - trail) << trail
+        raw.append(v)
+    unpack = struct.Struct(f"<{count}d").unpack
+    return ts, list(unpack(struct.pack(f"<{count}Q", *raw)))
+
+
+def compact(storage: Storage, before_ts: int) -> int:
+    """Comprime le ore intere precedenti a ``before_ts`` in ``telemetry_blocks``.
+
+    Elabora un'ora di una coppia nodo/metrica per transazione. Restituisce il
+    numero di campioni compressi; 0 finché ci sono backfill pendenti, che
+    devono ancora correggere righe di ``telemetry`` (ts, nomi delle metriche)
+    non più modificabili una volta nei blocchi. Si ferma anche durante un
+    export (vedi ``Storage.hold_tiers``).
+    """
+    if storage.pending_backfills() or storage.tier_holds:
+        return 0
+    before_ts -= before_ts % HOUR
+    db = storage.conn
+    with storage.lock:
+        pairs = db.execute(
+            "SELECT node_id, metric, MIN(ts) FROM telemetry WHERE ts < ? GROUP BY node_id, metric",
+            (before_ts,),
+        ).fetchall()
+
+    packed = 0
+    for node_id, metric, first_ts in pairs:
+        if node_id is None:
+            continue
+        cursor: Optional[int] = first_ts
+        while cursor is not None and cursor < before_ts:
+            start = cursor - cursor % HOUR
+            end = start + HOUR
+            with storage.lock:
+                if storage.tier_holds:
+                    return packed
+                rows = db.execute(
+                    """
+                    SELECT ts, value, node_name FROM telemetry
+                    WHERE node_id = ? AND metric = ? AND ts >= ? AND ts < ?
+                    ORDER BY ts
+                    """,
+                    (node_id, metric, start, end),
+                ).fetchall()
+                old = db.execute(
+                    "SELECT data FROM telemetry_blocks WHERE node_id=? AND metric=? AND hour_ts=?",
+                    (node_id, metric, start),
+                ).fetchone()
+                ts = [int(r[0]) for r in rows]
+                vals = [float(r[1]) for r in rows]
+                if old:
+                    o_ts, o_vals = decode(old[0])
+                    merged = sorted(zip(o_ts + ts, o_vals + vals), key=lambda p: p[0])
+                    ts = [p[0] for p in merged]
+                    vals = [p[1] for p in merged]
+                node_name = next((r[2] for r in reversed(rows) if r[2]), None)
+                db.execute(
+                    """
+                    INSERT INTO telemetry_blocks(node_id, metric, hour_ts, first_ts, last_ts, count, node_name, data)
+                    VALUES(?,?,?,?,?,?,?,?)
+                    ON CONFLICT(node_id, metric, hour_ts) DO UPDATE SET
+                      first_ts = excluded.first_ts,
+                      last_ts = excluded.last_ts,
+                      count = excluded.count,
+                      node_name = COALESCE(excluded.node_name, telemetry_blocks.node_name),
+                      data = excluded.data
+                    """,
+                    (node_id, metric, start, ts[0], ts[-1], len(ts), node_name, encode(ts, vals)),
+                )
+                db.execute(
+                    "DELETE FROM telemetry WHERE node_id = ? AND metric = ? AND ts >= ? AND ts < ?",
+                    (node_id, metric, start, end),
+                )
+                db.commit()
+                # i campioni cambiano livello: ETag e cache delle metriche vanno rinnovati
+                storage.touch("telemetry", node_id=node_id)
+                cursor = db.execute(
+                    "SELECT MIN(ts) FROM telemetry WHERE node_id = ? AND metric = ? AND ts >= ? AND ts < ?",
+                    (node_id, metric, end, before_ts),
+                ).fetchone()[0]
+            packed += len(rows)
+    return packed
+
+
+def select(
+    db: sqlite3.Connection,
+    since_ts: int,
+    node_ids: Optional[List[str]] = None,
+    until_ts: Optional[int] = None,
+) -> List[Tuple]:
+    """Righe grezze dei blocchi della finestra; va chiamato con il lock acquisito.
+
+    Serve a chi legge più livelli di storage nella stessa presa del lock (vedi
+    :func:`read` per l'uso normale); le righe si decodificano con :func:`blocks`.
+    """
+    params: List = [since_ts]
+    where = "last_ts >= ?"
+    if until_ts is not None:
+        where += " AND first_ts < ?"
+        params.append(until_ts)
+    if node_ids:
+        where += f" AND node_id IN ({','.join('?' for _ in node_ids)})"
+        params.extend(node_ids)
+    return db.execute(
+        f"""
+        SELECT node_id, node_name, metric, first_ts, last_ts, data FROM telemetry_blocks
+        WHERE {where} ORDER BY hour_ts
+        """,
+        params,
+    ).fetchall()
+
+
+def blocks(rows: List[Tuple], since_ts: int, until_ts: Optional[int] = None) -> Iterator[Block]:
+    """Decodifica e ritaglia le righe restituite da :func:`select`."""
+    for node_id, node_name, metric, first_ts, last_ts, data in rows:
+        ts, vals = decode(data)
+        if first_ts < since_ts or (until_ts is not None and last_ts >= until_ts):
+            keep = [i for i, t in enumerate(ts) if t >= since_ts and (until_ts is None or t < until_ts)]
+            ts = [ts[i] for i in keep]
+            vals = [vals[i] for i in keep]
+        if ts:
+            yield node_id, node_name, metric, ts, vals
+
+
+def read(
+    storage: Storage,
+    since_ts: int,
+    node_ids: Optional[List[str]] = None,
+    until_ts: Optional[int] = None,
+) -> Iterator[Block]:
+    """Itera sui blocchi della finestra, già decodificati e ritagliati."""
+    with storage.lock:
+        rows = select(storage.conn, since_ts, node_ids, until_ts)
+    yield from blocks(rows, since_ts, until_ts)
+
+
+def start_compactor(storage: Storage, interval: int = 600) -> threading.Thread:
+    """Comprime periodicamente le ore chiuse."""
+
+    def run():
+        while True:
+            try:
+                packed = compact(storage, int(time.time()))
+                if packed:
+                    print(f"[BLOCKS] Compressi {packed} campioni")
+            except Exception as e:
+                print(f"[BLOCKS] Compressione fallita: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="telemetry-compactor", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,160 @@
+"""Asset statici con nome hashato e versioni precompresse.
+
+``python webassets.py`` (eseguito anche da ``MeshPlotter.spec``) copia JS,
+CSS e SVG di ``static/`` in ``static/dist/`` come ``nome.<hash>.ext``, con
+accanto ``.gz`` e, se ``brotli`` è installato, ``.br``; l'elenco finisce in
+``static/dist/manifest.json``.
+
+A runtime :class:`AssetStore` legge il manifest, riscrive i riferimenti
+``/static/<nome>`` delle pagine HTML verso ``/assets/<nome hashato>`` e serve
+quei file con ``Cache-Control: immutable`` scegliendo la variante compressa
+accettata dal client. Le voci il cui sorgente è cambiato dopo la build sono
+ignorate: quei file restano serviti da ``/static`` come prima.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+from typing import Dict, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    brotli = None
+
+import compress
+
+EXTENSIONS = (".js", ".css", ".svg")
+DIST = "dist"
+MANIFEST = "manifest.json"
+IMMUTABLE = "public, max-age=31536000, immutable"
+MEDIA_TYPES = {".js": "text/javascript", ".css": "text/css", ".svg": "image/svg+xml"}
+# suffisso del file precompresso per codifica
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hashed_name(name: str, digest: str) -> str:
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest[:10]}{ext}"
+
+
+def build(static_dir: str = "static") -> Dict[str, Dict[str, str]]:
+    """Genera ``static/dist`` e restituisce il manifest."""
+    out_dir = os.path.join(static_dir, DIST)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest: Dict[str, Dict[str, str]] = {}
+    for name in sorted(os.listdir(static_dir)):
+        src = os.path.join(static_dir, name)
+        if not os.path.isfile(src) or not name.endswith(EXTENSIONS):
+            continue
+        with open(src, "rb") as f:
+            data = f.read()
+        digest = _digest(data)
+        target = hashed_name(name, digest)
+        with open(os.path.join(out_dir, target), "wb") as f:
+            f.write(data)
+        # mtime fisso: build ripetute producono gli stessi byte
+        with open(os.path.join(out_dir, target + ".gz"), "wb") as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(os.path.join(out_dir, target + ".br"), "wb") as f:
+                f.write(brotli.compress(data, quality=11))
+        manifest[name] = {"file": target, "sha256": digest}
+    # via le build precedenti
+    keep = {MANIFEST} | {e["file"] + s for e in manifest.values() for s in ("", ".gz", ".br")}
+    for name in os.listdir(out_dir):
+        if name not in keep:
+            os.remove(os.path.join(out_dir, name))
+    with open(os.path.join(out_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    print(f"[ASSETS] {len(manifest)} asset in {out_dir} (brotli: {'sì' if brotli is not None else 'no'})")
+    return manifest
+
+
+class AssetStore:
+    """Manifest caricato all'avvio: URL hashati e file precompressi."""
+
+    def __init__(self, static_dir: str = "static") -> None:
+        self.static_dir = static_dir
+        self.dist_dir = os.path.join(static_dir, DIST)
+        self.urls: Dict[str, str] = {}
+        self.files: Dict[str, str] = {}
+        self._html: Dict[str, Tuple[float, bytes, str]] = {}
+        self.load()
+
+    def load(self) -> None:
+        self.urls.clear()
+        self.files.clear()
+        self._html.clear()
+        try:
+            with open(os.path.join(self.dist_dir, MANIFEST), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        stale = []
+        for name, entry in manifest.items():
+            try:
+                with open(os.path.join(self.static_dir, name), "rb") as f:
+                    current = _digest(f.read())
+            except OSError:
+                continue
+            if current != entry.get("sha256") or not os.path.isfile(os.path.join(self.dist_dir, entry["file"])):
+                stale.append(name)
+                continue
+            self.urls[name] = f"/assets/{entry['file']}"
+            self.files[entry["file"]] = name
+        if stale:
+            print(f"[ASSETS] manifest non aggiornato per {', '.join(stale)}: esegui python webassets.py")
+
+    def rewrite(self, html: str) -> str:
+        """Sostituisce ``/static/<nome>`` con l'URL hashato, se presente nel manifest."""
+        if not self.urls:
+            return html
+        return re.sub(
+            r"/static/([\w.\-]+)",
+            lambda m: self.urls.get(m.group(1), m.group(0)),
+            html,
+        )
+
+    def page(self, name: str) -> Tuple[bytes, str]:
+        """Corpo HTML riscritto e relativo ETag, ricaricati se il file cambia."""
+        path = os.path.join(self.static_dir, name)
+        mtime = os.stat(path).st_mtime
+        cached = self._html.get(name)
+        if cached is None or cached[0] != mtime:
+            with open(path, "r", encoding="utf-8") as f:
+                body = self.rewrite(f.read()).encode("utf-8")
+            cached = (mtime, body, f'"{_digest(body)[:16]}"')
+            self._html[name] = cached
+        return cached[1], cached[2]
+
+    def lookup(self, filename: str, accept_encoding: str) -> Optional[Tuple[str, str, Optional[str]]]:
+        """``(percorso, media type, codifica)`` del file hashato più adatto al client."""
+        if filename not in self.files:
+            return None
+        path = os.path.join(self.dist_dir, filename)
+        available = [enc for enc, suffix in SUFFIXES.items() if os.path.isfile(path + suffix)]
+        encoding = compress.choose(accept_encoding, available) if accept_encoding else None
+        media_type = MEDIA_TYPES.get(os.path.splitext(filename)[1], "application/octet-stream")
+        if encoding is not None:
+            return path + SUFFIXES[encoding], media_type, encoding
+        return path, media_type, None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--static", default="static", help="cartella degli asset")
+    args = parser.parse_args()
+    build(args.static)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())